@@ -22,6 +22,24 @@ def create_app(config=Config):
     db.init_app(app)
     migrate.init_app(app, db)
 
+    from app import serialize
+    serialize.init_app(app)
+
+    from app import compress
+    compress.init_app(app)
+
+    from app import registry
+    registry.init_app(app)
+
+    from app import limiter
+    limiter.init_app(app)
+
+    from app import virtual
+    virtual.init_app(app)
+
+    from app import rules
+    rules.init_app(app)
+
     # blueprint registering
     from app.main import bp as bp_main
     app.register_blueprint(bp_main)
@@ -32,6 +50,9 @@ def create_app(config=Config):
     from app.api import bp as bp_api
     app.register_blueprint(bp_api, url_prefix='/api')
 
+    from app.cli import bp as bp_cli
+    app.register_blueprint(bp_cli)
+
     return app
 
 if Config.SQLALCHEMY_DATABASE_URI.startswith("sqlite"):
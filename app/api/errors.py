@@ -16,3 +16,10 @@ def bad_request(message=None):
 
 def unauthorized(message=None):
     return error_response(401, message)
+
+
+def too_many_requests(message=None, retry_after=None):
+    response = error_response(429, message)
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+    return response
@@ -0,0 +1,67 @@
+from app import models, query, serialize
+from app.api import bp
+from app.api.errors import bad_request
+from flask import current_app, request
+
+
+@bp.route("/query", methods=["POST"])
+def query_post():
+    """ Runs several sensor and reading queries at once, see app.query
+
+    Overlapping reading ranges of the same sensors are read by one scan.
+
+    Request Header:
+        Content-Type: application/json
+
+    Request Args:
+        queries: list of sub-queries, either
+            {"type" : "sensor", "filter" : {column name : list of values}}, like GET /api/sensor
+            {"type" : "reading", "sensor_id" : list of ids, "days", "minutes", "start", "end"},
+            like GET /api/sensor/reading
+
+    Returns:
+        response: JSON list with the result of every sub-query, in order
+    """
+    data = request.get_json() or {}
+    queries = data.get("queries") if isinstance(data, dict) else None
+    if not isinstance(queries, list) or len(queries) == 0:
+        return bad_request("'queries' needs to be a non empty list")
+    if len(queries) > current_app.config["QUERY_MAX_QUERIES"]:
+        return bad_request("At most {} queries are allowed".format(
+            current_app.config["QUERY_MAX_QUERIES"]))
+
+    plan = query.ReadingPlan()
+    # per sub-query: list of sensors or index of the reading plan
+    results = []
+    for i, sub in enumerate(queries):
+        try:
+            if not isinstance(sub, dict):
+                raise ValueError("Query needs to be an object")
+            if sub.get("type") == "sensor":
+                filters = sub.get("filter") or {}
+                if not isinstance(filters, dict):
+                    raise ValueError("'filter' needs to be an object")
+                results.append(query.filter_sensors(filters))
+            elif sub.get("type") == "reading":
+                ids = sub.get("sensor_id") or []
+                if not isinstance(ids, list):
+                    ids = [ids]
+                sensors = query.lookup_sensors(ids)
+                start, end = query.parse_window(sub)
+                results.append(plan.add(sensors, start, end))
+            else:
+                raise ValueError("'type' needs to be 'sensor' or 'reading'")
+        except ValueError as e:
+            return bad_request("Query {}: {}".format(i, e))
+
+    plan.execute()
+
+    provider = current_app.extensions["json_provider"]
+    columns = (models.SensorReading.datetime, models.SensorReading.value)
+    parts = []
+    for result in results:
+        if isinstance(result, int):
+            parts.append(provider.dumps_rows(columns, plan.result(result)))
+        else:
+            parts.append(provider.dumps({s.id : s.to_dict() for s in result}))
+    return serialize.raw_response(serialize.dumps_array(parts))
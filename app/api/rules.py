@@ -0,0 +1,174 @@
+from app import db, models, registry, rules
+from app.api import bp
+from app.api.errors import bad_request
+from app.serialize import jsonify
+from flask import request
+
+# virtual sensors have no posted readings to evaluate
+VIRTUAL_SENSOR = "Sensor {} is virtual, rules need a sensor with readings"
+
+# maximum events per request
+EVENT_LIMIT = 1000
+
+
+@bp.route("/rule")
+def rule_get():
+    """ route for rule get request
+
+    Request Args:
+        sensor_id[]: only rules of these sensors
+
+    Returns:
+        response: JSON object of all rules
+    """
+    q = models.Rule.query
+    sensor_ids = request.args.getlist("sensor_id[]")
+    if len(sensor_ids) > 0:
+        q = q.filter(models.Rule.sensor_id.in_(sensor_ids))
+
+    # {id : rule_object}
+    return jsonify({r.id : r.to_dict() for r in q.all()})
+
+
+@bp.route("/rule", methods=["POST"])
+def rule_post():
+    """ Adding rules, see app.rules for the kinds of rules
+
+    Request Header:
+        Content-Type: application/json
+
+    Request Args:
+        any valid columns and values of rule object
+
+    Returns:
+        response: JSON object of new rule
+    """
+    data = request.get_json() or {}
+
+    for key in data.keys():
+        if not key in models.Rule.column_names():
+            return bad_request("Column does not exist: '{}'".format(key))
+        if key in rules.STATE_COLUMNS:
+            return bad_request("Column is read only: '{}'".format(key))
+    sensor = registry.sensor(data.get("sensor_id"))
+    if sensor is None:
+        return bad_request("'sensor_id' not set or invalid: '{}'".format(data.get("sensor_id")))
+    if sensor.expression is not None:
+        return bad_request(VIRTUAL_SENSOR.format(sensor.id))
+    try:
+        rules.validate(data)
+    except ValueError as e:
+        return bad_request(str(e))
+
+    rule = models.Rule(**data)
+    db.session.add(rule)
+    try:
+        rules.seed(rule)
+        rules.reload()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return bad_request("Could not create rule: '{}'".format(e))
+
+    return jsonify(rule.to_dict())
+
+
+@bp.route("/rule/<int:id>", methods=["DELETE"])
+def rule_delete(id):
+    """ delete rule and its events
+
+    Args:
+        id (int): id of rule
+    """
+    rule = models.Rule.query.get(id)
+    if rule is None:
+        return bad_request("Rule with id {} does not exist".format(id))
+
+    db.session.delete(rule)
+    try:
+        rules.reload()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return bad_request("Could not delete rule: '{}'".format(e))
+
+    return "", 200
+
+
+@bp.route("/rule/<int:id>", methods=["PUT"])
+def rule_put(id):
+    """ change rule, its state is reset if more than the name changed
+
+    Args:
+        id (int): id of rule
+
+    Request Header:
+        Content-Type: application/json
+
+    Request Args:
+        any valid rule column names and values
+    """
+    data = request.get_json() or {}
+
+    rule = models.Rule.query.get(id)
+    if rule is None:
+        return bad_request("Rule with id {} does not exist".format(id))
+
+    for key in data.keys():
+        if not key in rule.column_names():
+            return bad_request("Column does not exist: '{}'".format(key))
+        if key in rules.STATE_COLUMNS:
+            return bad_request("Column is read only: '{}'".format(key))
+    if "sensor_id" in data:
+        sensor = registry.sensor(data["sensor_id"])
+        if sensor is None:
+            return bad_request("'sensor_id' invalid: '{}'".format(data["sensor_id"]))
+        if sensor.expression is not None:
+            return bad_request(VIRTUAL_SENSOR.format(sensor.id))
+    try:
+        rules.validate(dict(rule.to_dict(), **data))
+    except ValueError as e:
+        return bad_request(str(e))
+
+    # changed conditions reset the state
+    reset = any(value != getattr(rule, key) for key, value in data.items() if key != "name")
+    rule.update(**data)
+    try:
+        if reset:
+            rules.seed(rule)
+        rules.reload()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return bad_request("Could not update rule: '{}'".format(e))
+
+    return jsonify(rule.to_dict())
+
+
+@bp.route("/rule/event")
+def rule_event_get():
+    """ Fired rule events, oldest first
+
+    Automations poll with the id of the last seen event as 'since'.
+
+    Request Args:
+        since: only events with a greater id
+        limit: maximum number of events, clamped to 1..1000, defaults to 1000
+        rule_id[]: only events of these rules
+
+    Returns:
+        response: JSON list of events
+    """
+    try:
+        since = int(request.args.get("since", 0))
+        limit = int(request.args.get("limit", EVENT_LIMIT))
+        rule_ids = [int(i) for i in request.args.getlist("rule_id[]")]
+    except ValueError:
+        return bad_request("'since', 'limit' and 'rule_id' need to be integers")
+    limit = min(max(limit, 1), EVENT_LIMIT)
+
+    q = models.RuleEvent.query.filter(models.RuleEvent.id > since)
+    if len(rule_ids) > 0:
+        q = q.filter(models.RuleEvent.rule_id.in_(rule_ids))
+    events = q.order_by(models.RuleEvent.id).limit(limit).all()
+    return jsonify([e.to_dict() for e in events])
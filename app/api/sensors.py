@@ -1,10 +1,18 @@
 from datetime import datetime, timedelta
 import time
 
-from app import db, models
+from app import archive, db, limiter, models, query, registry, rules, serialize, tiles, virtual
 from app.api import bp
-from app.api.errors import bad_request
-from flask import jsonify, request
+from app.api.errors import bad_request, too_many_requests
+from app.serialize import jsonify
+from flask import current_app, request
+import sqlalchemy as sa
+
+# (sensor_id, datetime) keys per statement, two bound parameters each
+READING_KEY_CHUNK_SIZE = 400
+
+# readings in the range of a chunk, see archive.find_archived
+ARCHIVED = "Reading of sensor {} at {} is in the archived range, it can not be stored"
 
 
 @bp.route("/sensor")
@@ -28,8 +36,12 @@ def sensor_get():
     for col, values in mapper.items():
         if len(values) > 0:
             q = q.filter(col.in_(values))
-    
-    sensors = q.all()
+
+    # unfiltered from the registry, without db round trip
+    if any(len(values) > 0 for values in mapper.values()):
+        sensors = q.all()
+    else:
+        sensors = registry.sensors().values()
 
     # {id : sensor_object}
     return jsonify({s.id : s.to_dict() for s in sensors})
@@ -62,9 +74,22 @@ def sensor_post():
         if not key in models.Sensor.column_names():
             return bad_request("Column does not exist: '{}'".format(key))
 
+    # virtual sensor
+    if data.get("expression") is not None:
+        try:
+            virtual.validate(data.get("id"), data["expression"])
+        except ValueError as e:
+            return bad_request(str(e))
+    if data.get("rate_limit") is not None:
+        try:
+            data["rate_limit"] = _parse_rate_limit(data["rate_limit"])
+        except ValueError as e:
+            return bad_request(str(e))
+
     sensor = models.Sensor(**data)
     db.session.add(sensor)
     try:
+        registry.changed()
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -73,6 +98,17 @@ def sensor_post():
     return jsonify(sensor.to_dict())
 
 
+def _parse_rate_limit(value):
+    # the sensor forms post strings
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("'rate_limit' needs to be a number")
+    if not value >= 0:
+        raise ValueError("'rate_limit' needs to be positive or 0")
+    return value
+
+
 @bp.route("/sensor/<int:id>", methods=["DELETE"])
 def sensor_delete(id):
     """ sensor delete
@@ -89,10 +125,14 @@ def sensor_delete(id):
 
     db.session.delete(sensor)
     try:
+        # rules of the sensor are deleted aswell
+        registry.changed()
+        rules.reload()
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         return bad_request("Could not delete sensor: '{}'".format(e))
+    virtual.invalidate()
     return "", 200
 
 
@@ -119,15 +159,34 @@ def sensor_put(id):
         if not key in sensor.column_names():
             return bad_request("Column does not exist: '{}'".format(key))
 
+    # virtual sensor
+    if data.get("expression") is not None:
+        try:
+            virtual.validate(data.get("id", id), data["expression"])
+        except ValueError as e:
+            return bad_request(str(e))
+        # rules are evaluated on posted readings only
+        if len(sensor.rules) > 0:
+            return bad_request("Sensor {} has rules, it can not become virtual".format(id))
+    if data.get("rate_limit") is not None:
+        try:
+            data["rate_limit"] = _parse_rate_limit(data["rate_limit"])
+        except ValueError as e:
+            return bad_request(str(e))
+
     # set new values
     sensor.update(**data)
 
     try:
+        # changed ids cascade to rules
+        registry.changed()
+        rules.reload()
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         return bad_request("Could not update sensor: '{}'".format(e))
 
+    virtual.invalidate()
     return jsonify(sensor.to_dict())
 
 
@@ -139,45 +198,75 @@ def sensor_reading_get():
         sensor_id[]: one or more sensor ids
         days: number of days behind to retrieve data up to
         minutes: number of minutes behind to retrieve data up to
+        start: utc timestamp, absolute range start, replaces days and minutes
+        end: utc timestamp, absolute range end (inclusive), open if not given
 
     Returns:
         response: JSON object of sensors_id keys and minimal reading values
     """
-    # grab sensor_id[] arguments and deduplicate
+    # check for invalid ids and deduplicate, if no ids given, grab all sensors
+    try:
+        sensors = query.lookup_sensors(request.args.getlist("sensor_id[]"))
+        start, end = query.parse_window(request.args)
+    except ValueError as e:
+        return bad_request(str(e))
+
+    # includes archived readings and virtual sensors, see app.archive and app.virtual
+    data = ((s.id, virtual.sensor_readings_between(s, start, end)) for s in sensors)
+
+    # minimal sensor reading entries, straight from (datetime, value) rows
+    return serialize.rows_response(
+        (models.SensorReading.datetime, models.SensorReading.value), data)
+
+
+@bp.route("/sensor/reading/tile")
+def sensor_reading_tile():
+    """ route for downsampled, zoom level aligned reading tiles, see app.tiles
+
+    Request Args:
+        sensor_id[]: one or more sensor ids
+        level: zoom level, tile span is TILE_BASE_SECONDS * 2**level
+        index: tile index, tile starts at index * span seconds after the epoch
+
+    Returns:
+        response: JSON object of sensor_id keys and lists of datetime, value (mean),
+            min and max entries
+    """
     ids = request.args.getlist("sensor_id[]")
     try:
         ids = {int(id) for id in ids}
-    except TypeError:
-        return bad_request("sensor_id needs to be integers")
-
-    # check for invalid ids
-    for id in ids:    
-        if models.Sensor.query.get(id) is None:
+        level = int(request.args.get("level", 0))
+        index = int(request.args["index"])
+    except (KeyError, ValueError):
+        return bad_request("'sensor_id', 'level' and 'index' need to be integers")
+
+    config = current_app.config
+    if not 0 <= level <= config["TILE_MAX_LEVEL"]:
+        return bad_request("'level' needs to be between 0 and {}".format(config["TILE_MAX_LEVEL"]))
+    sensors = []
+    for id in ids:
+        sensor = registry.sensor(id)
+        if sensor is None:
             return bad_request("Unknown sensor id {}".format(id))
-        
-    # if no ids given, grab all ids
-    if len(ids) == 0:
-        ids = [s.id for s in models.Sensor.query.all()]
-
-    days = request.args.get("days", 0)
-    minutes = request.args.get("minutes", 0)
+        sensors.append(sensor)
     try:
-        days = float(days)
-        minutes = float(minutes)
-    except ValueError:
-        return bad_request("'days' and 'minutes' need to be numbers")
-    start = datetime.utcnow() - timedelta(days=days, minutes=minutes)
+        start, end = tiles.tile_range(level, index, config["TILE_BASE_SECONDS"])
+    except OverflowError:
+        return bad_request("'index' out of range")
 
-    data = {}
-    for id in ids:
-        readings = models.SensorReading.query.filter(
-            models.SensorReading.sensor_id == id).filter(
-            models.SensorReading.datetime >= start).order_by(
-            models.SensorReading.datetime.asc()).all()
-        # generate minimal sensor reading entries
-        data[id] = [r.to_dict("value", "datetime") for r in readings]
+    data = ((s.id, tiles.downsample(
+        virtual.sensor_readings_between(s, start, end), start, end, config["TILE_POINTS"]))
+        for s in sensors)
+    response = serialize.rows_response((models.SensorReading.datetime,
+        models.SensorReading.value, sa.column("min", sa.Float), sa.column("max", sa.Float)), data)
 
-    return jsonify(data)
+    # tiles of the past do not change anymore
+    if end < datetime.utcnow():
+        response.cache_control.public = True
+        response.cache_control.max_age = config["TILE_MAX_AGE"]
+    else:
+        response.cache_control.no_cache = True
+    return response
 
 
 @bp.route("/sensor/reading/columns")
@@ -191,20 +280,34 @@ def sensor_reading_columns():
 def sensor_reading_post():
     """ create new sensor readings
 
+    Readings are unique by (sensor_id, datetime), so retried requests do not
+    create duplicates. The whole batch is written by one upsert statement.
+
     Request Header:
         Content-Type: application/json
 
     Request Args:
         any valid sensor reading column names and values as single obj or list of obj
+        on_conflict: "ignore" or "overwrite" existing readings, defaults to READING_CONFLICT
+
+    Returns:
+        response: JSON list of the stored readings
     """
     data = request.get_json() or {}
 
+    on_conflict = request.args.get("on_conflict", current_app.config["READING_CONFLICT"])
+    if on_conflict not in ("ignore", "overwrite"):
+        return bad_request("'on_conflict' needs to be 'ignore' or 'overwrite'")
+
     # convert dict to list of single dict
     if not isinstance(data, list):
         data = [data]
 
     readings = []
+    last_default = None
     for reading_dict in data:
+        if not isinstance(reading_dict, dict):
+            return bad_request("Readings need to be objects")
         # check if all arguments in json data can be set
         for key in reading_dict.keys():
             if not key in models.SensorReading.column_names():
@@ -212,9 +315,13 @@ def sensor_reading_post():
 
         # check if sensor_id exists
         sensor_id = reading_dict.get("sensor_id")
-        sensor = models.Sensor.query.get(sensor_id)
+        sensor = registry.sensor(sensor_id)
         if sensor_id is None or sensor is None:
             return bad_request("'sensor_id' not set or invalid: '{}'".format(sensor_id))
+        if sensor.expression is not None:
+            return bad_request("Sensor {} is virtual, it has no readings to post".format(sensor_id))
+        # numeric strings are accepted, the posted keys are compared with the stored ones
+        reading_dict["sensor_id"] = sensor.id
 
         # if datetime timestamp is given, try to convert
         if "datetime" in reading_dict:
@@ -223,19 +330,243 @@ def sensor_reading_post():
                 reading_dict["datetime"] = datetime.fromtimestamp(timestamp)
             except TypeError as e:
                 return bad_request("Could not convert given datetime timestamp: '{}'".format(timestamp))
+        else:
+            # readings without datetime of one batch must not collide
+            now = datetime.utcnow()
+            if last_default is not None and now <= last_default:
+                now = last_default + timedelta(microseconds=1)
+            reading_dict["datetime"] = last_default = now
+
+        readings.append(reading_dict)
 
-        # create new reading
-        r = models.SensorReading(**reading_dict)
-        readings.append(r)
+    # backpressure, after the validation by the registry and before any db work,
+    # so rejected batches take no tokens
+    retry_after = limiter.check_readings(readings)
+    if retry_after is not None:
+        return too_many_requests("Rate limit of sensor readings exceeded", retry_after)
+
+    archived = archive.find_archived((r["sensor_id"], r["datetime"]) for r in readings)
+    if len(archived) > 0:
+        return bad_request(ARCHIVED.format(*archived[0]))
 
-    db.session.add_all(readings)
     try:
+        models.SensorReading.upsert(readings, on_conflict)
+        # backfilled readings
+        virtual.changed({r["sensor_id"] for r in readings}, min(r["datetime"] for r in readings))
+        # alert rules, in the same transaction as their readings
+        events = rules.ingest((r["sensor_id"], r["datetime"], r.get("value")) for r in readings)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         return bad_request("Could not create sensor reading(s): '{}'".format(e))
-    
-    return jsonify([r.to_dict() for r in readings])
+    rules.notify(events)
+
+    # stored readings, including the already existing ones of retries. only the
+    # posted keys are read, by the unique index
+    keys = list(dict.fromkeys((r["sensor_id"], r["datetime"]) for r in readings))
+    key_column = sa.tuple_(models.SensorReading.sensor_id, models.SensorReading.datetime)
+    stored = {}
+    for i in range(0, len(keys), READING_KEY_CHUNK_SIZE):
+        for r in models.SensorReading.query.filter(
+                key_column.in_(keys[i:i + READING_KEY_CHUNK_SIZE])):
+            stored[(r.sensor_id, r.datetime)] = r
+
+    return jsonify([stored[key].to_dict() for key in keys if key in stored])
+
+
+def _parse_dry_run(value):
+    # bool("false") is True
+    if value in (True, False, 0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in ("true", "false", "1", "0"):
+        return value.lower() in ("true", "1")
+    raise ValueError("'dry_run' needs to be true or false")
+
+
+def _is_number(value):
+    # json booleans are ints in python
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _parse_reading_filter(data):
+    """ Parses the sensor and time range filter of bulk requests
+
+    Args:
+        data (dict): request json with "sensor_id" (int or list), "start" and "end" (utc timestamps)
+
+    Returns:
+        tuple: (sensor_ids or None, start or None, end or None)
+
+    Raises:
+        ValueError: if the filter is empty or invalid
+    """
+    if not any(key in data for key in ("sensor_id", "start", "end")):
+        raise ValueError("At least one of 'sensor_id', 'start' or 'end' is required")
+
+    sensor_ids = data.get("sensor_id")
+    if sensor_ids is not None:
+        if not isinstance(sensor_ids, list):
+            sensor_ids = [sensor_ids]
+        if not all(isinstance(id, int) and not isinstance(id, bool) for id in sensor_ids):
+            raise ValueError("sensor_id needs to be integers")
+        for id in sensor_ids:
+            if registry.sensor(id) is None:
+                raise ValueError("Unknown sensor id {}".format(id))
+
+    if any(data.get(key) is not None and not _is_number(data[key]) for key in ("start", "end")):
+        raise ValueError("'start' and 'end' need to be timestamps")
+    try:
+        start, end = (None if data.get(key) is None else datetime.utcfromtimestamp(data[key])
+            for key in ("start", "end"))
+    except (ValueError, OverflowError, OSError):
+        raise ValueError("'start' and 'end' need to be timestamps")
+
+    return sensor_ids, start, end
+
+
+def _bulk_execute(sensor_ids, start, end, statement, dry_run):
+    """ Executes a set based statement on matching readings, chunked by id ranges
+
+    Every chunk of BULK_CHUNK_SIZE rows is committed on its own, so other
+    writers are not blocked for the whole operation.
+
+    Args:
+        sensor_ids, start, end: filter, see _parse_reading_filter
+        statement (callable): function(where clause) -> sqlalchemy statement
+        dry_run (bool): only count the matching readings
+
+    Returns:
+        int: number of affected readings
+    """
+    table = models.SensorReading.__table__
+    conditions = []
+    if sensor_ids is not None:
+        conditions.append(table.c.sensor_id.in_(sensor_ids))
+    if start is not None:
+        conditions.append(table.c.datetime >= start)
+    if end is not None:
+        conditions.append(table.c.datetime <= end)
+    where = sa.and_(*conditions)
+
+    if dry_run:
+        return db.session.execute(
+            sa.select(sa.func.count()).select_from(table).where(where)).scalar()
+
+    chunk_size = current_app.config["BULK_CHUNK_SIZE"]
+    affected = 0
+    last_id = 0
+    while True:
+        ids = db.session.execute(sa.select(table.c.id).where(where).where(
+            table.c.id > last_id).order_by(table.c.id).limit(chunk_size)).scalars().all()
+        if len(ids) == 0:
+            break
+        result = db.session.execute(statement(sa.and_(where, table.c.id.between(ids[0], ids[-1]))))
+        db.session.commit()
+        affected += result.rowcount
+        last_id = ids[-1]
+    return affected
+
+
+@bp.route("/sensor/reading", methods=["DELETE"])
+def sensor_reading_bulk_delete():
+    """ delete all sensor readings matching a filter, including archived readings
+
+    Request Header:
+        Content-Type: application/json
+
+    Request Args:
+        sensor_id: sensor id or list of sensor ids
+        start: utc timestamp, inclusive
+        end: utc timestamp, inclusive
+        dry_run: only count the matching readings
+
+    Returns:
+        response: JSON object with number of deleted (live and archived) readings
+    """
+    data = request.get_json() or {}
+    try:
+        sensor_ids, start, end = _parse_reading_filter(data)
+        dry_run = _parse_dry_run(data.get("dry_run", False))
+    except ValueError as e:
+        return bad_request(str(e))
+
+    table = models.SensorReading.__table__
+    try:
+        archived = archive.rewrite_chunks(sensor_ids, start, end,
+            lambda value: archive.DELETE, dry_run)
+        if not dry_run:
+            db.session.commit()
+        count = _bulk_execute(sensor_ids, start, end,
+            lambda where: table.delete().where(where), dry_run)
+    except Exception as e:
+        db.session.rollback()
+        return bad_request("Could not delete sensor readings: '{}'".format(e))
+    finally:
+        # chunks may have been committed before a failure
+        if not dry_run:
+            virtual.changed(sensor_ids, start)
+            db.session.commit()
+
+    return jsonify({"count" : count + archived, "archived" : archived, "dry_run" : dry_run})
+
+
+@bp.route("/sensor/reading", methods=["PUT"])
+def sensor_reading_bulk_put():
+    """ change all sensor readings matching a filter, including archived readings
+
+    Request Header:
+        Content-Type: application/json
+
+    Request Args:
+        sensor_id, start, end, dry_run: filter, see sensor_reading_bulk_delete
+        value: set value of all readings, may be null. not combined with scale and offset
+        scale: multiply values by scale, applied before offset
+        offset: add offset to values
+
+    Returns:
+        response: JSON object with number of changed (live and archived) readings
+    """
+    data = request.get_json() or {}
+    try:
+        sensor_ids, start, end = _parse_reading_filter(data)
+        dry_run = _parse_dry_run(data.get("dry_run", False))
+    except ValueError as e:
+        return bad_request(str(e))
+
+    table = models.SensorReading.__table__
+    if "value" in data and ("scale" in data or "offset" in data):
+        return bad_request("'value' can not be combined with 'scale' or 'offset'")
+    if "value" in data:
+        value = data["value"]
+        if value is not None and not _is_number(value):
+            return bad_request("'value' needs to be a number or null")
+        transform = lambda v: value
+        new_value = value
+    elif "scale" in data or "offset" in data:
+        scale, offset = data.get("scale", 1), data.get("offset", 0)
+        if not all(_is_number(x) for x in (scale, offset)):
+            return bad_request("'scale' and 'offset' need to be numbers")
+        transform = lambda v: None if v is None else v * scale + offset
+        new_value = table.c.value * scale + offset
+    else:
+        return bad_request("One of 'value', 'scale' or 'offset' is required")
+
+    try:
+        archived = archive.rewrite_chunks(sensor_ids, start, end, transform, dry_run)
+        if not dry_run:
+            db.session.commit()
+        count = _bulk_execute(sensor_ids, start, end,
+            lambda where: table.update().where(where).values(value=new_value), dry_run)
+    except Exception as e:
+        db.session.rollback()
+        return bad_request("Could not update sensor readings: '{}'".format(e))
+    finally:
+        # chunks may have been committed before a failure
+        if not dry_run:
+            virtual.changed(sensor_ids, start)
+            db.session.commit()
+
+    return jsonify({"count" : count + archived, "archived" : archived, "dry_run" : dry_run})
 
 
 @bp.route("/sensor/reading/<int:id>", methods=["DELETE"])
@@ -251,6 +582,7 @@ def sensor_reading_delete(id):
 
     db.session.delete(r)
     try:
+        virtual.changed([r.sensor_id], r.datetime)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
@@ -291,9 +623,16 @@ def sensor_reading_put(id):
             return bad_request("Could not convert given datetime timestamp: '{}'".format(timestamp))
 
     # set new data
+    sensor_id, dt = r.sensor_id, r.datetime
     r.update(**data)
+    if (r.sensor_id, r.datetime) != (sensor_id, dt):
+        archived = archive.find_archived([(r.sensor_id, r.datetime)])
+        if len(archived) > 0:
+            db.session.rollback()
+            return bad_request(ARCHIVED.format(*archived[0]))
 
     try:
+        virtual.changed([sensor_id, r.sensor_id], min(dt, r.datetime))
         db.session.commit()
     except Exception as e:
         db.session.rollback()
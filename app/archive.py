@@ -0,0 +1,413 @@
+""" Compressed chunk storage for archived sensor readings
+
+Old readings are packed per sensor into chunks, similar to the Gorilla paper
+(Pelkonen et al., "Gorilla: A Fast, Scalable, In-Memory Time Series Database"):
+
+    timestamps: delta-of-delta, stored in variable width buckets
+    values:     XOR with the previous value, storing only the meaningful bits
+
+Chunk layout (big endian bit stream):
+    count (32 bit), time unit (2 bit), first timestamp (64 bit), first value (64 bit),
+    then per reading: delta-of-delta bucket and XOR encoded value
+
+Timestamps are microseconds since the epoch, scaled down by the coarsest unit
+(second, millisecond, microsecond) that keeps the chunk lossless.
+Null values are stored as NaN, every NaN is decoded as null.
+"""
+from datetime import datetime, timedelta
+from operator import itemgetter
+import math
+import struct
+
+from app import db, models
+from flask import current_app
+
+EPOCH = datetime(1970, 1, 1)
+
+# time unit code -> microseconds
+UNITS = (1000000, 1000, 1)
+
+# delta-of-delta buckets: (control bits, control bit count, value bit count)
+# the first bucket ("0") stores a delta-of-delta of zero
+DOD_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+    (0b11110, 5, 32),
+    (0b11111, 5, 64),
+)
+
+NAN_BITS = 0x7ff8000000000000
+
+# marker returned by rewrite_chunks transformations to remove a reading
+DELETE = object()
+
+_double = struct.Struct(">d")
+_uint64 = struct.Struct(">Q")
+
+
+def _to_microseconds(dt):
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def _float_to_bits(value):
+    if value is None:
+        return NAN_BITS
+    return _uint64.unpack(_double.pack(value))[0]
+
+
+def _bits_to_float(bits):
+    value = _double.unpack(_uint64.pack(bits))[0]
+    return None if math.isnan(value) else value
+
+
+class BitWriter:
+    """ Appends values of arbitrary bit width to a byte buffer
+    """
+    __slots__ = ("_buffer", "_acc", "_nbits")
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._acc = 0
+        self._nbits = 0
+
+    def write(self, value, nbits):
+        self._acc = (self._acc << nbits) | (value & ((1 << nbits) - 1))
+        self._nbits += nbits
+        while self._nbits >= 8:
+            self._nbits -= 8
+            self._buffer.append((self._acc >> self._nbits) & 0xFF)
+        self._acc &= (1 << self._nbits) - 1
+
+    def getvalue(self):
+        """ Returns the written bits as bytes, zero padded to full bytes
+        """
+        if self._nbits > 0:
+            return bytes(self._buffer) + bytes([(self._acc << (8 - self._nbits)) & 0xFF])
+        return bytes(self._buffer)
+
+
+class BitReader:
+    """ Reads values of arbitrary bit width from bytes
+    """
+    __slots__ = ("_data", "_pos")
+
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+
+    def read(self, nbits):
+        start = self._pos >> 3
+        end = (self._pos + nbits + 7) >> 3
+        window = int.from_bytes(self._data[start:end], "big")
+        shift = (end << 3) - self._pos - nbits
+        self._pos += nbits
+        return (window >> shift) & ((1 << nbits) - 1)
+
+    def read_bit(self):
+        bit = (self._data[self._pos >> 3] >> (7 - (self._pos & 7))) & 1
+        self._pos += 1
+        return bit
+
+
+def encode_chunk(readings):
+    """ Packs readings into a compressed chunk
+
+    Args:
+        readings: list of (datetime, value) tuples, sorted by datetime
+
+    Returns:
+        bytes
+    """
+    timestamps = [_to_microseconds(dt) for dt, _ in readings]
+
+    # coarsest unit that keeps every timestamp exact
+    unit_code = 2
+    for code, unit in enumerate(UNITS):
+        if all(t % unit == 0 for t in timestamps):
+            unit_code = code
+            break
+    unit = UNITS[unit_code]
+
+    writer = BitWriter()
+    writer.write(len(readings), 32)
+    writer.write(unit_code, 2)
+    if len(readings) == 0:
+        return writer.getvalue()
+
+    prev_time = timestamps[0] // unit
+    prev_delta = 0
+    prev_bits = _float_to_bits(readings[0][1])
+    prev_lead, prev_trail = 65, 0 # forces a new window for the first xor
+    writer.write(prev_time, 64)
+    writer.write(prev_bits, 64)
+
+    for timestamp, (_, value) in zip(timestamps[1:], readings[1:]):
+        # timestamp
+        time = timestamp // unit
+        delta = time - prev_time
+        dod = delta - prev_delta
+        if dod == 0:
+            writer.write(0, 1)
+        else:
+            for control, control_bits, value_bits in DOD_BUCKETS:
+                if -(1 << (value_bits - 1)) <= dod < (1 << (value_bits - 1)):
+                    writer.write(control, control_bits)
+                    writer.write(dod + (1 << (value_bits - 1)), value_bits)
+                    break
+        prev_time, prev_delta = time, delta
+
+        # value
+        bits = _float_to_bits(value)
+        xor = bits ^ prev_bits
+        prev_bits = bits
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        lead = min(64 - xor.bit_length(), 31)
+        trail = (xor & -xor).bit_length() - 1
+        if lead >= prev_lead and trail >= prev_trail:
+            # meaningful bits fit into the previous window
+            writer.write(0b10, 2)
+            writer.write(xor >> prev_trail, 64 - prev_lead - prev_trail)
+        else:
+            significant = 64 - lead - trail
+            writer.write(0b11, 2)
+            writer.write(lead, 5)
+            writer.write(significant & 63, 6) # 64 is stored as 0
+            writer.write(xor >> trail, significant)
+            prev_lead, prev_trail = lead, trail
+
+    return writer.getvalue()
+
+
+def decode_chunk(data):
+    """ Unpacks a chunk created by encode_chunk
+
+    Args:
+        data (bytes): encoded chunk
+
+    Returns:
+        list: (datetime, value) tuples
+    """
+    reader = BitReader(data)
+    read, read_bit = reader.read, reader.read_bit
+    count = read(32)
+    unit = timedelta(microseconds=UNITS[read(2)])
+    if count == 0:
+        return []
+
+    time = read(64)
+    bits = read(64)
+    delta = 0
+    lead, significant = 0, 64
+    readings = [(EPOCH + time * unit, _bits_to_float(bits))]
+
+    for _ in range(count - 1):
+        # timestamp
+        if read_bit():
+            # count the leading ones of the control prefix, "11111" has no closing zero
+            ones = 1
+            while ones < len(DOD_BUCKETS) and read_bit():
+                ones += 1
+            value_bits = DOD_BUCKETS[ones - 1][2]
+            delta += read(value_bits) - (1 << (value_bits - 1))
+        time += delta
+
+        # value
+        if read_bit():
+            if read_bit():
+                lead = read(5)
+                significant = read(6) or 64
+            bits ^= read(significant) << (64 - lead - significant)
+        readings.append((EPOCH + time * unit, _bits_to_float(bits)))
+
+    return readings
+
+
+def readings_between(sensor_id, start, end=None):
+    """ Returns readings of a sensor, from archived chunks and the reading table
+
+    Only chunks overlapping the requested range are decoded.
+
+    Args:
+        sensor_id (int): id of sensor
+        start (datetime): lower bound, inclusive
+        end (datetime): upper bound, inclusive. no bound if None
+
+    Returns:
+        list: (datetime, value) tuples, sorted by datetime
+    """
+    return readings_between_many([sensor_id], start, end)[sensor_id]
+
+
+def readings_between_many(sensor_ids, start, end=None):
+    """ Returns readings of several sensors in the same range, with one scan of
+    the chunks and one of the reading table
+
+    Args:
+        sensor_ids: ids of sensors
+        start (datetime): lower bound, inclusive
+        end (datetime): upper bound, inclusive. no bound if None
+
+    Returns:
+        dict: {sensor_id : list of (datetime, value) tuples, sorted by datetime}
+    """
+    sensor_ids = list(sensor_ids)
+    chunk_query = models.SensorReadingChunk.query.filter(
+        models.SensorReadingChunk.sensor_id.in_(sensor_ids)).filter(
+        models.SensorReadingChunk.end >= start)
+    reading_query = db.session.query(models.SensorReading.sensor_id,
+        models.SensorReading.datetime, models.SensorReading.value).filter(
+        models.SensorReading.sensor_id.in_(sensor_ids)).filter(
+        models.SensorReading.datetime >= start)
+    if end is not None:
+        chunk_query = chunk_query.filter(models.SensorReadingChunk.start <= end)
+        reading_query = reading_query.filter(models.SensorReading.datetime <= end)
+
+    archived = {id : [] for id in sensor_ids}
+    for chunk in chunk_query.order_by(models.SensorReadingChunk.start.asc()):
+        decoded = decode_chunk(chunk.data)
+        if chunk.start < start or (end is not None and chunk.end > end):
+            decoded = [r for r in decoded if r[0] >= start and (end is None or r[0] <= end)]
+        archived[chunk.sensor_id].extend(decoded)
+
+    readings = {id : [] for id in sensor_ids}
+    for sensor_id, dt, value in reading_query.order_by(
+            models.SensorReading.sensor_id.asc(), models.SensorReading.datetime.asc()):
+        readings[sensor_id].append((dt, value))
+
+    for id, chunk_readings in archived.items():
+        if len(chunk_readings) > 0:
+            chunk_readings.extend(readings[id])
+            # chunks and rows are sorted on their own, so this is a cheap merge
+            chunk_readings.sort(key=itemgetter(0))
+            readings[id] = chunk_readings
+    return readings
+
+
+def find_archived(keys):
+    """ Returns the readings inside the range of an archived chunk of their sensor
+
+    The unique index of the reading table does not cover the chunks, so storing
+    these would duplicate or interleave archived readings.
+
+    Args:
+        keys: iterable of (sensor_id, datetime) tuples
+
+    Returns:
+        list: the archived (sensor_id, datetime) tuples of keys
+    """
+    keys = list(keys)
+    if len(keys) == 0:
+        return []
+    ranges = {}
+    for sensor_id, start, end in db.session.query(models.SensorReadingChunk.sensor_id,
+            models.SensorReadingChunk.start, models.SensorReadingChunk.end).filter(
+            models.SensorReadingChunk.sensor_id.in_({key[0] for key in keys})).filter(
+            models.SensorReadingChunk.end >= min(key[1] for key in keys)):
+        ranges.setdefault(sensor_id, []).append((start, end))
+    return [(sensor_id, dt) for sensor_id, dt in keys
+        if any(start <= dt <= end for start, end in ranges.get(sensor_id, ()))]
+
+
+def archive_readings(before, sensor_id=None, chunk_size=None):
+    """ Moves readings older than given datetime into compressed chunks
+
+    Readings are paged by datetime, every chunk is written, its readings deleted
+    and committed on its own, so memory is bounded by chunk_size and an interrupted
+    run can be continued.
+
+    Args:
+        before (datetime): readings older than this are archived
+        sensor_id (int): only archive readings of this sensor, all if None
+        chunk_size (int): maximum readings per chunk, defaults to ARCHIVE_CHUNK_SIZE
+
+    Returns:
+        int: number of archived readings
+    """
+    if chunk_size is None:
+        chunk_size = current_app.config["ARCHIVE_CHUNK_SIZE"]
+
+    if sensor_id is None:
+        sensor_ids = [id for id, in db.session.query(models.Sensor.id)]
+    else:
+        sensor_ids = [sensor_id]
+
+    archived = 0
+    for id in sensor_ids:
+        last = None
+        while True:
+            # (sensor_id, datetime) is unique, so paging by datetime is exact
+            query = db.session.query(
+                models.SensorReading.datetime, models.SensorReading.value).filter(
+                models.SensorReading.sensor_id == id).filter(
+                models.SensorReading.datetime < before)
+            if last is not None:
+                query = query.filter(models.SensorReading.datetime > last)
+            readings = query.order_by(models.SensorReading.datetime.asc()).limit(chunk_size).all()
+            if len(readings) == 0:
+                break
+
+            db.session.add(models.SensorReadingChunk(
+                sensor_id=id,
+                start=readings[0][0],
+                end=readings[-1][0],
+                count=len(readings),
+                data=encode_chunk(readings),
+            ))
+            models.SensorReading.query.filter(
+                models.SensorReading.sensor_id == id).filter(
+                models.SensorReading.datetime >= readings[0][0]).filter(
+                models.SensorReading.datetime <= readings[-1][0]).delete(synchronize_session=False)
+            db.session.commit()
+            archived += len(readings)
+            last = readings[-1][0]
+
+    return archived
+
+
+def rewrite_chunks(sensor_ids, start, end, transform, dry_run=False):
+    """ Applies a transformation to archived readings in a range
+
+    Chunks overlapping the range are decoded, transformed and encoded again,
+    chunks without remaining readings are deleted. Changes are not committed.
+
+    Args:
+        sensor_ids (list): ids of sensors, all if None
+        start (datetime): lower bound, inclusive. no bound if None
+        end (datetime): upper bound, inclusive. no bound if None
+        transform (callable): function(value) -> new value, or DELETE to remove the reading
+        dry_run (bool): only count the affected readings
+
+    Returns:
+        int: number of affected readings
+    """
+    query = models.SensorReadingChunk.query
+    if sensor_ids is not None:
+        query = query.filter(models.SensorReadingChunk.sensor_id.in_(sensor_ids))
+    if start is not None:
+        query = query.filter(models.SensorReadingChunk.end >= start)
+    if end is not None:
+        query = query.filter(models.SensorReadingChunk.start <= end)
+
+    affected = 0
+    for chunk in query:
+        readings = []
+        for dt, value in decode_chunk(chunk.data):
+            if (start is None or dt >= start) and (end is None or dt <= end):
+                affected += 1
+                value = transform(value)
+                if value is DELETE:
+                    continue
+            readings.append((dt, value))
+
+        if dry_run:
+            continue
+        if len(readings) == 0:
+            db.session.delete(chunk)
+        else:
+            chunk.update(start=readings[0][0], end=readings[-1][0],
+                count=len(readings), data=encode_chunk(readings))
+
+    return affected
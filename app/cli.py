@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+import logging
+
+import click
+from app import archive, server
+from flask import Blueprint, current_app
+
+# commands are registered at the top level, eg. "flask archive"
+bp = Blueprint("cli", __name__, cli_group=None)
+
+
+@bp.cli.command("archive")
+@click.option("--days", type=float, default=None,
+    help="Archive readings older than this many days. Defaults to ARCHIVE_AFTER_DAYS.")
+@click.option("--sensor-id", type=int, default=None,
+    help="Only archive readings of this sensor.")
+@click.option("--chunk-size", type=int, default=None,
+    help="Maximum readings per chunk. Defaults to ARCHIVE_CHUNK_SIZE.")
+def archive_command(days, sensor_id, chunk_size):
+    """ Packs old sensor readings into compressed chunks
+    """
+    if days is None:
+        days = current_app.config["ARCHIVE_AFTER_DAYS"]
+    before = datetime.utcnow() - timedelta(days=days)
+
+    count = archive.archive_readings(before, sensor_id=sensor_id, chunk_size=chunk_size)
+    click.echo("Archived {} readings older than {}".format(count, before))
+
+
+@bp.cli.command("serve")
+@click.option("--host", default=None, help="Host to bind. Defaults to SERVER_HOST.")
+@click.option("--port", type=int, default=None, help="Port to bind. Defaults to SERVER_PORT.")
+@click.option("--workers", type=int, default=None,
+    help="Number of worker processes. Defaults to SERVER_WORKERS.")
+@click.option("--threads", type=int, default=None,
+    help="Threads per worker process. Defaults to SERVER_THREADS.")
+def serve_command(host, port, workers, threads):
+    """ Runs the app on the multi process production server
+    """
+    # logged by the app logger, which server.logger propagates to
+    server.logger.setLevel(logging.INFO)
+    config = current_app.config
+    # the app proxy is not available in forked workers
+    server.serve(current_app._get_current_object(),
+        host=host or config["SERVER_HOST"],
+        port=port or config["SERVER_PORT"],
+        workers=workers,
+        threads=threads,
+    )
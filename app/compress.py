@@ -0,0 +1,186 @@
+""" Response compression negotiated by the Accept-Encoding request header
+
+Supported encodings, in order of server preference (COMPRESS_ALGORITHMS):
+    zstd: if the zstandard package is installed
+    br:   if the brotli package is installed
+    gzip: always
+
+Responses are compressed if they are successful, at least COMPRESS_MIN_SIZE bytes
+(streamed responses have no known size and are always compressed) and have one of
+COMPRESS_MIMETYPES. Compressed bodies of cacheable GET responses are kept in a
+LRU cache of COMPRESS_CACHE_SIZE bytes, keyed by a hash of the uncompressed body.
+"""
+from collections import OrderedDict
+import gzip
+import hashlib
+import threading
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError: # optional dependency
+    brotli = None
+
+try:
+    import zstandard
+except ImportError: # optional dependency
+    zstandard = None
+
+
+class Encoder:
+    """ Compression algorithm of a content encoding
+
+    Args:
+        compress (callable): function(data, level) -> bytes
+        compressobj (callable): function(level) -> object with compress(data) and flush()
+    """
+    def __init__(self, compress, compressobj):
+        self.compress = compress
+        self.compressobj = compressobj
+
+
+class _BrotliCompressObj:
+    # brotli.Compressor has process/finish instead of compress/flush
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+
+ENCODERS = {
+    "gzip" : Encoder(
+        lambda data, level: gzip.compress(data, compresslevel=level, mtime=0),
+        lambda level: zlib.compressobj(level, zlib.DEFLATED, 31), # 31: gzip container
+    ),
+}
+if brotli is not None:
+    ENCODERS["br"] = Encoder(
+        lambda data, level: brotli.compress(data, quality=level),
+        _BrotliCompressObj,
+    )
+if zstandard is not None:
+    ENCODERS["zstd"] = Encoder(
+        lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+        lambda level: zstandard.ZstdCompressor(level=level).compressobj(),
+    )
+
+
+class CompressionCache:
+    """ Thread safe LRU cache of compressed bodies, bounded by their total size
+
+    Args:
+        max_bytes (int): size budget, 0 disables the cache
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def set(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+def init_app(app):
+    """ Registers response compression
+
+    Args:
+        app: Flask app
+    """
+    for name in app.config["COMPRESS_ALGORITHMS"]:
+        if name not in ENCODERS:
+            app.logger.info("Compression '%s' is not available", name)
+
+    app.extensions["compress"] = CompressionCache(app.config["COMPRESS_CACHE_SIZE"])
+    app.after_request(compress_response)
+
+
+def _is_cacheable(response):
+    return request.method == "GET" and response.status_code == 200 \
+        and not response.cache_control.no_store and not response.cache_control.private
+
+
+def _compress_stream(iterable, compressobj):
+    for data in iterable:
+        if isinstance(data, str):
+            data = data.encode()
+        compressed = compressobj.compress(data)
+        if compressed:
+            yield compressed
+    yield compressobj.flush()
+
+
+def compress_response(response):
+    """ after_request hook, compresses the response if the client accepts it
+    """
+    config = current_app.config
+    if not 200 <= response.status_code < 300 or response.status_code == 204 \
+            or response.direct_passthrough \
+            or "Content-Encoding" in response.headers \
+            or response.mimetype not in config["COMPRESS_MIMETYPES"]:
+        return response
+
+    response.vary.add("Accept-Encoding")
+
+    available = [name for name in config["COMPRESS_ALGORITHMS"] if name in ENCODERS]
+    encoding = request.accept_encodings.best_match(available)
+    if encoding is None:
+        return response
+    encoder = ENCODERS[encoding]
+    level = config["COMPRESS_LEVELS"][encoding]
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoder.compressobj(level))
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < config["COMPRESS_MIN_SIZE"]:
+            return response
+
+        cache = current_app.extensions["compress"]
+        key = None
+        if cache.max_bytes > 0 and _is_cacheable(response):
+            key = (encoding, level, hashlib.blake2b(data, digest_size=16).digest())
+            compressed = cache.get(key)
+        else:
+            compressed = None
+
+        if compressed is None:
+            compressed = encoder.compress(data, level)
+            if key is not None:
+                cache.set(key, compressed)
+        response.set_data(compressed)
+
+    response.headers["Content-Encoding"] = encoding
+    # the compressed body is a different representation
+    etag, weak = response.get_etag()
+    if etag is not None:
+        response.set_etag("{}-{}".format(etag, encoding), weak)
+    return response
@@ -0,0 +1,110 @@
+""" Token bucket rate limiting of posted readings
+
+Every posted reading costs a token of the bucket of its sensor and of the bucket
+of the client (remote address). Buckets refill with LIMIT_SENSOR_RATE, or the
+rate_limit of the sensor, and LIMIT_CLIENT_RATE readings per second and hold
+LIMIT_BURST_SECONDS of their rate. A request is accepted if all its buckets have
+enough tokens, else it is rejected with 429 and Retry-After, before any db work
+(the rate limits of sensors come from app.registry).
+
+A batch larger than a bucket is accepted if the bucket is full, the bucket then
+goes into debt. Buckets are kept per process, in a LRU of LIMIT_MAX_BUCKETS, so
+with several server workers the limits apply per worker.
+"""
+from collections import OrderedDict
+import math
+import threading
+import time
+
+from app import registry
+from flask import current_app, request
+
+
+class TokenBuckets:
+    """ Thread safe token buckets, O(1) per bucket and check
+
+    Args:
+        max_buckets (int): maximum number of buckets, least recently used are dropped
+    """
+    def __init__(self, max_buckets):
+        self.max_buckets = max_buckets
+        # key -> [tokens, time of last refill]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, costs, now=None):
+        """ Takes tokens from all buckets or none
+
+        Args:
+            costs (dict): {key : (tokens, rate per second, bucket size)}
+            now (float): monotonic time, defaults to time.monotonic()
+
+        Returns:
+            float: 0 if accepted, else seconds until the request would be accepted
+        """
+        now = time.monotonic() if now is None else now
+        wait = 0
+        with self._lock:
+            buckets = []
+            for key, (cost, rate, burst) in costs.items():
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = self._buckets[key] = [burst, now]
+                else:
+                    self._buckets.move_to_end(key)
+                    bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                    bucket[1] = now
+                # batches larger than the bucket need a full bucket
+                needed = min(cost, burst)
+                if bucket[0] < needed:
+                    wait = max(wait, (needed - bucket[0]) / rate)
+                buckets.append((bucket, cost))
+
+            if wait == 0:
+                for bucket, cost in buckets:
+                    bucket[0] -= cost
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+def init_app(app):
+    """ Sets up the token buckets
+
+    Args:
+        app: Flask app
+    """
+    app.extensions["limiter"] = TokenBuckets(app.config["LIMIT_MAX_BUCKETS"])
+
+
+def check_readings(readings):
+    """ Takes the tokens of posted readings, call after validating them
+
+    Args:
+        readings (list(dict)): posted readings, with valid sensor_id
+
+    Returns:
+        int: None if accepted, else seconds to retry after
+    """
+    config = current_app.config
+    seconds = config["LIMIT_BURST_SECONDS"]
+
+    # {sensor id : (sensor, number of readings)}
+    counts = {}
+    for reading in readings:
+        sensor = registry.sensor(reading["sensor_id"])
+        counts[sensor.id] = (sensor, counts.get(sensor.id, (None, 0))[1] + 1)
+
+    costs = {}
+    rate = config["LIMIT_CLIENT_RATE"]
+    if rate > 0:
+        costs[("client", request.remote_addr)] = (len(readings), rate, rate * seconds)
+    for sensor_id, (sensor, count) in counts.items():
+        rate = config["LIMIT_SENSOR_RATE"] if sensor.rate_limit is None else sensor.rate_limit
+        if rate > 0:
+            costs[("sensor", sensor_id)] = (count, rate, rate * seconds)
+
+    if len(costs) == 0:
+        return None
+    wait = current_app.extensions["limiter"].acquire(costs)
+    return None if wait == 0 else math.ceil(wait)
@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, IntegerField
+from wtforms import FloatField, StringField, IntegerField
 from wtforms.validators import DataRequired
 
 
@@ -8,3 +8,5 @@ class SensorForm(FlaskForm):
     name = StringField("Name", [DataRequired()])
     unit = StringField("Unit")
     description = StringField("Description")
+    expression = StringField("Expression")
+    rate_limit = FloatField("Rate limit")
@@ -1,7 +1,22 @@
-from app import models
+from app import models, registry
 from app.main import bp
 from app.main.forms import SensorForm
-from flask import abort, render_template
+from flask import abort, current_app, render_template
+
+
+def plot_config():
+    """ Returns the config of the plots in sensor.js, see setPlotConfig
+
+    Returns:
+        dict
+    """
+    config = current_app.config
+    return {
+        "tileBaseMs" : config["TILE_BASE_SECONDS"] * 1000,
+        "tileMaxLevel" : config["TILE_MAX_LEVEL"],
+        "tilePoints" : config["TILE_POINTS"],
+        "maxPoints" : config["PLOT_MAX_POINTS"],
+    }
 
 
 @bp.route("/")
@@ -11,12 +26,12 @@ def index():
 
 @bp.route("/sensor")
 def sensor():
-    return render_template("main/sensor.html", title="Sensor")
+    return render_template("main/sensor.html", title="Sensor", plot_config=plot_config())
 
 
 @bp.route("/sensor/<int:id>")
 def sensor_id(id):
-    s = models.Sensor.query.get(id)
+    s = registry.sensor(id)
     if s is None:
         return abort(404)
     
@@ -25,7 +40,8 @@ def sensor_id(id):
     for key in models.Sensor.column_names():
         setattr(getattr(form, key), "data", getattr(s, key))
 
-    return render_template("main/sensor_id.html", title="Edit Sensor", form=form)
+    return render_template("main/sensor_id.html", title="Edit Sensor", form=form,
+        plot_config=plot_config())
 
 @bp.route("/sensor/new")
 def sensor_new():
@@ -1,22 +1,31 @@
 from datetime import datetime
+from functools import lru_cache
+import itertools
 
 from app import db
+from app.serialize import format_datetime
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 
 
 class ApiMixin:
 
+    # table metadata does not change at runtime, computed once per class
+
     @classmethod
+    @lru_cache(maxsize=None)
     def column_names(cls):
-        """ Returns list of column names
+        """ Returns tuple of column names
 
         Returns:
-            list
+            tuple
         """
-        return cls.__table__.columns.keys()
+        return tuple(cls.__table__.columns.keys())
 
     @classmethod
+    @lru_cache(maxsize=None)
     def column_properties(cls):
-        """Returns list of table columns dicts
+        """Returns list of table columns dicts, must not be modified
 
         Returns:
             list(dict): list of dicts describing the table columns
@@ -66,9 +75,73 @@ class SensorReading(db.Model, ApiMixin):
     value = db.Column(db.Float, nullable=True)
     datetime = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
 
+    __table_args__ = (
+        # devices retry on failed requests, see upsert
+        db.UniqueConstraint("sensor_id", "datetime", name="uq_sensor_reading_sensor_id_datetime"),
+    )
+
     # relationships
     sensor = db.relationship("Sensor", back_populates="readings")
 
+    # dialects with native "INSERT ... ON CONFLICT"
+    UPSERT_DIALECTS = {
+        "sqlite" : sqlite.insert,
+        "postgresql" : postgresql.insert,
+    }
+
+    @classmethod
+    def upsert(cls, rows, on_conflict="ignore"):
+        """ Inserts rows, rows with an existing (sensor_id, datetime) are ignored or overwritten
+
+        Uses one "INSERT ... ON CONFLICT" statement per set of row keys. Other
+        dialects fall back to row wise inserts in savepoints. Changes are not committed.
+
+        Args:
+            rows (list(dict)): column names and values, every row needs sensor_id and datetime
+            on_conflict (str): "ignore" keeps existing readings, "overwrite" replaces their values
+        """
+        if on_conflict not in ("ignore", "overwrite"):
+            raise ValueError("on_conflict needs to be 'ignore' or 'overwrite'")
+
+        # a statement must not hit the same row twice
+        unique = {}
+        for row in rows:
+            key = (row["sensor_id"], row["datetime"])
+            if on_conflict == "overwrite" or key not in unique:
+                unique[key] = row
+
+        insert = cls.UPSERT_DIALECTS.get(db.engine.dialect.name)
+        keyfunc = lambda row: sorted(row.keys())
+        for _, group in itertools.groupby(sorted(unique.values(), key=keyfunc), key=keyfunc):
+            group = list(group)
+            if insert is None:
+                cls._upsert_fallback(group, on_conflict)
+                continue
+
+            statement = insert(cls.__table__)
+            overwrite = {key : statement.excluded[key] for key in group[0].keys()
+                if key not in ("id", "sensor_id", "datetime")}
+            if on_conflict == "overwrite" and len(overwrite) > 0:
+                statement = statement.on_conflict_do_update(
+                    index_elements=["sensor_id", "datetime"], set_=overwrite)
+            else:
+                statement = statement.on_conflict_do_nothing(
+                    index_elements=["sensor_id", "datetime"])
+            db.session.execute(statement, group)
+
+    @classmethod
+    def _upsert_fallback(cls, rows, on_conflict):
+        for row in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(cls.__table__.insert(), row)
+            except IntegrityError:
+                if on_conflict == "overwrite":
+                    db.session.execute(cls.__table__.update().where(
+                        cls.sensor_id == row["sensor_id"]).where(
+                        cls.datetime == row["datetime"]).values(
+                        {k : v for k, v in row.items() if k != "id"}))
+
     def __repr__(self):
         return "SensorReading<id={}, sensor_id={}, value={}, datetime={}>".format(
             self.id, self.sensor_id, self.value, self.datetime
@@ -84,7 +157,7 @@ class SensorReading(db.Model, ApiMixin):
             "id" : self.id,
             "sensor_id" : self.sensor_id,
             "value" : self.value,
-            "datetime" : self.datetime.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            "datetime" : format_datetime(self.datetime),
         }
         # reduce dict by *args values
         if len(args) > 0:
@@ -92,12 +165,43 @@ class SensorReading(db.Model, ApiMixin):
         return data
 
 
+class SensorReadingChunk(db.Model, ApiMixin):
+    """ Archived sensor readings, packed by app.archive.encode_chunk
+    """
+    __tablename__ = "sensor_reading_chunk"
+
+    id = db.Column(db.Integer, primary_key=True)
+    sensor_id = db.Column(db.Integer,
+        db.ForeignKey("sensor.id", onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=False)
+    start = db.Column(db.DateTime, nullable=False)
+    end = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_sensor_reading_chunk_sensor_id_end", "sensor_id", "end"),
+    )
+
+    # relationships
+    sensor = db.relationship("Sensor", back_populates="chunks")
+
+    def __repr__(self):
+        return "SensorReadingChunk<id={}, sensor_id={}, start={}, end={}, count={}>".format(
+            self.id, self.sensor_id, self.start, self.end, self.count
+        )
+
+
 class Sensor(db.Model, ApiMixin):
     __tablename__ = "sensor"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     unit = db.Column(db.String)
     description = db.Column(db.String)
+    # virtual sensors are computed from other sensors, see app.virtual
+    expression = db.Column(db.String)
+    # posted readings per second, LIMIT_SENSOR_RATE if null, 0 disables, see app.limiter
+    rate_limit = db.Column(db.Float)
 
     # relationships
     readings = db.relationship(
@@ -106,10 +210,22 @@ class Sensor(db.Model, ApiMixin):
         cascade="all, delete-orphan",
         passive_deletes=True, # let cascading deletes be managed by db
     )
+    chunks = db.relationship(
+        "SensorReadingChunk",
+        back_populates="sensor",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+    rules = db.relationship(
+        "Rule",
+        back_populates="sensor",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
 
     def __repr__(self):
-        return "Sensor<id={}, name={}, unit={}, description={}>".format(
-            self.id, self.name, self.unit, self.description
+        return "Sensor<id={}, name={}, unit={}, description={}, expression={}, rate_limit={}>".format(
+            self.id, self.name, self.unit, self.description, self.expression, self.rate_limit
         )
 
     def to_dict(self):
@@ -118,4 +234,100 @@ class Sensor(db.Model, ApiMixin):
             "name" : self.name,
             "unit" : self.unit,
             "description" : self.description,
+            "expression" : self.expression,
+            "rate_limit" : self.rate_limit,
+        }
+
+
+class Rule(db.Model, ApiMixin):
+    """ Alert rule of a sensor, evaluated on ingest by app.rules
+    """
+    __tablename__ = "rule"
+
+    KINDS = ("threshold", "hysteresis", "rate", "stale")
+
+    id = db.Column(db.Integer, primary_key=True)
+    sensor_id = db.Column(db.Integer,
+        db.ForeignKey("sensor.id", onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=False)
+    name = db.Column(db.String)
+    kind = db.Column(db.String, nullable=False)
+    above = db.Column(db.Float)
+    below = db.Column(db.Float)
+    minutes = db.Column(db.Float)
+    # state shared by all processes, changed by app.rules only
+    active = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    # datetime of the last evaluated reading
+    last = db.Column(db.DateTime)
+
+    # relationships
+    sensor = db.relationship("Sensor", back_populates="rules")
+    events = db.relationship(
+        "RuleEvent",
+        back_populates="rule",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    def __repr__(self):
+        return "Rule<id={}, sensor_id={}, kind={}, above={}, below={}, minutes={}, active={}>".format(
+            self.id, self.sensor_id, self.kind, self.above, self.below, self.minutes, self.active
+        )
+
+    def to_dict(self):
+        return {
+            "id" : self.id,
+            "sensor_id" : self.sensor_id,
+            "name" : self.name,
+            "kind" : self.kind,
+            "above" : self.above,
+            "below" : self.below,
+            "minutes" : self.minutes,
+            "active" : self.active,
+            "last" : None if self.last is None else format_datetime(self.last),
+        }
+
+
+class RuleEvent(db.Model, ApiMixin):
+    """ A rule that fired (active) or cleared (not active)
+    """
+    __tablename__ = "rule_event"
+
+    id = db.Column(db.Integer, primary_key=True)
+    rule_id = db.Column(db.Integer,
+        db.ForeignKey("rule.id", onupdate="CASCADE", ondelete="CASCADE"),
+        nullable=False, index=True)
+    sensor_id = db.Column(db.Integer, nullable=False)
+    active = db.Column(db.Boolean, nullable=False)
+    value = db.Column(db.Float)
+    datetime = db.Column(db.DateTime, nullable=False)
+
+    # relationships
+    rule = db.relationship("Rule", back_populates="events")
+
+    def __repr__(self):
+        return "RuleEvent<id={}, rule_id={}, active={}, value={}, datetime={}>".format(
+            self.id, self.rule_id, self.active, self.value, self.datetime
+        )
+
+    def to_dict(self):
+        return {
+            "id" : self.id,
+            "rule_id" : self.rule_id,
+            "sensor_id" : self.sensor_id,
+            "active" : self.active,
+            "value" : self.value,
+            "datetime" : format_datetime(self.datetime),
         }
+
+
+class Version(db.Model, ApiMixin):
+    """ Change counters, eg. of sensors, to detect stale caches of other processes, see app.registry
+    """
+    __tablename__ = "version"
+
+    name = db.Column(db.String, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "Version<name={}, version={}>".format(self.name, self.version)
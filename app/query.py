@@ -0,0 +1,189 @@
+""" Batched sensor and reading queries, see POST /api/query
+
+Reading sub-queries of one batch are planned together: the ranges requested per
+sensor are merged where they overlap, sensors with the same merged range are read
+by one scan (archive.readings_between_many) and every sub-query gets its slice of
+the scanned readings. Eg. a day of sensors 1 and 2 and a month of sensor 1 are
+read by a scan of a month of sensor 1 and one of a day of sensor 2. Virtual
+sensors are evaluated per sub-query, their results are memoized by app.virtual.
+"""
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from app import archive, registry, virtual
+
+
+def parse_window(args):
+    """ Parses the reading range of request args or a sub-query
+
+    Args:
+        args: mapping with optional days, minutes (relative to now) or
+            start, end (utc timestamps, replace days and minutes)
+
+    Returns:
+        tuple: (start, end) datetimes, end is None if open
+
+    Raises:
+        ValueError: if a value is invalid
+    """
+    try:
+        days = float(args.get("days", 0))
+        minutes = float(args.get("minutes", 0))
+    except (TypeError, ValueError):
+        raise ValueError("'days' and 'minutes' need to be numbers")
+    start = datetime.utcnow() - timedelta(days=days, minutes=minutes)
+
+    # absolute range
+    end = None
+    try:
+        if args.get("start") is not None:
+            start = datetime.utcfromtimestamp(float(args["start"]))
+        if args.get("end") is not None:
+            end = datetime.utcfromtimestamp(float(args["end"]))
+    except (TypeError, ValueError, OverflowError, OSError):
+        raise ValueError("'start' and 'end' need to be timestamps")
+    return start, end
+
+
+def lookup_sensors(ids):
+    """ Returns the sensors of ids, all sensors if ids is empty
+
+    Args:
+        ids: sensor ids, numeric strings are accepted
+
+    Returns:
+        list(SensorInfo)
+
+    Raises:
+        ValueError: if an id is not an integer or unknown
+    """
+    sensors = []
+    # deduplicated after converting, "1" and 1 are the same sensor
+    for id in dict.fromkeys(registry.parse_id(id) for id in ids):
+        sensor = registry.sensors().get(id)
+        if sensor is None:
+            raise ValueError("Unknown sensor id {}".format(id))
+        sensors.append(sensor)
+
+    if len(sensors) == 0:
+        sensors = list(registry.sensors().values())
+    return sensors
+
+
+def filter_sensors(filters):
+    """ Returns the sensors matching filters, like the args of GET /api/sensor
+
+    Args:
+        filters (dict): {column name : list of accepted values}
+
+    Returns:
+        list(SensorInfo)
+
+    Raises:
+        ValueError: if a column does not exist
+    """
+    accepted = {}
+    for name, values in filters.items():
+        if name not in registry.SensorInfo._fields:
+            raise ValueError("Column does not exist: '{}'".format(name))
+        if not isinstance(values, list):
+            values = [values]
+        # request args are strings
+        accepted[name] = {str(value) for value in values}
+
+    return [s for s in registry.sensors().values()
+        if all(str(getattr(s, name)) in values for name, values in accepted.items())]
+
+
+def _merge(ranges):
+    # merges overlapping (start, end) ranges, end None is open
+    merged = []
+    for start, end in sorted(ranges, key=lambda r: r[0]):
+        if merged and (merged[-1][1] is None or start <= merged[-1][1]):
+            last_start, last_end = merged[-1]
+            merged[-1] = (last_start, None if end is None or last_end is None else max(end, last_end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _covering(ranges, start):
+    # merged range containing start
+    for range_ in ranges:
+        if range_[0] <= start:
+            covering = range_
+    return covering
+
+
+class ReadingPlan:
+    """ Reading sub-queries, executed together
+
+    >>> plan = ReadingPlan()
+    >>> day = plan.add(sensors, start, None)
+    >>> plan.execute()
+    >>> plan.result(day)
+    """
+    def __init__(self):
+        # (sensors, start, end)
+        self._queries = []
+        # (sensor_id, merged range) -> (datetimes, readings)
+        self._scans = None
+        self._ranges = None
+
+    def add(self, sensors, start, end):
+        """ Adds a sub-query
+
+        Args:
+            sensors (list(SensorInfo)): sensors
+            start (datetime): lower bound, inclusive
+            end (datetime): upper bound, inclusive. no bound if None
+
+        Returns:
+            int: index of the result
+        """
+        self._queries.append((sensors, start, end))
+        return len(self._queries) - 1
+
+    def execute(self):
+        """ Reads the readings of all sub-queries
+
+        Returns:
+            int: number of scans
+        """
+        requested = {}
+        for query_sensors, start, end in self._queries:
+            for sensor in query_sensors:
+                if sensor.expression is None:
+                    requested.setdefault(sensor.id, []).append((start, end))
+        self._ranges = {id : _merge(ranges) for id, ranges in requested.items()}
+
+        # sensors with equal merged ranges share a scan
+        scans = {}
+        for id, ranges in self._ranges.items():
+            for range_ in ranges:
+                scans.setdefault(range_, []).append(id)
+
+        self._scans = {}
+        for (start, end), ids in scans.items():
+            for id, readings in archive.readings_between_many(ids, start, end).items():
+                self._scans[(id, (start, end))] = ([r[0] for r in readings], readings)
+        return len(scans)
+
+    def result(self, index):
+        """ Returns the result of a sub-query, after execute
+
+        Returns:
+            list: (sensor_id, list of (datetime, value) tuples) tuples
+        """
+        query_sensors, start, end = self._queries[index]
+        result = []
+        for sensor in query_sensors:
+            if sensor.expression is not None:
+                result.append((sensor.id, virtual.readings_between(sensor, start, end)))
+                continue
+            range_ = _covering(self._ranges[sensor.id], start)
+            datetimes, readings = self._scans[(sensor.id, range_)]
+            first = bisect_left(datetimes, start)
+            last = len(datetimes) if end is None else bisect_right(datetimes, end)
+            result.append((sensor.id, readings[first:last]))
+        return result
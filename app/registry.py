@@ -0,0 +1,191 @@
+""" Process wide cache of sensor metadata
+
+Sensors are looked up by almost every request but rarely change. The registry
+keeps all sensors in memory as immutable SensorInfo records, so validating
+sensor ids costs no database round trip.
+
+Changes of sensors call changed() before committing. It increments the "sensor"
+counter of the version table in the same transaction and drops the cache of the
+process once the transaction commits, so no request caches the old rows again. Other processes, eg. server workers, compare the version of their cache
+with the table at most every REGISTRY_CHECK_SECONDS, a single primary key lookup,
+and reload all sensors if it changed. Registry caches other data the same way,
+eg. the memo of app.virtual.
+"""
+from collections import namedtuple
+import threading
+import time
+
+from app import db, models
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+SENSOR = "sensor"
+
+# session.info key of the caches to drop on commit
+_PENDING = "registry_invalidate"
+
+
+class SensorInfo(namedtuple("SensorInfo", models.Sensor.column_names())):
+    """ Immutable copy of the columns of a Sensor
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        return self._asdict()
+
+
+def get_version(name):
+    """ Returns the change counter of name, 0 if it never changed
+    """
+    version = db.session.query(models.Version.version).filter(
+        models.Version.name == name).scalar()
+    return version or 0
+
+
+def get_versions(names):
+    """ Returns the change counters of names with one query
+
+    Returns:
+        tuple: versions in the order of names
+    """
+    versions = dict(db.session.query(models.Version.name, models.Version.version).filter(
+        models.Version.name.in_(names)))
+    return tuple(versions.get(name) or 0 for name in names)
+
+
+def bump_version(name):
+    """ Increments the change counter of name, not committed
+
+    Args:
+        name (str): eg. "sensor"
+    """
+    table = models.Version.__table__
+    result = db.session.execute(table.update().where(table.c.name == name).values(
+        version=table.c.version + 1))
+    if result.rowcount == 0:
+        db.session.execute(table.insert().values(name=name, version=1))
+
+
+class Registry:
+    """ Thread safe cache of data loaded by a function, reloaded if a version of names changed
+
+    Args:
+        names (str or tuple): name or names in the version table
+        load (callable): function without arguments returning the data
+        check_seconds (float): minimum seconds between version checks
+    """
+    def __init__(self, names, load, check_seconds):
+        self.names = (names,) if isinstance(names, str) else tuple(names)
+        self.check_seconds = check_seconds
+        self._load = load
+        self._data = None
+        self._version = None
+        self._checked = 0
+        # incremented by invalidate, loads started before are not kept
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        with self._lock:
+            data, version, checked = self._data, self._version, self._checked
+            generation = self._generation
+        if data is not None and now - checked < self.check_seconds:
+            return data
+
+        # read before loading, a concurrent change makes the next check reload again
+        current = get_versions(self.names)
+        if data is None or current != version:
+            data = self._load()
+        with self._lock:
+            if self._generation == generation:
+                self._data, self._version, self._checked = data, current, now
+        return data
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+            self._generation += 1
+
+    def invalidate_on_commit(self):
+        """ Drops the data once the current transaction commits, not if it rolls back
+        """
+        db.session.info.setdefault(_PENDING, set()).add(self)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_pending(session):
+    for cache in session.info.pop(_PENDING, ()):
+        cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session):
+    session.info.pop(_PENDING, None)
+
+
+def _load_sensors():
+    columns = [getattr(models.Sensor, name) for name in SensorInfo._fields]
+    return {row[0] : SensorInfo(*row) for row in db.session.query(*columns)}
+
+
+def init_app(app):
+    """ Sets up the sensor registry
+
+    Args:
+        app: Flask app
+    """
+    app.extensions["registry"] = Registry(SENSOR, _load_sensors, app.config["REGISTRY_CHECK_SECONDS"])
+
+
+def sensors():
+    """ Returns all sensors
+
+    Returns:
+        dict: {id : SensorInfo}, must not be modified
+    """
+    return current_app.extensions["registry"].get()
+
+
+def parse_id(id):
+    """ Converts a sensor id of a request
+
+    Args:
+        id: int or string of digits
+
+    Returns:
+        int: sensor id
+
+    Raises:
+        ValueError: for other values, eg. floats and booleans, which int() would convert
+    """
+    # json booleans are ints in python
+    if isinstance(id, int) and not isinstance(id, bool):
+        return id
+    if isinstance(id, str) and id.isascii() and id.isdigit():
+        return int(id)
+    raise ValueError("sensor_id needs to be integers")
+
+
+def sensor(id):
+    """ Returns a sensor by id
+
+    Args:
+        id (int): sensor id, strings of digits are accepted
+
+    Returns:
+        SensorInfo: None if the id is invalid or the sensor does not exist
+    """
+    try:
+        id = parse_id(id)
+    except ValueError:
+        return None
+    return sensors().get(id)
+
+
+def changed():
+    """ Marks the sensors as changed, call before committing changes of sensors
+    """
+    bump_version(SENSOR)
+    current_app.extensions["registry"].invalidate_on_commit()
@@ -0,0 +1,421 @@
+""" Alert rules, evaluated incrementally on ingest
+
+Rule kinds (see models.Rule):
+    threshold:  active while the value is above `above` or below `below`
+    hysteresis: becomes active above `above` and clears only below `below`
+    rate:       active while the change of the value over the last `minutes`
+                is above `above` or below `below`
+    stale:      active while the sensor has no reading for `minutes`
+
+A rule fires an event when it becomes active and when it clears. Events are
+stored as RuleEvent, see GET /api/rule/event, and posted to RULE_WEBHOOK_URL if
+it is set.
+
+The state of a rule, whether it is active and the datetime of the last evaluated
+reading, is stored in its row, so all server workers share it. Posted readings
+are evaluated in the transaction storing them, with the rules of their sensors
+locked, in O(1) per reading. Readings older than the last evaluated reading of a
+rule are ignored. The change of a rate rule is measured from the oldest reading
+of its window, looked up by two index lookups per batch instead of kept on the
+row. New and changed rules start with the state of the stored readings.
+
+Stale rules can not fire on ingest. They are checked every RULE_CHECK_SECONDS in
+every worker of the production server (flask serve), each deadline fires once by
+a conditional update.
+
+The sensors with rules are cached per process, see app.registry, so readings of
+other sensors cost no query.
+"""
+from collections import deque, namedtuple
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import queue
+import threading
+import urllib.request
+
+from app import archive, db, models, registry, server
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+RULE = "rule"
+
+RuleSpec = namedtuple("RuleSpec", "id, sensor_id, kind, above, below, minutes")
+
+# columns of models.Rule changed by this module only
+STATE_COLUMNS = ("active", "last")
+
+
+def _outside(value, above, below):
+    return (above is not None and value > above) or (below is not None and value < below)
+
+
+class RuleState:
+    """ Incremental state of a rule
+
+    Args:
+        spec (RuleSpec): rule
+    """
+    # readings without value are skipped
+    needs_value = True
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.active = False
+        self.last = None
+
+    def update(self, dt, value):
+        """ Evaluates a new reading
+
+        Returns:
+            bool: new active state if it changed, else None
+        """
+        if self.last is not None and dt <= self.last:
+            return None
+        self.last = dt
+        if value is None and self.needs_value:
+            return None
+        active = self.evaluate(dt, value)
+        if active == self.active:
+            return None
+        self.active = active
+        return active
+
+    def evaluate(self, dt, value):
+        raise NotImplementedError
+
+
+class ThresholdState(RuleState):
+    def evaluate(self, dt, value):
+        return _outside(value, self.spec.above, self.spec.below)
+
+
+class HysteresisState(RuleState):
+    def evaluate(self, dt, value):
+        if self.active:
+            return value >= self.spec.below
+        return value > self.spec.above
+
+
+class RateState(RuleState):
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.window = deque()
+        self.span = timedelta(minutes=spec.minutes)
+
+    def evaluate(self, dt, value):
+        self.window.append((dt, value))
+        while self.window[0][0] < dt - self.span:
+            self.window.popleft()
+        return _outside(value - self.window[0][1], self.spec.above, self.spec.below)
+
+
+class StaleState(RuleState):
+    needs_value = False
+
+    def evaluate(self, dt, value):
+        # every reading clears
+        return False
+
+
+STATES = {
+    "threshold" : ThresholdState,
+    "hysteresis" : HysteresisState,
+    "rate" : RateState,
+    "stale" : StaleState,
+}
+
+
+def validate(data):
+    """ Checks the columns of a rule
+
+    Args:
+        data (dict): column names and values
+
+    Raises:
+        ValueError: if the rule is invalid
+    """
+    kind = data.get("kind")
+    if kind not in STATES:
+        raise ValueError("'kind' needs to be one of {}".format(", ".join(STATES)))
+    for key in ("above", "below", "minutes"):
+        value = data.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError("'{}' needs to be a number".format(key))
+
+    above, below, minutes = data.get("above"), data.get("below"), data.get("minutes")
+    if kind in ("threshold", "rate") and above is None and below is None:
+        raise ValueError("Rule '{}' needs 'above' or 'below'".format(kind))
+    if kind == "hysteresis" and (above is None or below is None or below > above):
+        raise ValueError("Rule 'hysteresis' needs 'above' and 'below', with below <= above")
+    if kind in ("rate", "stale") and (minutes is None or minutes <= 0):
+        raise ValueError("Rule '{}' needs positive 'minutes'".format(kind))
+
+
+def _spec(rule):
+    return RuleSpec(rule.id, rule.sensor_id, rule.kind, rule.above, rule.below, rule.minutes)
+
+
+def _state(rule):
+    # state of a rule row, shared by all processes
+    state = STATES[rule.kind](_spec(rule))
+    state.active, state.last = rule.active, rule.last
+    return state
+
+
+def _load_rule_sensors():
+    return frozenset(sensor_id for sensor_id, in db.session.query(models.Rule.sensor_id).distinct())
+
+
+def _event(spec, active, value, dt):
+    return {
+        "rule_id" : spec.id,
+        "sensor_id" : spec.sensor_id,
+        "active" : active,
+        "value" : value,
+        "datetime" : dt,
+    }
+
+
+class Notifier:
+    """ Posts events as JSON list to a webhook url, from a background thread
+
+    Args:
+        url (str): webhook url
+        timeout (float): seconds per request
+    """
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+
+    def send(self, events):
+        # threads do not survive the fork of server workers
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._queue.put(events)
+
+    def close(self, timeout=None):
+        """ Posts the queued events and stops the thread
+
+        Args:
+            timeout (float): maximum seconds to wait, events still queued are dropped
+        """
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning("Dropped %d queued batches of rule events", self._queue.qsize())
+        self._thread = None
+
+    def _run(self):
+        while True:
+            events = self._queue.get()
+            if events is None:
+                return
+            request = urllib.request.Request(self.url, data=json.dumps(events).encode(),
+                headers={"Content-Type" : "application/json"})
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except OSError:
+                logger.exception("Could not post %d rule events to %s", len(events), self.url)
+
+
+def init_app(app):
+    """ Sets up the cache of sensors with rules and the webhook
+
+    Args:
+        app: Flask app
+    """
+    app.extensions["rules"] = registry.Registry(RULE, _load_rule_sensors,
+        app.config["REGISTRY_CHECK_SECONDS"])
+    url = app.config["RULE_WEBHOOK_URL"]
+    app.extensions["rules_notifier"] = None if not url else \
+        Notifier(url, app.config["RULE_WEBHOOK_TIMEOUT"])
+
+
+def reload():
+    """ Marks the rules as changed in all processes, call before committing
+    changes of rules or sensors
+    """
+    registry.bump_version(RULE)
+    current_app.extensions["rules"].invalidate_on_commit()
+
+
+def seed(rule, now=None):
+    """ Sets the state of a new or changed rule from the stored readings, without
+    events. Call before committing
+
+    Args:
+        rule (models.Rule): rule
+        now (datetime): defaults to utcnow
+    """
+    now = now or datetime.utcnow()
+    state = STATES[rule.kind](_spec(rule))
+    if rule.kind == "rate":
+        rows = archive.readings_between(rule.sensor_id, now - state.span)
+    else:
+        rows = db.session.query(models.SensorReading.datetime, models.SensorReading.value) \
+            .filter(models.SensorReading.sensor_id == rule.sensor_id) \
+            .order_by(models.SensorReading.datetime.desc()).limit(1).all()
+    for dt, value in rows:
+        state.update(dt, value)
+    rule.active = state.active
+    # stale rules of sensors without readings count from now
+    rule.last = now if state.last is None and rule.kind == "stale" else state.last
+
+
+def _record(events):
+    # stores events of the current transaction, ids are set by the flush
+    rows = [models.RuleEvent(**event) for event in events]
+    if len(rows) > 0:
+        db.session.add_all(rows)
+        db.session.flush()
+    return [row.to_dict() for row in rows]
+
+
+def _window(sensor_id, span, first, last):
+    # stored readings that can start the window of the readings from first to last:
+    # those up to last - span and the next one, the batch itself is appended on
+    # evaluation. Two index lookups, one for a single reading. Readings of archived
+    # chunks are not read, they are older than any posted reading
+    q = db.session.query(models.SensorReading.datetime, models.SensorReading.value) \
+        .filter(models.SensorReading.sensor_id == sensor_id) \
+        .filter(models.SensorReading.value != None) \
+        .filter(models.SensorReading.datetime < first) \
+        .order_by(models.SensorReading.datetime)
+    rows = q.filter(models.SensorReading.datetime >= first - span) \
+        .filter(models.SensorReading.datetime <= last - span).all()
+    return rows + q.filter(models.SensorReading.datetime > last - span).limit(1).all()
+
+
+def ingest(readings):
+    """ Evaluates the rules of new readings and stores fired events
+
+    Call after storing the readings and before committing. The rules are locked
+    until the commit, so each change of a state fires once in all processes.
+
+    Args:
+        readings: iterable of (sensor_id, datetime, value) tuples
+
+    Returns:
+        list(dict): stored events, post them with notify() after committing
+    """
+    sensor_ids = current_app.extensions["rules"].get()
+    readings = sorted((r for r in readings if r[0] in sensor_ids), key=lambda r: r[1])
+    if len(readings) == 0:
+        return []
+
+    by_sensor = {}
+    for reading in readings:
+        by_sensor.setdefault(reading[0], []).append(reading)
+    events = []
+    for rule in models.Rule.query.filter(models.Rule.sensor_id.in_(by_sensor)) \
+            .order_by(models.Rule.id).with_for_update():
+        state = _state(rule)
+        evaluated = [r for r in by_sensor[rule.sensor_id] if state.last is None or r[1] > state.last]
+        if len(evaluated) == 0:
+            continue
+        if isinstance(state, RateState):
+            state.window.extend(_window(rule.sensor_id, state.span, evaluated[0][1], evaluated[-1][1]))
+        for _, dt, value in evaluated:
+            active = state.update(dt, value)
+            if active is not None:
+                events.append(_event(state.spec, active, value, dt))
+        rule.active, rule.last = state.active, state.last
+    return _record(events)
+
+
+def check(now=None):
+    """ Fires stale rules, stores and posts the events
+
+    Each rule is fired by a conditional update, so every process may check.
+
+    Args:
+        now (datetime): defaults to utcnow
+
+    Returns:
+        list(dict): stored events
+    """
+    now = now or datetime.utcnow()
+    table = models.Rule.__table__
+    events = []
+    for rule in models.Rule.query.filter(models.Rule.kind == "stale") \
+            .filter(models.Rule.active == db.false()).order_by(models.Rule.id).all():
+        if rule.last is None:
+            db.session.execute(table.update().where(table.c.id == rule.id)
+                .where(table.c.last == None).values(last=now))
+            continue
+        deadline = rule.last + timedelta(minutes=rule.minutes)
+        if deadline > now:
+            continue
+        # unchanged since loaded, eg. not cleared by a reading or fired by another process
+        result = db.session.execute(table.update().where(table.c.id == rule.id)
+            .where(table.c.active == db.false()).where(table.c.last == rule.last)
+            .values(active=True))
+        if result.rowcount == 1:
+            events.append(_event(_spec(rule), True, None, deadline))
+    try:
+        events = _record(events)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.exception("Could not store %d rule events", len(events))
+        return []
+    notify(events)
+    return events
+
+
+def notify(events):
+    """ Posts committed events to RULE_WEBHOOK_URL, if set
+
+    Args:
+        events (list(dict)): events returned by ingest() or check()
+    """
+    notifier = current_app.extensions["rules_notifier"]
+    if notifier is not None and len(events) > 0:
+        notifier.send(events)
+
+
+@server.register_startup
+def start_checker():
+    """ Checks stale rules every RULE_CHECK_SECONDS in a background thread
+    """
+    app = current_app._get_current_object()
+    interval = app.config["RULE_CHECK_SECONDS"]
+    if interval <= 0:
+        return
+    stop = app.extensions["rules_checker"] = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            with app.app_context():
+                try:
+                    check()
+                except Exception:
+                    logger.exception("Checking stale rules failed")
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+@server.register_shutdown
+def stop_checker():
+    stop = current_app.extensions.get("rules_checker")
+    if stop is not None:
+        stop.set()
+
+
+@server.register_shutdown
+def flush_notifier():
+    """ Posts the queued events, waits at most RULE_WEBHOOK_TIMEOUT seconds
+    """
+    notifier = current_app.extensions["rules_notifier"]
+    if notifier is not None:
+        notifier.close(current_app.config["RULE_WEBHOOK_TIMEOUT"])
@@ -0,0 +1,282 @@
+""" JSON serialization for api responses
+
+The app uses a pluggable JSON provider (see JSON_PROVIDER config):
+    "auto":   orjson if installed, else the standard library
+    "orjson": orjson, fails if not installed
+    "stdlib": standard library json
+
+Both providers write datetimes as '%Y-%m-%dT%H:%M:%SZ'.
+
+For large responses rows_response goes straight from query rows to JSON:
+row serializers write JSON text without intermediate dicts, with orjson row
+builders create the dicts for a single orjson.dumps call.
+"""
+from datetime import datetime
+from functools import lru_cache
+from operator import itemgetter
+import json
+import math
+
+from flask import current_app, json as flask_json
+from flask.wrappers import Response
+
+try:
+    import orjson
+except ImportError: # optional dependency
+    orjson = None
+
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def format_datetime(dt):
+    """ Formats a naive utc datetime like DATETIME_FORMAT, but faster than strftime
+    """
+    return dt.isoformat(timespec="seconds") + "Z"
+
+
+class JSONEncoder(flask_json.JSONEncoder):
+    """ flask JSONEncoder with DATETIME_FORMAT datetimes, used by flask.jsonify aswell
+    """
+    def default(self, o):
+        if isinstance(o, datetime):
+            return format_datetime(o)
+        return super().default(o)
+
+
+class JSONProvider:
+    """ Base class of JSON providers
+    """
+    name = None
+
+    def dumps(self, obj):
+        """ Serializes obj
+
+        Returns:
+            str or bytes
+        """
+        raise NotImplementedError
+
+    def response(self, obj, status=200):
+        """ Creates a json response of obj
+        """
+        return raw_response(self.dumps(obj), status)
+
+    def dumps_rows(self, columns, groups):
+        """ Serializes groups of rows to {key : [{column : value, ...}, ...], ...}
+
+        Args:
+            columns: sqlalchemy columns, in the same order as the row values
+            groups: iterable of (key, rows) tuples
+
+        Returns:
+            str or bytes
+        """
+        serializer = row_serializer(*columns)
+        return dumps_object((key, serializer(rows)) for key, rows in groups)
+
+
+class StdlibJSONProvider(JSONProvider):
+    name = "stdlib"
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=JSONEncoder, separators=(",", ":"))
+
+
+class OrjsonJSONProvider(JSONProvider):
+    name = "orjson"
+
+    # int keys are used for sensor ids, naive datetimes are utc
+    OPTIONS = 0 if orjson is None else (orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+        | orjson.OPT_UTC_Z | orjson.OPT_OMIT_MICROSECONDS)
+
+    def __init__(self):
+        if orjson is None:
+            raise RuntimeError("JSON_PROVIDER 'orjson' requires the orjson package")
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=self._default, option=self.OPTIONS)
+
+    def dumps_rows(self, columns, groups):
+        # building dicts for orjson beats writing the JSON text in python
+        builder = row_builder(*columns)
+        return self.dumps({key : builder(rows) for key, rows in groups})
+
+    @staticmethod
+    def _default(o):
+        # same fallbacks as flask, eg. decimals and uuids
+        return JSONEncoder().default(o)
+
+
+PROVIDERS = {
+    StdlibJSONProvider.name : StdlibJSONProvider,
+    OrjsonJSONProvider.name : OrjsonJSONProvider,
+}
+
+
+def init_app(app):
+    """ Sets up the JSON provider given by JSON_PROVIDER config
+
+    Args:
+        app: Flask app
+    """
+    name = app.config.get("JSON_PROVIDER", "auto")
+    if name == "auto":
+        name = "stdlib" if orjson is None else "orjson"
+    if name not in PROVIDERS:
+        raise ValueError("Unknown JSON_PROVIDER: '{}'".format(name))
+
+    app.json_encoder = JSONEncoder
+    app.extensions["json_provider"] = PROVIDERS[name]()
+
+
+def jsonify(obj, status=200):
+    """ Like flask.jsonify, but uses the app JSON provider
+
+    Args:
+        obj: json serializable object
+        status (int): response status code
+
+    Returns:
+        response
+    """
+    return current_app.extensions["json_provider"].response(obj, status)
+
+
+def rows_response(columns, groups, status=200):
+    """ Creates a json response of grouped rows using the app JSON provider
+
+    Args:
+        columns: sqlalchemy columns, in the same order as the row values
+        groups: iterable of (key, rows) tuples
+        status (int): response status code
+    """
+    provider = current_app.extensions["json_provider"]
+    return raw_response(provider.dumps_rows(columns, groups), status)
+
+
+def raw_response(data, status=200):
+    """ Creates a json response of already serialized data
+
+    Args:
+        data (str or bytes): JSON text
+        status (int): response status code
+    """
+    return Response(data, status=status, mimetype="application/json")
+
+
+def dumps_object(items):
+    """ Joins already serialized values to a JSON object
+
+    Args:
+        items: iterable of (key, JSON text) tuples
+
+    Returns:
+        str
+    """
+    return "{" + ",".join(
+        '{}:{}'.format(json.dumps(str(key)), value) for key, value in items) + "}"
+
+
+def dumps_array(values):
+    """ Joins already serialized values to a JSON array
+
+    Args:
+        values: iterable of JSON texts, str or bytes
+
+    Returns:
+        str
+    """
+    return "[" + ",".join(
+        value.decode() if isinstance(value, bytes) else value for value in values) + "]"
+
+
+# column dumpers, serialize all values of a column at once
+
+def _dumps_floats(values):
+    # NaN and Infinity are not valid JSON
+    return [repr(float(v)) if v is not None and math.isfinite(v) else "null" for v in values]
+
+
+def _dumps_ints(values):
+    return [str(int(v)) if v is not None else "null" for v in values]
+
+
+def _dumps_datetimes(values):
+    return ['"' + v.isoformat(timespec="seconds") + 'Z"' if v is not None else "null"
+        for v in values]
+
+
+def _dumps_others(values):
+    return [json.dumps(v, cls=JSONEncoder) for v in values]
+
+
+_DUMPERS = {
+    float : _dumps_floats,
+    int : _dumps_ints,
+    datetime : _dumps_datetimes,
+}
+
+
+@lru_cache(maxsize=None)
+def _serializer(names, types):
+    # row template like '{"datetime":%s,"value":%s}'
+    template = "{" + ",".join(json.dumps(name).replace("%", "%%") + ":%s" for name in names) + "}"
+    dumpers = tuple(_DUMPERS.get(type_, _dumps_others) for type_ in types)
+
+    getters = tuple(itemgetter(i) for i in range(len(names)))
+
+    def serializer(rows):
+        rows = rows if isinstance(rows, list) else list(rows)
+        columns = [dumps(map(getter, rows)) for dumps, getter in zip(dumpers, getters)]
+        return "[" + ",".join(map(template.__mod__, zip(*columns))) + "]"
+    return serializer
+
+
+@lru_cache(maxsize=None)
+def _builder(names):
+    if len(names) == 2:
+        # readings, a dict display is about twice as fast as dict(zip())
+        first, second = names
+
+        def builder(rows):
+            return [{first : a, second : b} for a, b in rows]
+    else:
+        def builder(rows):
+            return [dict(zip(names, row)) for row in rows]
+    return builder
+
+
+def _column_type(column):
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def row_serializer(*columns):
+    """ Returns a function serializing rows to a JSON list of objects
+
+    >>> serializer = row_serializer(SensorReading.datetime, SensorReading.value)
+    >>> serializer([(datetime(2021, 9, 11), 1.5)])
+    '[{"datetime":"2021-09-11T00:00:00Z","value":1.5}]'
+
+    Args:
+        *columns: sqlalchemy columns, in the same order as the row values
+
+    Returns:
+        callable: function(rows) -> str
+    """
+    names = tuple(column.key for column in columns)
+    return _serializer(names, tuple(_column_type(column) for column in columns))
+
+
+def row_builder(*columns):
+    """ Returns a function converting rows to a list of dicts
+
+    Args:
+        *columns: sqlalchemy columns, in the same order as the row values
+
+    Returns:
+        callable: function(rows) -> list(dict)
+    """
+    return _builder(tuple(column.key for column in columns))
@@ -0,0 +1,314 @@
+""" Multi process, multi threaded production server
+
+The app is created once (preloaded) in the master process, which binds the
+listening socket and forks SERVER_WORKERS worker processes, each serving with
+SERVER_THREADS threads. Database connections are disposed around the fork, so no
+connection is shared between processes. Two backends (see SERVER_BACKEND config):
+    "auto":     gunicorn if installed, else the builtin server
+    "gunicorn": gunicorn with gthread workers, fails if not installed
+    "builtin":  werkzeug based fallback, eg. on Windows
+
+Every worker calls the startup hooks registered by register_startup before
+serving, eg. to start background threads, which do not survive the fork.
+On SIGTERM or SIGINT the master stops all workers. A worker stops accepting
+connections, finishes its running requests and calls the shutdown hooks
+registered by register_shutdown, eg. to flush pending work.
+
+The builtin server accepts at most SERVER_MAX_CONNECTIONS connections per worker,
+further clients wait in the listen backlog. Reads and writes of a connection
+time out after SERVER_TIMEOUT seconds. Crashing workers are respawned with an
+exponential backoff. Forking is not available on Windows, there a single worker is used.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+from app import db
+from werkzeug.serving import BaseWSGIServer, get_sockaddr, select_address_family
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError: # optional dependency, not available on Windows
+    BaseApplication = None
+
+logger = logging.getLogger(__name__)
+
+# respawn delay of crashing workers, doubled per crash
+RESPAWN_MIN_DELAY = 0.5
+RESPAWN_MAX_DELAY = 30
+# workers running this long (seconds) did not crash at startup, the delay is reset
+RESPAWN_RESET_SECONDS = 10
+
+_startup_hooks = []
+_shutdown_hooks = []
+
+
+def register_startup(func):
+    """ Registers a function called with app context when a worker starts
+
+    Can be used as decorator.
+
+    Args:
+        func (callable): function without arguments
+
+    Returns:
+        func
+    """
+    _startup_hooks.append(func)
+    return func
+
+
+def register_shutdown(func):
+    """ Registers a function called with app context when a worker shuts down
+
+    Can be used as decorator.
+
+    Args:
+        func (callable): function without arguments
+
+    Returns:
+        func
+    """
+    _shutdown_hooks.append(func)
+    return func
+
+
+def _run_hooks(app, hooks, name):
+    with app.app_context():
+        for func in hooks:
+            try:
+                func()
+            except Exception:
+                logger.exception("%s hook %r failed", name, func)
+
+
+def run_startup_hooks(app):
+    """ Calls all registered startup hooks, errors are logged and skipped
+
+    Args:
+        app: Flask app
+    """
+    _run_hooks(app, _startup_hooks, "Startup")
+
+
+def run_shutdown_hooks(app):
+    """ Calls all registered shutdown hooks, errors are logged and skipped
+
+    Args:
+        app: Flask app
+    """
+    _run_hooks(app, _shutdown_hooks, "Shutdown")
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """ WSGI server handling requests in a fixed size thread pool
+
+    Args:
+        threads (int): number of threads
+        max_connections (int): connections handled or queued for a thread, the accept
+            loop waits while reached. defaults to threads
+        timeout (float): timeout in seconds of socket reads and writes, None blocks
+    """
+    multithread = True
+
+    def __init__(self, *args, threads=4, max_connections=None, timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max(threads, max_connections or threads))
+
+    def process_request(self, request, client_address):
+        # backpressure, further clients wait in the listen backlog
+        self._slots.acquire()
+        request.settimeout(self.timeout)
+        self.executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        # wait for running requests
+        self.executor.shutdown(wait=True)
+        super().server_close()
+
+
+def _dispose_engine(app):
+    # pooled connections must not be used by more than one process
+    with app.app_context():
+        db.engine.dispose()
+
+
+def _run_worker(app, host, port, threads, fd=None, multiprocess=False):
+    """ Serves until SIGTERM or SIGINT, then runs the shutdown hooks
+    """
+    server = PooledWSGIServer(host, port, app, threads=threads, fd=fd,
+        max_connections=app.config["SERVER_MAX_CONNECTIONS"], timeout=app.config["SERVER_TIMEOUT"])
+    server.multiprocess = multiprocess
+
+    def stop(signum, frame):
+        # shutdown() blocks until serve_forever returns, which runs in this thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info("Worker %d serving on http://%s:%d with %d threads",
+        os.getpid(), host, server.server_address[1], threads)
+    run_startup_hooks(app)
+    try:
+        server.serve_forever()
+    finally:
+        run_shutdown_hooks(app)
+        logger.info("Worker %d stopped", os.getpid())
+
+
+def _bind(host, port):
+    family = select_address_family(host, port)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(get_sockaddr(host, port, family))
+    sock.listen(BaseWSGIServer.request_queue_size)
+    return sock
+
+
+def _respawn_delay(delay, uptime):
+    """ Returns the delay before respawning a worker
+
+    Args:
+        delay (float): previous delay in seconds
+        uptime (float): seconds the exited worker ran
+
+    Returns:
+        float: seconds
+    """
+    if uptime >= RESPAWN_RESET_SECONDS:
+        return 0
+    return min(RESPAWN_MAX_DELAY, max(RESPAWN_MIN_DELAY, delay * 2))
+
+
+def _serve_gunicorn(app, host, port, workers, threads):
+    config = app.config
+    # ipv6 addresses need brackets
+    bind = "[{}]:{}".format(host, port) if ":" in host else "{}:{}".format(host, port)
+
+    class Application(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind" : bind,
+                "workers" : workers,
+                "threads" : threads,
+                "worker_class" : "gthread",
+                "worker_connections" : config["SERVER_MAX_CONNECTIONS"],
+                "timeout" : config["SERVER_TIMEOUT"],
+                "graceful_timeout" : config["SERVER_TIMEOUT"],
+                "preload_app" : True,
+                "post_fork" : lambda server, worker: _dispose_engine(app),
+                "post_worker_init" : lambda worker: run_startup_hooks(app),
+                "worker_exit" : lambda server, worker: run_shutdown_hooks(app),
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    # the preloaded app must not pass its connections to the workers
+    _dispose_engine(app)
+    Application().run()
+
+
+def serve(app, host="127.0.0.1", port=5000, workers=None, threads=None):
+    """ Runs the app on the production server, blocks until stopped
+
+    Args:
+        app: preloaded Flask app
+        host (str): host to bind
+        port (int): port to bind
+        workers (int): number of processes, defaults to SERVER_WORKERS
+        threads (int): threads per process, defaults to SERVER_THREADS
+    """
+    workers = workers or app.config["SERVER_WORKERS"]
+    threads = threads or app.config["SERVER_THREADS"]
+
+    backend = app.config.get("SERVER_BACKEND", "auto")
+    if backend == "auto":
+        backend = "builtin" if BaseApplication is None else "gunicorn"
+    if backend not in ("gunicorn", "builtin"):
+        raise ValueError("Unknown SERVER_BACKEND: '{}'".format(backend))
+    if backend == "gunicorn":
+        if BaseApplication is None:
+            raise RuntimeError("SERVER_BACKEND 'gunicorn' requires the gunicorn package")
+        _serve_gunicorn(app, host, port, workers, threads)
+        return
+
+    if not hasattr(os, "fork"):
+        workers = 1
+
+    if workers == 1:
+        _run_worker(app, host, port, threads)
+        return
+
+    sock = _bind(host, port)
+    # children would inherit the pooled connections of the master
+    _dispose_engine(app)
+
+    # pid -> start time
+    children = {}
+    stopping = threading.Event()
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _dispose_engine(app)
+                _run_worker(app, host, port, threads, fd=sock.fileno(), multiprocess=True)
+            except Exception:
+                logger.exception("Worker %d crashed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = time.monotonic()
+
+    def stop(signum, frame):
+        stopping.set()
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for _ in range(workers):
+        spawn()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("Master %d started %d workers", os.getpid(), workers)
+
+    delay = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = children.pop(pid, None)
+        if started is None or stopping.is_set():
+            continue
+        # replace crashed workers, with a growing delay if they crash at startup
+        delay = _respawn_delay(delay, time.monotonic() - started)
+        logger.warning("Worker %d exited with status %d, restarting in %.1f seconds",
+            pid, status, delay)
+        # returns early on SIGTERM or SIGINT
+        if not stopping.wait(delay):
+            spawn()
+
+    sock.close()
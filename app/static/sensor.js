@@ -55,33 +55,420 @@ function buildTimedeltaButtons(
     return htmlButtons;
 }
 
+// per sensor cache of fetched readings, stored as non overlapping segments of covered time
+// segment: {start: ms, end: ms, t: [ms, ...], datetime: [str, ...], value: [number, ...], used: ms}
+// the api serves datetimes in whole seconds, so segments cover [start, end) in whole seconds and hold
+// exactly the readings whose served datetime lies in it, see floorSecond
+class ReadingCache {
+    constructor({
+        budget = 500000,        // maximum number of cached readings, least recently used segments are evicted
+        persist = false,        // keep segments in IndexedDB across page loads
+        maxAge = 86400000,      // persisted segments older than this (ms) are dropped, edits of old readings expire
+        liveMargin = 60000,     // the last minute before "now" is never considered covered
+    } = {}) {
+        this.budget = budget;
+        this.maxAge = maxAge;
+        this.liveMargin = liveMargin;
+        this.sensors = {};
+        this.size = 0;
+        this.db = null;
+        this.dirty = new Set();
+        this.saveTimer = null;
+        this.ready = persist && window.indexedDB ? this.load() : Promise.resolve();
+    }
+
+    segments(sensorId) {
+        return this.sensors[sensorId] || (this.sensors[sensorId] = []);
+    }
+
+    missing(sensorId, start, end) {
+        // returns the [start, end) gaps not covered by cached segments, bounds in whole seconds
+        let gaps = [];
+        let cursor = start;
+        for (const seg of this.segments(sensorId)) {
+            if (seg.end < cursor) continue;
+            if (seg.start > end) break;
+            if (seg.start > cursor) gaps.push([cursor, seg.start]);
+            cursor = Math.max(cursor, seg.end);
+        }
+        if (cursor < end) gaps.push([cursor, end]);
+        return gaps;
+    }
+
+    insert(sensorId, start, end, readings) {
+        // adds fetched readings of [start, end), merging overlapping or touching segments
+        end = Math.max(start, Math.min(end, floorSecond(Date.now() - this.liveMargin)));
+        let seg = {start: start, end: end, t: [], datetime: [], value: [], used: Date.now()};
+        for (const r of readings) {
+            const t = Date.parse(r.datetime);
+            // not covered yet, fetched again with the next gap
+            if (t >= end) continue;
+            seg.t.push(t);
+            seg.datetime.push(r.datetime);
+            seg.value.push(r.value);
+        }
+
+        let kept = [];
+        for (const other of this.segments(sensorId)) {
+            if (other.end < seg.start || other.start > seg.end) {
+                kept.push(other);
+                continue;
+            }
+            this.size -= other.t.length;
+            seg = mergeSegments(seg, other);
+        }
+        kept.push(seg);
+        kept.sort(function(a, b) {return a.start - b.start;});
+        this.sensors[sensorId] = kept;
+        this.size += seg.t.length;
+
+        this.evict();
+        this.scheduleSave(sensorId);
+    }
+
+    get(sensorId, start, end) {
+        // returns cached readings in [start, end) in api format: [{datetime, value}, ...]
+        let readings = [];
+        for (const seg of this.segments(sensorId)) {
+            if (seg.end <= start || seg.start >= end) continue;
+            seg.used = Date.now();
+            for (let i = lowerBound(seg.t, start); i < seg.t.length && seg.t[i] < end; i++) {
+                readings.push({datetime: seg.datetime[i], value: seg.value[i]});
+            }
+        }
+        return readings;
+    }
+
+    evict() {
+        // drops least recently used segments until the budget is met
+        while (this.size > this.budget) {
+            let oldest = null;
+            for (const [sensorId, segments] of Object.entries(this.sensors)) {
+                for (const seg of segments) {
+                    if (oldest === null || seg.used < oldest.seg.used) oldest = {sensorId: sensorId, seg: seg};
+                }
+            }
+            if (oldest === null) break;
+            this.sensors[oldest.sensorId] = this.sensors[oldest.sensorId].filter(function(s) {return s !== oldest.seg;});
+            this.size -= oldest.seg.t.length;
+            this.dirty.add(oldest.sensorId);
+        }
+    }
+
+    clear() {
+        this.sensors = {};
+        this.size = 0;
+        if (this.db) this.db.transaction("segments", "readwrite").objectStore("segments").clear();
+    }
+
+    load() {
+        // opens the IndexedDB and restores segments that are not expired
+        let cache = this;
+        return new Promise(function(resolve) {
+            let request = indexedDB.open("bottled_home_readings", 1);
+            request.onupgradeneeded = function() {
+                request.result.createObjectStore("segments", {keyPath: "sensorId"});
+            };
+            request.onerror = function() {resolve();};
+            request.onsuccess = function() {
+                cache.db = request.result;
+                let getAll = cache.db.transaction("segments").objectStore("segments").getAll();
+                getAll.onerror = function() {resolve();};
+                getAll.onsuccess = function() {
+                    const expired = Date.now() - cache.maxAge;
+                    for (const record of getAll.result) {
+                        // segments of before whole second bounds are dropped aswell
+                        cache.sensors[record.sensorId] = record.segments.filter(function(seg) {
+                            return seg.used > expired && seg.start % 1000 == 0 && seg.end % 1000 == 0;
+                        });
+                        for (const seg of cache.sensors[record.sensorId]) cache.size += seg.t.length;
+                    }
+                    cache.evict();
+                    resolve();
+                };
+            };
+        });
+    }
+
+    scheduleSave(sensorId) {
+        // writes changed sensors to IndexedDB, batched to one transaction per second
+        if (!this.db) return;
+        this.dirty.add(sensorId);
+        if (this.saveTimer !== null) return;
+        let cache = this;
+        this.saveTimer = setTimeout(function() {
+            let store = cache.db.transaction("segments", "readwrite").objectStore("segments");
+            for (const id of cache.dirty) store.put({sensorId: id, segments: cache.segments(id)});
+            cache.dirty.clear();
+            cache.saveTimer = null;
+        }, 1000);
+    }
+}
+
+function lowerBound(array, value) {
+    // index of the first element >= value in a sorted array
+    let lo = 0, hi = array.length;
+    while (lo < hi) {
+        const mid = (lo + hi) >> 1;
+        if (array[mid] < value) lo = mid + 1; else hi = mid;
+    }
+    return lo;
+}
+
+function floorSecond(ms) {
+    // the api truncates datetimes to whole seconds
+    return Math.floor(ms / 1000) * 1000;
+}
+
+function mergeSegments(a, b) {
+    // merges two segments, the readings of a (the newer fetch) replace those of b in [a.start, a.end)
+    // readings within one second share their t, so they are taken by range and not matched by t
+    let merged = {start: Math.min(a.start, b.start), end: Math.max(a.end, b.end), t: [], datetime: [], value: [], used: Date.now()};
+    const parts = [
+        [b, 0, lowerBound(b.t, a.start)],
+        [a, 0, a.t.length],
+        [b, lowerBound(b.t, a.end), b.t.length],
+    ];
+    for (const [src, from, to] of parts) {
+        for (let k = from; k < to; k++) {
+            merged.t.push(src.t[k]);
+            merged.datetime.push(src.datetime[k]);
+            merged.value.push(src.value[k]);
+        }
+    }
+    return merged;
+}
+
+// replace with new ReadingCache({persist: true}) to keep readings across page loads
+var readingCache = new ReadingCache();
+
+// server config, set by the page with setPlotConfig, see app.main.routes.plot_config
+var plotConfig = {
+    tileBaseMs: 60000,      // span of a level 0 tile
+    tileMaxLevel: 24,
+    tilePoints: 256,        // points per tile at most
+    maxPoints: 10000,       // windows with more readings per sensor are loaded as tiles
+};
+
+function setPlotConfig(config) {
+    Object.assign(plotConfig, config);
+}
+
+function timedeltaMs(timedelta) {
+    return (timedelta.days || 0) * 86400000 + (timedelta.minutes || 0) * 60000;
+}
+
 function getReadings(sensors, timedelta, callback) {
-    $.ajax({
-        url: "/api/sensor/reading",
-        // example data: {sensor_id:[1, 2, ...], days: 1}
-        data: Object.assign({"sensor_id": Object.keys(sensors)}, timedelta),
-        success: function(readings) {
-            callback(readings);
+    // fetches readings of the last timedelta ({days, minutes}), only requesting gaps missing in readingCache
+    // [start, end) in whole seconds, including the current second
+    const end = floorSecond(Date.now()) + 1000;
+    const start = floorSecond(end - timedeltaMs(timedelta));
+
+    readingCache.ready.then(function() {
+        // group sensors by identical gaps, one request per gap
+        let gaps = {};
+        for (const sensorId of Object.keys(sensors)) {
+            for (const [gapStart, gapEnd] of readingCache.missing(sensorId, start, end)) {
+                const key = gapStart + "-" + gapEnd;
+                (gaps[key] = gaps[key] || {start: gapStart, end: gapEnd, ids: []}).ids.push(sensorId);
+            }
         }
+
+        let requests = Object.values(gaps).map(function(gap) {
+            return $.ajax({
+                url: "/api/sensor/reading",
+                // example data: {sensor_id:[1, 2, ...], start: 1631377439, end: 1631463838.999999}
+                // the api end is inclusive, stored datetimes have microseconds
+                data: {"sensor_id": gap.ids, start: gap.start / 1000, end: gap.end / 1000 - 0.000001},
+            }).then(function(readings) {
+                for (const sensorId of gap.ids) {
+                    readingCache.insert(sensorId, gap.start, gap.end, readings[sensorId] || []);
+                }
+            });
+        });
+
+        // merge cached and fresh segments
+        $.when.apply($, requests).done(function() {
+            let readings = {};
+            for (const sensorId of Object.keys(sensors)) {
+                readings[sensorId] = readingCache.get(sensorId, start, end);
+            }
+            callback(readings);
+        });
     });
 }
 
+// per plot element: last requested timedelta and ui revision, see enableZoomLoading
+// tiles: null while raw readings are plotted, else the plotted tile range {start, end} (ms),
+// {live: true} for the window of timedelta up to now
+var plotStates = {};
+
+function getPlotState(plotElem) {
+    return plotStates[plotElem] || (plotStates[plotElem] = {timedelta: {days: 1}, revision: 0, tiles: null});
+}
+
 // plots the sensor readings in given timedelta
 function plot(plotElem, sensors, readings) {
     let traces = extractData(sensors, readings);
 
     let layout = setupPlotlyLayout(sensors, traces);
+    // a constant revision keeps the zoom of the user on replots
+    let state = getPlotState(plotElem);
+    layout["uirevision"] = state.revision;
 
-    Plotly.react(plotElem, traces, layout);
+    Plotly.react(plotElem, traces, layout).then(function(gd) {
+        // plotly event handlers can only be attached once the element is plotted
+        if (state.onRelayout && !state.relayoutAttached) {
+            gd.on("plotly_relayout", state.onRelayout);
+            state.relayoutAttached = true;
+        }
+    });
+}
+
+// windows up to this (ms) are loaded as readings while the reading rate of a sensor is unknown
+const RAW_WINDOW_MS = 86400000;
+
+function estimatePoints(sensors, start, end) {
+    // highest expected number of readings of a sensor in [start, end], by the density of cached readings
+    let points = 0;
+    for (const sensorId of Object.keys(sensors)) {
+        let count = 0, covered = 0;
+        for (const seg of readingCache.segments(sensorId)) {
+            count += seg.t.length;
+            covered += seg.end - seg.start;
+        }
+        if (covered == 0) {
+            if (end - start > RAW_WINDOW_MS) return Infinity;
+            continue;
+        }
+        points = Math.max(points, count / covered * (end - start));
+    }
+    return points;
 }
 
 function getReadingsPlot(plotElem, sensors, timedelta) {
-    // combined function for request and plot
-    getReadings(sensors, timedelta, function(readings) {
-        plot(plotElem, sensors, readings);
+    // combined function for request and plot, windows above plotConfig.maxPoints are plotted from tiles
+    let state = getPlotState(plotElem);
+    state.timedelta = timedelta;
+    state.revision++;
+    readingCache.ready.then(function() {
+        const end = Date.now();
+        const start = end - timedeltaMs(timedelta);
+        const tiled = estimatePoints(sensors, start, end) > plotConfig.maxPoints;
+        state.tiles = tiled ? {live: true} : null;
+        const load = tiled
+            ? function(callback) {getTiles(sensors, start, end, callback);}
+            : function(callback) {getReadings(sensors, timedelta, callback);};
+        load(function(readings) {
+            plot(plotElem, sensors, readings);
+        });
     });
 }
 
+class TileCache {
+    // least recently used zoom level aligned, downsampled tiles: sensorId + ":" + level + ":" + index -> [{datetime, value, min, max}, ...]
+    constructor(budget = 500000) {     // maximum number of cached points
+        this.budget = budget;
+        this.tiles = new Map();         // in order of use, oldest first
+        this.size = 0;
+    }
+
+    get(key) {
+        const tile = this.tiles.get(key);
+        if (tile !== undefined) {
+            this.tiles.delete(key);
+            this.tiles.set(key, tile);
+        }
+        return tile;
+    }
+
+    set(key, tile) {
+        if (this.tiles.has(key)) this.size -= this.tiles.get(key).length + 1;
+        this.tiles.delete(key);
+        this.tiles.set(key, tile);
+        // empty tiles count as a point, so they are limited aswell
+        this.size += tile.length + 1;
+        while (this.size > this.budget) {
+            const [oldest, evicted] = this.tiles.entries().next().value;
+            this.tiles.delete(oldest);
+            this.size -= evicted.length + 1;
+        }
+    }
+}
+
+var tileCache = new TileCache();
+const TILES_PER_VIEW = 4;       // tiles in the visible range, each has up to plotConfig.tilePoints points
+
+function getTiles(sensors, start, end, callback) {
+    // fetches the tiles covering [start, end] (ms) at a resolution fitting the range
+    const level = Math.min(plotConfig.tileMaxLevel, Math.max(0,
+        Math.ceil(Math.log2((end - start) / TILES_PER_VIEW / plotConfig.tileBaseMs))));
+    const span = plotConfig.tileBaseMs * Math.pow(2, level);
+    const now = Date.now();
+
+    let requests = [];
+    let keys = {};
+    // tiles of this view, independent of evictions of tileCache
+    let found = {};
+    for (let index = Math.floor(start / span); index * span <= end; index++) {
+        // tiles reaching into the future are still growing, they are never cached
+        const final = (index + 1) * span < now;
+        let ids = [];
+        for (const sensorId of Object.keys(sensors)) {
+            const key = sensorId + ":" + level + ":" + index;
+            (keys[sensorId] = keys[sensorId] || []).push(key);
+            const tile = final ? tileCache.get(key) : undefined;
+            if (tile === undefined) ids.push(sensorId); else found[key] = tile;
+        }
+        if (ids.length == 0) continue;
+
+        requests.push($.ajax({
+            url: "/api/sensor/reading/tile",
+            data: {"sensor_id": ids, level: level, index: index},
+        }).then(function(tiles) {
+            for (const sensorId of ids) {
+                const key = sensorId + ":" + level + ":" + index;
+                found[key] = tiles[sensorId] || [];
+                if (final) tileCache.set(key, found[key]);
+            }
+        }));
+    }
+
+    $.when.apply($, requests).done(function() {
+        let readings = {};
+        for (const sensorId of Object.keys(sensors)) {
+            readings[sensorId] = [].concat(...keys[sensorId].map(function(key) {return found[key];}));
+        }
+        callback(readings);
+    });
+}
+
+function enableZoomLoading(plotElem, sensors) {
+    // replots zoomed or panned ranges with tiles, detail loads progressively while zooming in
+    let timer = null;
+    getPlotState(plotElem).onRelayout = function(event) {
+        let range = event["xaxis.range"] || [event["xaxis.range[0]"], event["xaxis.range[1]"]];
+        let autorange = event["xaxis.autorange"];
+        if (!autorange && range[0] === undefined) return;
+
+        // wait until zooming or panning settles
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            if (autorange) {
+                getReadingsPlot(plotElem, sensors, getPlotState(plotElem).timedelta);
+                return;
+            }
+            // plotly ranges are utc strings without timezone
+            const start = Date.parse(range[0].replace(" ", "T") + "Z");
+            const end = Date.parse(range[1].replace(" ", "T") + "Z");
+            getPlotState(plotElem).tiles = {start: start, end: end};
+            getTiles(sensors, start, end, function(readings) {
+                plot(plotElem, sensors, readings);
+            });
+        }, 250);
+    };
+}
+
 function getPlotLayoutType() {
     return Cookies.get("plot_layout_type") || "DEFAULT";
 }
@@ -158,7 +545,8 @@ function extractData(sensors, readings) {
     for (sensorId in readings) {
         let datetimes = readings[sensorId].map(function(obj) {return obj["datetime"];});
         let values = readings[sensorId].map(function(obj) {return obj["value"];});
-        traces.push({x: datetimes, y: values, name: sensors[sensorId]["name"]});
+        // webgl traces stay responsive with many points
+        traces.push({x: datetimes, y: values, name: sensors[sensorId]["name"], type: "scattergl", mode: "lines"});
     }
     return traces;
 }
@@ -166,7 +554,20 @@ function extractData(sensors, readings) {
 // extends plot every timeinterval by new values
 function updatePlot(plotElem, sensors, minutes=1) {
     return setInterval(function() {
-        if (!$.isEmptyObject(sensors)) {
+        if ($.isEmptyObject(sensors)) return;
+        let state = getPlotState(plotElem);
+        if (state.tiles !== null) {
+            // tile traces hold mean, min and max points, raw readings are not appended to them.
+            // the growing tiles are refetched, final ones come from tileCache
+            let start = state.tiles.start, end = state.tiles.end;
+            if (state.tiles.live) {
+                end = Date.now();
+                start = end - timedeltaMs(state.timedelta);
+            }
+            getTiles(sensors, start, end, function(readings) {
+                plot(plotElem, sensors, readings);
+            });
+        } else {
             getReadings(sensors, {minutes: minutes}, function(readings) {
                 let traces = extractData(sensors, readings);
                 // transform into new standard
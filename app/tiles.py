@@ -0,0 +1,61 @@
+""" Zoom level aligned, downsampled tiles of sensor readings
+
+A tile of level z covers TILE_BASE_SECONDS * 2**z seconds, tile i starts at
+i * span seconds after the epoch. Aligned tiles can be cached by clients and
+proxies, zooming in by one level halves the span of a tile.
+Tiles with more than TILE_POINTS readings are downsampled to TILE_POINTS buckets.
+"""
+from datetime import timedelta
+
+from app.archive import EPOCH
+
+
+def tile_range(level, index, base_seconds):
+    """ Returns start and end datetime of a tile
+
+    Args:
+        level (int): zoom level
+        index (int): tile index
+        base_seconds (int): span of a level 0 tile
+
+    Returns:
+        tuple: (start, end), end is exclusive
+    """
+    span = timedelta(seconds=base_seconds * 2 ** level)
+    start = EPOCH + span * index
+    return start, start + span
+
+
+def downsample(readings, start, end, points):
+    """ Reduces readings to at most given number of buckets
+
+    Args:
+        readings: list of (datetime, value) tuples, sorted by datetime
+        start (datetime): start of first bucket
+        end (datetime): end of last bucket, exclusive
+        points (int): number of buckets
+
+    Returns:
+        list: (datetime, mean, min, max) tuples, datetime is the bucket start.
+            If there are not more readings than points, readings are returned as is.
+    """
+    readings = [r for r in readings if r[0] < end and r[1] is not None]
+    if len(readings) <= points:
+        return [(dt, value, value, value) for dt, value in readings]
+
+    bucket = (end - start) / points
+    result = []
+    current, total, count, low, high = None, 0.0, 0, None, None
+    for dt, value in readings:
+        index = (dt - start) // bucket
+        if index != current:
+            if count > 0:
+                result.append((start + bucket * current, total / count, low, high))
+            current, total, count, low, high = index, 0.0, 0, value, value
+        total += value
+        count += 1
+        low = min(low, value)
+        high = max(high, value)
+    if count > 0:
+        result.append((start + bucket * current, total / count, low, high))
+    return result
@@ -0,0 +1,365 @@
+""" Virtual sensors, computed from the readings of other sensors
+
+A sensor with an expression is virtual, eg. "s1 + s2 + s3" or "dewpoint(s4, s5)",
+where s<id> is the series of the sensor with that id. Sources are aligned to
+buckets of VIRTUAL_BUCKET_SECONDS, every source is averaged per bucket and the
+expression is evaluated for the buckets all sources have readings in.
+
+Evaluation is vectorized with numpy if it is installed, else bucket by bucket.
+Results are memoized per (sensor, block of VIRTUAL_BLOCK_BUCKETS buckets) for
+blocks that lie completely in the past. The memo of every process is a
+registry.Registry of the "sensor" and "reading" versions: changes of sensors
+(registry.changed) and changes of source readings in past blocks (changed, eg.
+backfills, edits and deletes) drop the memo of all processes within
+REGISTRY_CHECK_SECONDS. Readings posted to the current block change no version.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+import ast
+import math
+import re
+import threading
+
+from app import archive, db, models, registry
+from app.archive import EPOCH
+from flask import current_app
+
+try:
+    import numpy
+except ImportError: # optional dependency
+    numpy = None
+
+SOURCE_PATTERN = re.compile(r"^s(\d+)$")
+
+# name in the version table, see changed
+READING = "reading"
+
+_BINARY_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod)
+_UNARY_OPERATORS = (ast.UAdd, ast.USub)
+
+
+def _dewpoint(xp):
+    # magnus formula, temperature in °C and relative humidity in %
+    def dewpoint(temperature, humidity):
+        gamma = xp.log(humidity / 100) + 17.62 * temperature / (243.12 + temperature)
+        return 243.12 * gamma / (17.62 - gamma)
+    return dewpoint
+
+
+SCALAR_FUNCTIONS = {
+    "abs" : abs,
+    "min" : min,
+    "max" : max,
+    "sqrt" : math.sqrt,
+    "exp" : math.exp,
+    "log" : math.log,
+    "log10" : math.log10,
+    "dewpoint" : _dewpoint(math),
+}
+
+ARRAY_FUNCTIONS = None if numpy is None else {
+    "abs" : numpy.abs,
+    "min" : numpy.minimum,
+    "max" : numpy.maximum,
+    "sqrt" : numpy.sqrt,
+    "exp" : numpy.exp,
+    "log" : numpy.log,
+    "log10" : numpy.log10,
+    "dewpoint" : _dewpoint(numpy),
+}
+
+
+class _FloatConstants(ast.NodeTransformer):
+    def visit_Constant(self, node):
+        return ast.copy_location(ast.Constant(float(node.value)), node)
+
+
+@lru_cache(maxsize=256)
+def compile_expression(expression):
+    """ Validates and compiles an expression
+
+    Args:
+        expression (str): arithmetic over s<id> names, numbers and SCALAR_FUNCTIONS
+
+    Returns:
+        tuple: (code object, frozenset of source sensor ids)
+
+    Raises:
+        ValueError: if the expression is invalid
+    """
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as e:
+        raise ValueError("Invalid expression: '{}'".format(e.msg))
+
+    sources = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            match = SOURCE_PATTERN.match(node.id)
+            if match is None and node.id not in SCALAR_FUNCTIONS:
+                raise ValueError("Unknown name in expression: '{}'".format(node.id))
+            if match is not None:
+                sources.add(int(match.group(1)))
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in SCALAR_FUNCTIONS \
+                    or node.keywords:
+                raise ValueError("Only calls of {} are allowed".format(", ".join(SCALAR_FUNCTIONS)))
+        elif isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)):
+                raise ValueError("Only numbers are allowed as constants")
+        elif not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Load)
+                + _BINARY_OPERATORS + _UNARY_OPERATORS):
+            raise ValueError("Not allowed in expression: '{}'".format(type(node).__name__))
+
+    if len(sources) == 0:
+        raise ValueError("Expression needs at least one source sensor, eg. 's1'")
+    # float arithmetic overflows instead of growing integers, eg. 9**9**9**9
+    try:
+        tree = ast.fix_missing_locations(_FloatConstants().visit(tree))
+    except OverflowError:
+        raise ValueError("Constant too large in expression")
+    return compile(tree, "<expression>", "eval"), frozenset(sources)
+
+
+def validate(sensor_id, expression):
+    """ Checks that an expression compiles and only uses existing, non virtual sensors
+
+    Args:
+        sensor_id (int): id of the virtual sensor, None for new sensors
+        expression (str): expression of the virtual sensor
+
+    Raises:
+        ValueError: if the expression is invalid
+    """
+    if not isinstance(expression, str):
+        raise ValueError("Expression needs to be a string")
+    _, sources = compile_expression(expression)
+    for id in sources:
+        if id == sensor_id:
+            raise ValueError("Virtual sensor can not use itself")
+        source = registry.sensor(id)
+        if source is None:
+            raise ValueError("Unknown sensor id {} in expression".format(id))
+        if source.expression is not None:
+            raise ValueError("Virtual sensor can not use virtual sensor {}".format(id))
+
+
+class BlockCache:
+    """ Thread safe LRU memo of evaluated blocks: (sensor_id, block) -> [(datetime, value), ...]
+
+    Args:
+        max_blocks (int): maximum number of blocks
+    """
+    def __init__(self, max_blocks):
+        self.max_blocks = max_blocks
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._blocks.get(key)
+            if value is not None:
+                self._blocks.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._blocks[key] = value
+            while len(self._blocks) > self.max_blocks:
+                self._blocks.popitem(last=False)
+
+
+def init_app(app):
+    """ Sets up the memo of evaluated blocks
+
+    Args:
+        app: Flask app
+    """
+    max_blocks = app.config["VIRTUAL_CACHE_BLOCKS"]
+    app.extensions["virtual"] = registry.Registry((registry.SENSOR, READING),
+        lambda: BlockCache(max_blocks), app.config["REGISTRY_CHECK_SECONDS"])
+
+
+def _memo():
+    return current_app.extensions["virtual"].get()
+
+
+def invalidate():
+    """ Drops the memo of this process, eg. after registry.changed
+    """
+    current_app.extensions["virtual"].invalidate()
+
+
+def changed(sensor_ids=None, start=None):
+    """ Marks readings as changed, call before committing changes of readings
+
+    Increments the "reading" counter of the version table if memoized results are
+    affected: readings of a source of a virtual sensor before the current block.
+
+    Args:
+        sensor_ids: changed sensor ids, all if None
+        start (datetime): first changed datetime, no bound if None
+    """
+    span = _block_span()
+    if start is not None and (start - EPOCH) // span >= (datetime.utcnow() - EPOCH) // span:
+        # the current block is never memoized
+        return
+    if sensor_ids is not None:
+        sensor_ids = set(sensor_ids)
+        sources = set()
+        for sensor in registry.sensors().values():
+            if sensor.expression is not None:
+                try:
+                    sources |= compile_expression(sensor.expression)[1]
+                except ValueError:
+                    continue
+        if sources.isdisjoint(sensor_ids):
+            return
+    registry.bump_version(READING)
+    current_app.extensions["virtual"].invalidate_on_commit()
+
+
+def _bucket_span():
+    return timedelta(seconds=current_app.config["VIRTUAL_BUCKET_SECONDS"])
+
+
+def _block_span():
+    return _bucket_span() * current_app.config["VIRTUAL_BLOCK_BUCKETS"]
+
+
+def _bucket_means(readings, start, bucket):
+    # {bucket index : mean value}, relative to start
+    sums, counts = {}, {}
+    for dt, value in readings:
+        if value is None:
+            continue
+        index = (dt - start) // bucket
+        sums[index] = sums.get(index, 0.0) + value
+        counts[index] = counts.get(index, 0) + 1
+    return {index : sums[index] / counts[index] for index in sums}
+
+
+def _evaluate(code, sources, start, end):
+    """ Evaluates an expression for all buckets in [start, end)
+
+    Returns:
+        list: (datetime, value) tuples, one per bucket with readings of all sources
+    """
+    bucket = _bucket_span()
+    means = {id : _bucket_means(archive.readings_between(id, start, end), start, bucket)
+        for id in sources}
+    # buckets every source has readings in
+    indices = sorted(set.intersection(*(set(m) for m in means.values())))
+    if len(indices) == 0:
+        return []
+    datetimes = [start + bucket * index for index in indices]
+    # readings_between includes end
+    if datetimes[-1] >= end:
+        datetimes.pop()
+        indices.pop()
+
+    if numpy is not None:
+        namespace = dict(ARRAY_FUNCTIONS)
+        for id in sources:
+            namespace["s{}".format(id)] = numpy.array([means[id][i] for i in indices], dtype=float)
+        try:
+            with numpy.errstate(all="ignore"):
+                values = numpy.broadcast_to(eval(code, {"__builtins__" : {}}, namespace), len(indices))
+            values = [v if math.isfinite(v) else None for v in values.tolist()]
+        except (ArithmeticError, ValueError):
+            # python float arithmetic of constants, eg. 10.0**400
+            values = [None] * len(indices)
+    else:
+        values = []
+        for i in indices:
+            namespace = dict(SCALAR_FUNCTIONS)
+            for id in sources:
+                namespace["s{}".format(id)] = means[id][i]
+            try:
+                value = float(eval(code, {"__builtins__" : {}}, namespace))
+            except (ArithmeticError, ValueError):
+                value = None
+            values.append(value if value is not None and math.isfinite(value) else None)
+
+    return list(zip(datetimes, values))
+
+
+def _source_start(sources):
+    # earliest reading of any source, evaluation never starts before it
+    starts = [db.session.query(db.func.min(models.SensorReading.datetime)).filter(
+        models.SensorReading.sensor_id.in_(sources)).scalar(),
+        db.session.query(db.func.min(models.SensorReadingChunk.start)).filter(
+        models.SensorReadingChunk.sensor_id.in_(sources)).scalar()]
+    starts = [s for s in starts if s is not None]
+    return min(starts) if len(starts) > 0 else None
+
+
+def readings_between(sensor, start, end=None):
+    """ Returns the evaluated readings of a virtual sensor, memoized per block
+
+    Args:
+        sensor (Sensor): virtual sensor
+        start (datetime): lower bound, inclusive
+        end (datetime): upper bound, inclusive. now if None
+
+    Returns:
+        list: (datetime, value) tuples, datetime is the bucket start
+    """
+    code, sources = compile_expression(sensor.expression)
+    now = datetime.utcnow()
+    end = now if end is None or end > now else end
+
+    first_reading = _source_start(sources)
+    if first_reading is None or end < first_reading:
+        return []
+    start = max(start, first_reading)
+
+    cache = _memo()
+    span = _block_span()
+    first_block = (start - EPOCH) // span
+    last_block = (end - EPOCH) // span
+
+    readings = []
+    block = first_block
+    while block <= last_block:
+        cached = cache.get((sensor.id, block))
+        if cached is not None:
+            readings.extend(cached)
+            block += 1
+            continue
+
+        # evaluate the run of missing blocks at once
+        run_end = block
+        while run_end < last_block and cache.get((sensor.id, run_end + 1)) is None:
+            run_end += 1
+        run_start_dt = EPOCH + span * block
+        evaluated = _evaluate(code, sources, run_start_dt, EPOCH + span * (run_end + 1))
+        readings.extend(evaluated)
+
+        # memoize complete blocks of the past
+        by_block = {}
+        for dt, value in evaluated:
+            by_block.setdefault((dt - EPOCH) // span, []).append((dt, value))
+        for b in range(block, run_end + 1):
+            if EPOCH + span * (b + 1) <= now:
+                cache.set((sensor.id, b), by_block.get(b, []))
+        block = run_end + 1
+
+    return [r for r in readings if start - _bucket_span() < r[0] <= end]
+
+
+def sensor_readings_between(sensor, start, end=None):
+    """ Returns readings of a real or virtual sensor
+
+    Args:
+        sensor (Sensor): sensor
+        start (datetime): lower bound, inclusive
+        end (datetime): upper bound, inclusive. no bound if None
+
+    Returns:
+        list: (datetime, value) tuples, sorted by datetime
+    """
+    if sensor.expression is None:
+        return archive.readings_between(sensor.id, start, end)
+    return readings_between(sensor, start, end)
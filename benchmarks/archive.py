@@ -0,0 +1,77 @@
+""" Compression ratio and decode throughput of archived reading chunks
+
+Usage:
+    python -m benchmarks.archive [--readings N] [--chunk-size N]
+"""
+import argparse
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite://")
+
+from app.archive import decode_chunk, encode_chunk
+
+# id (8), sensor_id (8), value (8), datetime (~26 as text in sqlite) + index overhead
+ROW_BYTES = 50
+
+
+def generate(n, interval=10, jitter=False, decimals=1):
+    """ Generates a temperature like series
+
+    Args:
+        n (int): number of readings
+        interval (int): seconds between readings
+        jitter (bool): add sub second noise to the timestamps
+        decimals (int): rounding of the values
+    """
+    readings = []
+    dt = datetime(2021, 1, 1)
+    for i in range(n):
+        offset = timedelta(microseconds=random.randint(0, 200000)) if jitter else timedelta()
+        value = 20 + 5 * math.sin(i / 8640 * 2 * math.pi) + random.gauss(0, 0.1)
+        readings.append((dt + timedelta(seconds=i * interval) + offset, round(value, decimals)))
+    return readings
+
+
+def run(name, readings, chunk_size):
+    chunks = [readings[i:i + chunk_size] for i in range(0, len(readings), chunk_size)]
+
+    t0 = time.perf_counter()
+    encoded = [encode_chunk(chunk) for chunk in chunks]
+    t1 = time.perf_counter()
+    for data in encoded:
+        decode_chunk(data)
+    t2 = time.perf_counter()
+
+    size = sum(len(data) for data in encoded)
+    print("{:<28} {:>8.2f} B/reading {:>8.1f}x {:>12.0f} enc/s {:>12.0f} dec/s".format(
+        name,
+        size / len(readings),
+        len(readings) * ROW_BYTES / size,
+        len(readings) / (t1 - t0),
+        len(readings) / (t2 - t1),
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readings", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    random.seed(0)
+    print("{} readings, chunk size {}, ratio against ~{} B/row\n".format(
+        args.readings, args.chunk_size, ROW_BYTES))
+    run("10s, 1 decimal", generate(args.readings), args.chunk_size)
+    run("10s, 2 decimals", generate(args.readings, decimals=2), args.chunk_size)
+    run("10s + jitter, 1 decimal", generate(args.readings, jitter=True), args.chunk_size)
+    run("60s, constant", [(dt, 1.0) for dt, _ in generate(args.readings, interval=60)],
+        args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
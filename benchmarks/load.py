@@ -0,0 +1,317 @@
+""" Load test of devices posting readings alongside dashboards
+
+Starts the production server (flask serve) on a temporary sqlite database, or
+uses a running instance with --url, and simulates:
+    devices:    every device posts batches of readings of its own sensor to
+                /api/sensor/reading, at --rate readings/s per device
+    dashboards: the flow of sensor.html, /api/sensor, a day of readings of all
+                sensors and a poll of the last minute every --poll seconds.
+                Dashboards are reloaded every --session seconds
+
+Clients are spread over --processes processes, every device and dashboard is a
+thread. Devices send on a fixed schedule, so a saturated server shows up as a
+falling ingest rate, growing latencies and errors instead of slowed down clients.
+
+All clients post from one address and would share one rate limit bucket, so the
+started server runs without rate limits (LIMIT_CLIENT_RATE and LIMIT_SENSOR_RATE
+0). Rejections by rate limits (429) are counted apart from errors, eg. of an
+instance given with --url.
+
+Every --interval seconds the ingest rate, error rate, rate limited share and
+latency percentiles per endpoint are printed. With several --devices levels, each level runs --duration
+seconds and a summary per level is printed, to find the saturation point.
+
+Usage:
+    python -m benchmarks.load [--devices 10,50,100] [--dashboards N] [--rate R] [--batch N]
+        [--workers N] [--threads N] [--duration S] [--url URL]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+from benchmarks.serve import wait_for
+
+# latency columns
+INGEST = "ingest"   # POST /api/sensor/reading
+SENSORS = "sensors" # GET /api/sensor
+DAY = "day"         # GET /api/sensor/reading, last day
+POLL = "poll"       # GET /api/sensor/reading, last minute
+ENDPOINTS = (INGEST, SENSORS, DAY, POLL)
+
+
+def populate(uri, sensors, history):
+    os.environ["SQLALCHEMY_DATABASE_URI"] = uri
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    from app import create_app, db, models
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        now = datetime.utcnow()
+        for i in range(sensors):
+            sensor = models.Sensor(name="load{}".format(i))
+            db.session.add(sensor)
+            db.session.add_all([models.SensorReading(sensor=sensor, value=j % 100 / 10,
+                datetime=now - timedelta(seconds=history * (j + 1))) for j in range(86400 // history)])
+            db.session.commit()
+
+
+def request(url, data=None):
+    """ Returns the http status code, None on connection errors, raises nothing
+    """
+    if data is not None:
+        data = json.dumps(data).encode()
+    req = urllib.request.Request(url, data=data, headers={"Content-Type" : "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        e.close()
+        return e.code
+    except (urllib.error.URLError, OSError):
+        return None
+
+
+class Recorder:
+    """ Collects (endpoint, time, latency, status, readings) samples of a client process
+    """
+    def __init__(self, results):
+        self.results = results
+        self._samples = []
+        self._lock = threading.Lock()
+
+    def call(self, endpoint, url, data=None, readings=0):
+        t0 = time.time()
+        status = request(url, data)
+        ok = status is not None and status < 400
+        with self._lock:
+            self._samples.append((endpoint, t0, time.time() - t0, status, readings if ok else 0))
+
+    def flush(self):
+        with self._lock:
+            samples, self._samples = self._samples, []
+        if samples:
+            self.results.put(samples)
+
+
+def device(recorder, base, sensor_id, rate, batch, deadline):
+    interval = batch / rate
+    next_time = time.time()
+    while next_time < deadline:
+        time.sleep(max(0, next_time - time.time()))
+        now = time.time()
+        readings = [{"sensor_id" : sensor_id, "value" : round(20 + (i % 50) / 10, 1),
+            "datetime" : now - (batch - 1 - i) / rate} for i in range(batch)]
+        recorder.call(INGEST, base + "/api/sensor/reading", readings, batch)
+        next_time += interval
+        if next_time < time.time() - interval:
+            # too far behind, skip missed batches
+            next_time = time.time()
+
+
+def dashboard(recorder, base, sensor_ids, poll, session, deadline):
+    ids = urllib.parse.urlencode([("sensor_id[]", id) for id in sensor_ids])
+    url = base + "/api/sensor/reading?" + ids + "&start={}&end={}"
+    while time.time() < deadline:
+        opened = time.time()
+        recorder.call(SENSORS, base + "/api/sensor")
+        now = time.time()
+        recorder.call(DAY, url.format(now - 86400, now))
+        while time.time() < min(deadline, opened + session):
+            time.sleep(max(0, min(poll, deadline - time.time())))
+            if time.time() >= deadline:
+                break
+            now = time.time()
+            recorder.call(POLL, url.format(now - 60, now))
+
+
+def client(base, devices, dashboards, sensor_ids, args, start, deadline, results):
+    recorder = Recorder(results)
+    threads = [threading.Thread(target=device, args=(recorder, base, id, args.rate, args.batch,
+        deadline), daemon=True) for id in devices]
+    threads += [threading.Thread(target=dashboard, args=(recorder, base, sensor_ids, args.poll,
+        args.session, deadline), daemon=True) for _ in range(dashboards)]
+
+    # start spread over a second, not as one burst
+    time.sleep(max(0, start - time.time()))
+    for thread in threads:
+        thread.start()
+        time.sleep(1 / len(threads))
+    while any(thread.is_alive() for thread in threads):
+        time.sleep(0.5)
+        recorder.flush()
+    recorder.flush()
+
+
+def percentile(values, p):
+    # nearest rank
+    if len(values) == 0:
+        return float("nan")
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+class Stats:
+    """ Ingest rate, error rate, rate limited share and latency percentiles of samples
+    """
+    def __init__(self):
+        self.latencies = {endpoint : [] for endpoint in ENDPOINTS}
+        self.errors = 0
+        self.limited = 0
+        self.requests = 0
+        self.readings = 0
+
+    def add(self, sample):
+        endpoint, _, latency, status, readings = sample
+        self.latencies[endpoint].append(latency)
+        self.requests += 1
+        # rejected by rate limits, not by a saturated server
+        if status == 429:
+            self.limited += 1
+        elif status is None or status >= 400:
+            self.errors += 1
+        self.readings += readings
+
+    def line(self, label, seconds):
+        parts = ["{:>8}".format(label),
+            "{:>10.0f}".format(self.readings / seconds),
+            "{:>10.1f}".format(self.requests / seconds),
+            "{:>8.2f}".format(100 * self.errors / max(1, self.requests)),
+            "{:>8.2f}".format(100 * self.limited / max(1, self.requests))]
+        for endpoint in ENDPOINTS:
+            values = sorted(self.latencies[endpoint])
+            parts.append("{:>6.0f} {:>6.0f} {:>6.0f}".format(
+                *(1000 * percentile(values, p) for p in (50, 95, 99))))
+        return " ".join(parts)
+
+
+def header():
+    columns = ["{:>8}".format(""), "{:>10}".format("readings/s"), "{:>10}".format("requests/s"),
+        "{:>8}".format("errors %"), "{:>8}".format("429 %")]
+    columns += ["{:>20}".format(endpoint + " p50/p95/p99 ms") for endpoint in ENDPOINTS]
+    return " ".join(columns)
+
+
+def run_level(base, devices, args, sensor_ids):
+    """ Runs devices and dashboards for args.duration seconds, prints stats per interval
+
+    Returns:
+        Stats: of the whole run
+    """
+    results = multiprocessing.Queue()
+    processes = min(args.processes, devices + args.dashboards)
+    start = time.time() + 1
+    deadline = start + args.duration
+    workers = []
+    for p in range(processes):
+        ids = sensor_ids[:devices][p::processes]
+        dashboards = len(range(p, args.dashboards, processes))
+        workers.append(multiprocessing.Process(target=client,
+            args=(base, ids, dashboards, sensor_ids, args, start, deadline, results)))
+    for worker in workers:
+        worker.start()
+
+    total = Stats()
+    interval = Stats()
+    interval_end = start + args.interval
+    while any(worker.is_alive() for worker in workers) or not results.empty():
+        try:
+            samples = results.get(timeout=0.5)
+        except queue.Empty:
+            samples = []
+        for sample in samples:
+            # samples arrive in batches, attribute them by start time
+            while sample[1] >= interval_end:
+                print(interval.line("{:.0f}s".format(interval_end - start), args.interval))
+                interval = Stats()
+                interval_end += args.interval
+            interval.add(sample)
+            total.add(sample)
+    for worker in workers:
+        worker.join()
+    if interval.requests > 0:
+        print(interval.line("{:.0f}s".format(interval_end - start), args.interval))
+    return total
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--devices", default="10",
+        help="number of devices, comma separated levels are run one after another")
+    parser.add_argument("--dashboards", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=0.1, help="readings/s per device")
+    parser.add_argument("--batch", type=int, default=1, help="readings per post")
+    parser.add_argument("--poll", type=float, default=60, help="seconds between dashboard polls")
+    parser.add_argument("--session", type=float, default=300, help="seconds until a dashboard reloads")
+    parser.add_argument("--duration", type=float, default=60, help="seconds per level")
+    parser.add_argument("--interval", type=float, default=10, help="seconds per printed line")
+    parser.add_argument("--processes", type=int, default=cpus, help="client processes")
+    parser.add_argument("--history", type=int, default=60,
+        help="seconds between the readings of the last day, created for every sensor")
+    parser.add_argument("--workers", type=int, default=None, help="server workers")
+    parser.add_argument("--threads", type=int, default=None, help="threads per server worker")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--url", default=None,
+        help="base url of a running instance, eg. http://127.0.0.1:5000, instead of starting one")
+    args = parser.parse_args()
+    levels = [int(d) for d in args.devices.split(",")]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server = None
+        if args.url is None:
+            uri = "sqlite:///" + os.path.join(tmp, "load.db")
+            populate(uri, max(levels), args.history)
+            # all devices post from one address
+            env = dict(os.environ, FLASK_APP="main.py", SQLALCHEMY_DATABASE_URI=uri,
+                LIMIT_CLIENT_RATE="0", LIMIT_SENSOR_RATE="0")
+            env.setdefault("SECRET_KEY", "benchmark")
+            command = [sys.executable, "-m", "flask", "serve", "--port", str(args.port)]
+            if args.workers:
+                command += ["--workers", str(args.workers)]
+            if args.threads:
+                command += ["--threads", str(args.threads)]
+            server = subprocess.Popen(command, env=env,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            base = "http://127.0.0.1:{}".format(args.port)
+        else:
+            base = args.url.rstrip("/")
+
+        try:
+            wait_for(base + "/api/timestamp")
+            with urllib.request.urlopen(base + "/api/sensor") as response:
+                sensor_ids = sorted(int(id) for id in json.loads(response.read()))
+            if len(sensor_ids) < max(levels):
+                raise SystemExit("Need {} sensors, found {}".format(max(levels), len(sensor_ids)))
+
+            summaries = []
+            for devices in levels:
+                print("\n{} devices at {} readings/s in batches of {}, {} dashboards\n".format(
+                    devices, args.rate, args.batch, args.dashboards))
+                print(header())
+                total = run_level(base, devices, args, sensor_ids)
+                summaries.append(total.line(str(devices), args.duration))
+
+            print("\nper level (devices), offered ingest {} readings/s per device\n".format(args.rate))
+            print(header())
+            for line in summaries:
+                print(line)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == "__main__":
+    main()
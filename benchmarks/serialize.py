@@ -0,0 +1,66 @@
+""" Serialization of large reading responses
+
+Compares the previous path (SensorReading.to_dict + flask.jsonify) against the
+app JSON provider and the row serializers and rows_response of app.serialize.
+
+Usage:
+    python -m benchmarks.serialize [--readings N] [--repeat N]
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "sqlite://")
+
+import flask
+from app import create_app, models, serialize
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readings", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    start = datetime(2021, 1, 1)
+    rows = [(start + timedelta(seconds=10 * i), 20.0 + (i % 100) / 10) for i in range(args.readings)]
+    readings = [models.SensorReading(id=i, sensor_id=1, datetime=dt, value=v)
+        for i, (dt, v) in enumerate(rows)]
+
+    app = create_app()
+    with app.app_context():
+        serializer = serialize.row_serializer(
+            models.SensorReading.datetime, models.SensorReading.value)
+        cases = {
+            "to_dict + flask.jsonify" : lambda: flask.jsonify(
+                {1 : [r.to_dict("value", "datetime") for r in readings]}),
+            "dicts + provider ({})".format(app.extensions["json_provider"].name) : lambda:
+                serialize.jsonify({1 : [{"datetime" : dt, "value" : v} for dt, v in rows]}),
+            "row_serializer" : lambda: serialize.raw_response(
+                serialize.dumps_object([(1, serializer(rows))])),
+            "rows_response" : lambda: serialize.rows_response(
+                (models.SensorReading.datetime, models.SensorReading.value), [(1, rows)]),
+        }
+
+        print("{} readings, best of {}\n".format(args.readings, args.repeat))
+        baseline = None
+        for name, func in cases.items():
+            seconds = best_of(args.repeat, func)
+            baseline = baseline or seconds
+            print("{:<32} {:>8.1f} ms {:>12.0f} readings/s {:>6.1f}x".format(
+                name, seconds * 1000, args.readings / seconds, baseline / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+""" Throughput of the production server (flask serve) by number of workers
+
+Starts the server on a temporary sqlite database for every worker count and
+requests a day of readings from concurrent client processes.
+
+Usage:
+    python -m benchmarks.serve [--workers 1,2,4] [--threads N] [--clients N] [--duration S]
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+URL = "http://127.0.0.1:{port}/api/sensor/reading?days=1&sensor_id[]=1"
+
+
+def populate(uri, readings):
+    os.environ["SQLALCHEMY_DATABASE_URI"] = uri
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    from app import create_app, db, models
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        sensor = models.Sensor(name="benchmark")
+        db.session.add(sensor)
+        now = datetime.utcnow()
+        db.session.add_all([models.SensorReading(sensor=sensor, value=i % 100 / 10,
+            datetime=now - timedelta(seconds=10 * i)) for i in range(readings)])
+        db.session.commit()
+
+
+def client(url, deadline, counter):
+    count = 0
+    while time.time() < deadline:
+        with urllib.request.urlopen(url) as response:
+            response.read()
+        count += 1
+    with counter.get_lock():
+        counter.value += count
+
+
+def wait_for(url, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+def run(env, port, workers, threads, clients, duration):
+    server = subprocess.Popen([sys.executable, "-m", "flask", "serve", "--port", str(port),
+        "--workers", str(workers), "--threads", str(threads)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = URL.format(port=port)
+        wait_for(url)
+        counter = multiprocessing.Value("i", 0)
+        deadline = time.time() + duration
+        processes = [multiprocessing.Process(target=client, args=(url, deadline, counter))
+            for _ in range(clients)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        return counter.value / duration
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", default=",".join(str(2 ** i) for i in range(cpus.bit_length())))
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--clients", type=int, default=2 * cpus)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--readings", type=int, default=8640) # one day every 10 seconds
+    parser.add_argument("--port", type=int, default=5099)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = "sqlite:///" + os.path.join(tmp, "benchmark.db")
+        env = dict(os.environ, FLASK_APP="main.py", SQLALCHEMY_DATABASE_URI=uri)
+        env.setdefault("SECRET_KEY", "benchmark")
+        populate(uri, args.readings)
+
+        print("{} cpus, {} threads per worker, {} clients, {} readings per response\n".format(
+            cpus, args.threads, args.clients, args.readings))
+        baseline = None
+        for workers in [int(w) for w in args.workers.split(",")]:
+            rate = run(env, args.port, workers, args.threads, args.clients, args.duration)
+            baseline = baseline or rate
+            print("{:>3} workers {:>10.1f} requests/s {:>6.2f}x".format(workers, rate, rate / baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,4 +7,82 @@ class Config:
     SECRET_KEY = os.environ["SECRET_KEY"]
     SQLALCHEMY_DATABASE_URI = os.environ["SQLALCHEMY_DATABASE_URI"]
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    
\ No newline at end of file
+
+    # "auto", "orjson" or "stdlib", see app.serialize
+    JSON_PROVIDER = os.environ.get("JSON_PROVIDER", "auto")
+
+    # readings older than this are packed into compressed chunks by `flask archive`
+    ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", 30))
+    # maximum number of readings per archived chunk
+    ARCHIVE_CHUNK_SIZE = int(os.environ.get("ARCHIVE_CHUNK_SIZE", 1024))
+
+    # response compression, see app.compress
+    COMPRESS_ALGORITHMS = os.environ.get("COMPRESS_ALGORITHMS", "zstd,br,gzip").split(",")
+    COMPRESS_LEVELS = {
+        "gzip" : int(os.environ.get("COMPRESS_LEVEL_GZIP", 6)),
+        "br" : int(os.environ.get("COMPRESS_LEVEL_BR", 4)),
+        "zstd" : int(os.environ.get("COMPRESS_LEVEL_ZSTD", 3)),
+    }
+    COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+    COMPRESS_MIMETYPES = {
+        "application/json",
+        "application/javascript",
+        "text/css",
+        "text/html",
+        "text/plain",
+    }
+    # bytes of compressed response bodies kept in memory, 0 disables caching
+    COMPRESS_CACHE_SIZE = int(os.environ.get("COMPRESS_CACHE_SIZE", 16 * 1024 * 1024))
+
+    # reading tiles, see app.tiles
+    TILE_BASE_SECONDS = int(os.environ.get("TILE_BASE_SECONDS", 60))
+    TILE_MAX_LEVEL = int(os.environ.get("TILE_MAX_LEVEL", 24))
+    TILE_POINTS = int(os.environ.get("TILE_POINTS", 256))
+    # Cache-Control max-age of tiles that lie completely in the past
+    TILE_MAX_AGE = int(os.environ.get("TILE_MAX_AGE", 3600))
+    # plots of windows with more readings per sensor are loaded as tiles
+    PLOT_MAX_POINTS = int(os.environ.get("PLOT_MAX_POINTS", 10000))
+
+    # rows per statement of bulk reading updates and deletes
+    BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE", 1000))
+
+    # production server, see app.server
+    SERVER_HOST = os.environ.get("SERVER_HOST", "127.0.0.1")
+    SERVER_PORT = int(os.environ.get("SERVER_PORT", 5000))
+    SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", os.cpu_count() or 1))
+    SERVER_THREADS = int(os.environ.get("SERVER_THREADS", 4))
+    # "auto" (gunicorn if installed), "gunicorn" or "builtin"
+    SERVER_BACKEND = os.environ.get("SERVER_BACKEND", "auto")
+    # connections handled or waiting for a thread per worker
+    SERVER_MAX_CONNECTIONS = int(os.environ.get("SERVER_MAX_CONNECTIONS", 100))
+    # seconds until a stalled connection or request is dropped
+    SERVER_TIMEOUT = int(os.environ.get("SERVER_TIMEOUT", 30))
+
+    # handling of posted readings with an existing (sensor_id, datetime): "ignore" or "overwrite"
+    READING_CONFLICT = os.environ.get("READING_CONFLICT", "ignore")
+
+    # virtual sensors, see app.virtual
+    VIRTUAL_BUCKET_SECONDS = int(os.environ.get("VIRTUAL_BUCKET_SECONDS", 60))
+    VIRTUAL_BLOCK_BUCKETS = int(os.environ.get("VIRTUAL_BLOCK_BUCKETS", 1024))
+    VIRTUAL_CACHE_BLOCKS = int(os.environ.get("VIRTUAL_CACHE_BLOCKS", 4096))
+
+    # alert rules, see app.rules
+    # seconds between checks of stale rules in production server workers, 0 disables
+    RULE_CHECK_SECONDS = float(os.environ.get("RULE_CHECK_SECONDS", 30))
+    # events are posted to this url, eg. of a local listener
+    RULE_WEBHOOK_URL = os.environ.get("RULE_WEBHOOK_URL")
+    RULE_WEBHOOK_TIMEOUT = float(os.environ.get("RULE_WEBHOOK_TIMEOUT", 5))
+
+    # seconds between checks for sensors and rules changed by other processes, see app.registry
+    REGISTRY_CHECK_SECONDS = float(os.environ.get("REGISTRY_CHECK_SECONDS", 1))
+
+    # maximum number of sub-queries of POST /api/query
+    QUERY_MAX_QUERIES = int(os.environ.get("QUERY_MAX_QUERIES", 64))
+
+    # token buckets of posted readings, see app.limiter. rates are readings per second, 0 disables
+    LIMIT_SENSOR_RATE = float(os.environ.get("LIMIT_SENSOR_RATE", 10))
+    LIMIT_CLIENT_RATE = float(os.environ.get("LIMIT_CLIENT_RATE", 100))
+    # bucket size, in seconds of the rate
+    LIMIT_BURST_SECONDS = float(os.environ.get("LIMIT_BURST_SECONDS", 10))
+    # buckets kept in memory, least recently used are dropped
+    LIMIT_MAX_BUCKETS = int(os.environ.get("LIMIT_MAX_BUCKETS", 100000))
@@ -1,4 +1,4 @@
-from app import create_app, db, models
+from app import create_app, db, models, server
 
 app = create_app()
 
@@ -10,3 +10,8 @@ def make_shell_context():
         "Sensor" : models.Sensor,
         "SensorReading": models.SensorReading,
     }
+
+
+if __name__ == "__main__":
+    # production server, same as "flask serve"
+    server.serve(app, app.config["SERVER_HOST"], app.config["SERVER_PORT"])
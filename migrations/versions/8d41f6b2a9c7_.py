@@ -0,0 +1,33 @@
+"""unique sensor readings per sensor and datetime
+
+Revision ID: 8d41f6b2a9c7
+Revises: 3c9a5e7d1f02
+Create Date: 2026-10-19 11:37:05.102934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41f6b2a9c7'
+down_revision = '3c9a5e7d1f02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # remove duplicates of retried requests, the first stored reading is kept
+    op.execute(
+        "DELETE FROM sensor_reading WHERE id NOT IN "
+        "(SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM sensor_reading "
+        "GROUP BY sensor_id, datetime) AS keep)"
+    )
+    # batch mode recreates the table on sqlite
+    with op.batch_alter_table('sensor_reading', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_sensor_reading_sensor_id_datetime', ['sensor_id', 'datetime'])
+
+
+def downgrade():
+    with op.batch_alter_table('sensor_reading', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_sensor_reading_sensor_id_datetime', type_='unique')
@@ -0,0 +1,93 @@
+import datetime
+import unittest
+
+from app import archive, db, models
+from test_basic import TestCaseWebApp, populate_db
+
+
+class TestChunkEncoding(unittest.TestCase):
+    def test_roundtrip(self):
+        start = datetime.datetime(2021, 9, 11)
+        readings = [
+            (start, 21.5),
+            (start + datetime.timedelta(seconds=10), 21.5),
+            (start + datetime.timedelta(seconds=20), None),
+            (start + datetime.timedelta(seconds=30, microseconds=1234), -3.25),
+            (start + datetime.timedelta(days=3), 1e300),
+            (start + datetime.timedelta(days=2), 0.1), # out of order
+        ]
+        self.assertEqual(archive.decode_chunk(archive.encode_chunk(readings)), readings)
+
+        # edge cases
+        self.assertEqual(archive.decode_chunk(archive.encode_chunk([])), [])
+        self.assertEqual(archive.decode_chunk(archive.encode_chunk(readings[:1])), readings[:1])
+
+    def test_compression(self):
+        start = datetime.datetime(2021, 9, 11)
+        readings = [(start + datetime.timedelta(seconds=10 * i), 20.0) for i in range(1000)]
+        # regular timestamps and constant values need about 2 bits per reading
+        self.assertLess(len(archive.encode_chunk(readings)), 300)
+
+
+class TestArchive(TestCaseWebApp):
+    def setUp(self):
+        super().setUp()
+        self.n = 4
+        populate_db(self.n)
+        self.client = self.app.test_client()
+
+
+    def tearDown(self):
+        super().tearDown()
+        self.client = None
+
+
+    def test_archive_readings(self):
+        before = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+        count = models.SensorReading.query.filter(models.SensorReading.datetime < before).count()
+
+        archived = archive.archive_readings(before, chunk_size=2)
+        self.assertEqual(archived, count)
+        self.assertEqual(models.SensorReading.query.count(), self.n * self.n - count)
+        self.assertEqual(sum(c.count for c in models.SensorReadingChunk.query), count)
+        # paged per chunk
+        self.assertTrue(all(c.count <= 2 for c in models.SensorReadingChunk.query))
+        self.assertEqual(archive.archive_readings(before, chunk_size=2), 0)
+
+        # archived readings are still served by the api
+        data = self.client.get("/api/sensor/reading", query_string={"days":1}).get_json()
+        self.assertEqual(len([r for readings in data.values() for r in readings]), self.n * self.n)
+        for readings in data.values():
+            datetimes = [r["datetime"] for r in readings]
+            self.assertEqual(datetimes, sorted(datetimes))
+
+        # only the newest reading of each sensor lies in the last minute
+        data = self.client.get("/api/sensor/reading", query_string={"minutes":1}).get_json()
+        self.assertEqual(len([r for readings in data.values() for r in readings]), self.n)
+
+    def test_archived_reading_post(self):
+        archive.archive_readings(datetime.datetime.utcnow() - datetime.timedelta(minutes=1), chunk_size=2)
+        chunk = models.SensorReadingChunk.query.filter(
+            models.SensorReadingChunk.start < models.SensorReadingChunk.end).first()
+        dt = chunk.start + (chunk.end - chunk.start) / 2
+        self.assertEqual(archive.find_archived([(chunk.sensor_id, dt), (chunk.sensor_id, chunk.end
+            + datetime.timedelta(days=1))]), [(chunk.sensor_id, dt)])
+
+        # not stored twice, eg. by retries of old readings
+        count = models.SensorReading.query.count()
+        response = self.client.post("/api/sensor/reading", json=[{"sensor_id" : chunk.sensor_id,
+            "value" : 1, "datetime" : dt.timestamp()}])
+        self.assertEqual(response.status_code, 400)
+        reading = models.SensorReading.query.filter_by(sensor_id=chunk.sensor_id).first()
+        response = self.client.put("/api/sensor/reading/{}".format(reading.id),
+            json={"datetime" : dt.timestamp()})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("archived", response.get_json()["message"])
+        self.assertEqual(models.SensorReading.query.count(), count)
+
+
+    def test_sensor_delete_cascade(self):
+        archive.archive_readings(datetime.datetime.utcnow())
+        models.Sensor.query.filter_by(id=1).delete()
+        db.session.commit()
+        self.assertIsNone(models.SensorReadingChunk.query.filter_by(sensor_id=1).first())
@@ -5,7 +5,8 @@ import unittest
 import app
 import config
 import sqlalchemy.exc
-from app import db, models
+from app import archive, db, models
+from app.api import sensors as sensors_api
 from flask import current_app
 
 config.Config.SQLALCHEMY_DATABASE_URI = "sqlite://"
@@ -202,8 +203,17 @@ class TestApi(TestCaseWebApp):
         data = response_last_minute.get_json()
         self.assertEqual(len([r for readings in data.values() for r in readings]), 1)
 
+        # absolute range, only the newest reading of each sensor (30 seconds old)
+        now = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).timestamp()
+        response_range = get(200, query_string={"start":now - 60, "end":now - 10})
+        data = response_range.get_json()
+        self.assertEqual(len([r for readings in data.values() for r in readings]), self.n)
+
         # ask for non existent sensor
         get(400, query_string={"sensor_id[]":999999})
+        get(400, query_string={"sensor_id[]":"abc"})
+        get(400, query_string={"sensor_id[]":"1.5"})
+        get(400, query_string={"start":"yesterday"})
 
 
     def test_sensor_reading_post(self):
@@ -231,9 +241,70 @@ class TestApi(TestCaseWebApp):
         post(400, json={"sensor_id": 1, "value" : "not a float"})
         post(400, json={"sensor_id": 1, "not a column" : None})
         post(400, json={"value":1.3}) # sensor_id missing
+        # ids int() would truncate or convert
+        post(400, json={"sensor_id":1.7, "value":1})
+        post(400, json={"sensor_id":True, "value":1})
         post(400, json=[{"sensor_id":1}, {}]) # one valid, one invalid
 
 
+    def test_sensor_reading_post_retry(self):
+        post = lambda status_code, **kwargs: self.request(self.client.post, "/api/sensor/reading", status_code, **kwargs)
+        batch = [{"sensor_id":1, "value":1, "datetime":1631377439}, {"sensor_id":2, "value":2, "datetime":1631377439}]
+        count = models.SensorReading.query.count()
+
+        # retries do not duplicate readings
+        first = post(200, json=batch).get_json()
+        retry = post(200, json=batch).get_json()
+        self.assertEqual(first, retry)
+        self.assertEqual(models.SensorReading.query.count(), count + 2)
+
+        # duplicates within a batch
+        post(200, json=[batch[0], batch[0]])
+        self.assertEqual(models.SensorReading.query.count(), count + 2)
+
+        # overwrite existing values
+        changed = post(200, json=dict(batch[0], value=3), query_string={"on_conflict":"overwrite"}).get_json()
+        self.assertEqual(changed[0]["id"], first[0]["id"])
+        self.assertEqual(models.SensorReading.query.get(first[0]["id"]).value, 3)
+        ignored = post(200, json=dict(batch[0], value=4)).get_json()
+        self.assertEqual(ignored[0]["value"], 3)
+
+        post(400, json=batch, query_string={"on_conflict":"invalid"})
+
+
+    def test_sensor_reading_post_response(self):
+        post = lambda status_code, **kwargs: self.request(self.client.post, "/api/sensor/reading", status_code, **kwargs)
+        # only the posted readings are returned, not the ones in between, in chunks of keys
+        batch = [{"sensor_id":1, "value":i, "datetime":time.time() - 7 * 86400 * i} for i in range(2)]
+        post(200, json=batch)
+        chunk_size = sensors_api.READING_KEY_CHUNK_SIZE
+        sensors_api.READING_KEY_CHUNK_SIZE = 1
+        try:
+            batch.append({"sensor_id":2, "value":2, "datetime":time.time()})
+            stored = post(200, json=batch).get_json()
+        finally:
+            sensors_api.READING_KEY_CHUNK_SIZE = chunk_size
+        self.assertEqual([(r["sensor_id"], r["value"]) for r in stored], [(1, 0), (1, 1), (2, 2)])
+        # numeric string ids
+        stored = post(200, json={"sensor_id":"2", "value":3}).get_json()
+        self.assertEqual([(r["sensor_id"], r["value"]) for r in stored], [(2, 3)])
+
+
+    def test_sensor_reading_upsert_fallback(self):
+        # dialects without "ON CONFLICT"
+        dialects = models.SensorReading.UPSERT_DIALECTS
+        models.SensorReading.UPSERT_DIALECTS = {}
+        try:
+            row = {"sensor_id":1, "value":5, "datetime":datetime.datetime(2021, 9, 11)}
+            models.SensorReading.upsert([row])
+            models.SensorReading.upsert([dict(row, value=6)])
+            self.assertEqual(models.SensorReading.query.filter_by(datetime=row["datetime"]).one().value, 5)
+            models.SensorReading.upsert([dict(row, value=6)], on_conflict="overwrite")
+            self.assertEqual(models.SensorReading.query.filter_by(datetime=row["datetime"]).one().value, 6)
+        finally:
+            models.SensorReading.UPSERT_DIALECTS = dialects
+
+
     def test_sensor_reading_delete(self):
         delete = lambda status_code, id, **kwargs: self.request(self.client.delete, "/api/sensor/reading/" + str(id), status_code, **kwargs)
 
@@ -261,3 +332,65 @@ class TestApi(TestCaseWebApp):
 
         # does not exist
         put(400, 999999, json={"value":1})
+
+
+    def test_sensor_reading_bulk_delete(self):
+        delete = lambda status_code, **kwargs: self.request(self.client.delete, "/api/sensor/reading", status_code, **kwargs)
+        sensor = models.Sensor.query.get(1)
+        count = len(sensor.readings)
+
+        # dry run only counts
+        response = delete(200, json={"sensor_id":sensor.id, "dry_run":True})
+        self.assertEqual(response.get_json()["count"], count)
+        self.assertEqual(len(sensor.readings), count)
+        response = delete(200, json={"sensor_id":sensor.id, "dry_run":"true"})
+        self.assertTrue(response.get_json()["dry_run"])
+        for dry_run in ("yes", 2, None, [True]):
+            delete(400, json={"sensor_id":sensor.id, "dry_run":dry_run})
+        response = delete(200, json={"sensor_id":sensor.id, "dry_run":"false", "start":0, "end":0})
+        self.assertFalse(response.get_json()["dry_run"])
+        self.assertEqual(len(sensor.readings), count)
+
+        # older than one minute, archived readings included
+        archive.archive_readings(datetime.datetime.utcnow() - datetime.timedelta(seconds=75))
+        end = datetime.datetime.utcnow().replace(tzinfo=datetime.timezone.utc).timestamp() - 60
+        response = delete(200, json={"sensor_id":[sensor.id], "end":end})
+        self.assertEqual(response.get_json()["count"], count - 1)
+        self.assertEqual(response.get_json()["archived"], count - 1)
+        self.assertIsNone(models.SensorReadingChunk.query.filter_by(sensor_id=sensor.id).first())
+
+        # whole sensor, chunked by one row per statement
+        self.app.config["BULK_CHUNK_SIZE"] = 1
+        response = delete(200, json={"sensor_id":sensor.id})
+        self.assertEqual(response.get_json()["count"], 1)
+        self.assertEqual(models.SensorReading.query.filter_by(sensor_id=sensor.id).count(), 0)
+
+        # invalid
+        delete(400, json={}) # no filter
+        delete(400, json={"sensor_id":999999})
+        delete(400, json={"sensor_id":1, "start":"yesterday"})
+
+
+    def test_sensor_reading_bulk_put(self):
+        put = lambda status_code, **kwargs: self.request(self.client.put, "/api/sensor/reading", status_code, **kwargs)
+        sensor = models.Sensor.query.get(1)
+        values = sorted(r.value for r in sensor.readings)
+
+        # scale and offset
+        response = put(200, json={"sensor_id":sensor.id, "scale":2, "offset":1})
+        self.assertEqual(response.get_json()["count"], len(values))
+        db.session.expire_all()
+        self.assertEqual(sorted(r.value for r in sensor.readings), [v * 2 + 1 for v in values])
+
+        # null values
+        put(200, json={"sensor_id":sensor.id, "value":None})
+        db.session.expire_all()
+        self.assertTrue(all(r.value is None for r in sensor.readings))
+
+        # invalid
+        put(400, json={"sensor_id":sensor.id}) # no change
+        put(400, json={"sensor_id":sensor.id, "scale":"a"})
+        put(400, json={"sensor_id":sensor.id, "scale":True})
+        put(400, json={"sensor_id":True, "scale":2})
+        put(400, json={"sensor_id":sensor.id, "start":True, "scale":2})
+        put(400, json={"sensor_id":sensor.id, "value":1, "offset":1})
@@ -0,0 +1,72 @@
+import gzip
+import json
+
+from app import compress
+from flask import Response
+from test_basic import TestCaseWebApp, populate_db
+
+
+class TestCompress(TestCaseWebApp):
+    def setUp(self):
+        super().setUp()
+        populate_db(20)
+        self.client = self.app.test_client()
+
+
+    def tearDown(self):
+        super().tearDown()
+        self.client = None
+
+
+    def get(self, url, encoding=None, **kwargs):
+        headers = {} if encoding is None else {"Accept-Encoding": encoding}
+        response = self.client.get(url, headers=headers, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+
+    def test_gzip(self):
+        plain = self.get("/api/sensor/reading", query_string={"days":1})
+        self.assertNotIn("Content-Encoding", plain.headers)
+        self.assertIn("Accept-Encoding", plain.headers["Vary"])
+
+        response = self.get("/api/sensor/reading", "gzip", query_string={"days":1})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertLess(len(response.data), len(plain.data))
+        self.assertEqual(json.loads(gzip.decompress(response.data)), plain.get_json())
+
+        # gzip not acceptable
+        response = self.get("/api/sensor/reading", "gzip;q=0", query_string={"days":1})
+        self.assertNotIn("Content-Encoding", response.headers)
+
+
+    def test_min_size(self):
+        response = self.get("/api/timestamp", "gzip")
+        self.assertNotIn("Content-Encoding", response.headers)
+
+
+    def test_cache(self):
+        cache = self.app.extensions["compress"]
+        first = self.get("/api/sensor", "gzip")
+        second = self.get("/api/sensor", "gzip")
+        self.assertEqual(first.data, second.data)
+        self.assertEqual((cache.misses, cache.hits), (1, 1))
+        self.assertEqual(cache.size, len(first.data))
+
+        # lru eviction by size
+        cache = compress.CompressionCache(10)
+        cache.set("a", b"12345")
+        cache.set("b", b"12345")
+        cache.get("a")
+        cache.set("c", b"12345")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), b"12345")
+
+
+    def test_streamed(self):
+        self.app.add_url_rule("/stream", "stream",
+            lambda: Response((str(i) for i in range(1000)), mimetype="text/plain"))
+        response = self.get("/stream", "gzip")
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", response.headers)
+        self.assertEqual(gzip.decompress(response.data), "".join(str(i) for i in range(1000)).encode())
@@ -0,0 +1,108 @@
+from app import limiter
+from test_basic import TestCaseWebApp, populate_db
+
+
+class TestTokenBuckets(TestCaseWebApp):
+    def test_refill(self):
+        buckets = limiter.TokenBuckets(10)
+        # rate 2/s, burst 4
+        cost = lambda n: {"a" : (n, 2, 4)}
+        self.assertEqual(buckets.acquire(cost(4), now=0), 0)
+        self.assertEqual(buckets.acquire(cost(1), now=0), 0.5)
+        self.assertEqual(buckets.acquire(cost(1), now=0.5), 0)
+        # refill is capped by the burst
+        self.assertEqual(buckets.acquire(cost(4), now=100), 0)
+        self.assertEqual(buckets.acquire(cost(1), now=100), 0.5)
+
+
+    def test_debt(self):
+        buckets = limiter.TokenBuckets(10)
+        # batches larger than the burst are accepted from a full bucket
+        self.assertEqual(buckets.acquire({"a" : (10, 2, 4)}, now=0), 0)
+        self.assertEqual(buckets.acquire({"a" : (1, 2, 4)}, now=0), 3.5)
+        self.assertEqual(buckets.acquire({"a" : (1, 2, 4)}, now=3.5), 0)
+
+
+    def test_all_or_none(self):
+        buckets = limiter.TokenBuckets(10)
+        self.assertEqual(buckets.acquire({"a" : (1, 1, 1)}, now=0), 0)
+        # b has tokens but a does not
+        self.assertEqual(buckets.acquire({"a" : (1, 1, 1), "b" : (1, 1, 1)}, now=0), 1)
+        self.assertEqual(buckets.acquire({"b" : (1, 1, 1)}, now=0), 0)
+
+
+    def test_lru(self):
+        buckets = limiter.TokenBuckets(2)
+        buckets.acquire({"a" : (1, 1, 1)}, now=0)
+        buckets.acquire({"b" : (1, 1, 1)}, now=0)
+        buckets.acquire({"a" : (0, 1, 1)}, now=0)
+        buckets.acquire({"c" : (1, 1, 1)}, now=0)
+        # a is kept, b is dropped and starts full again
+        self.assertEqual(buckets.acquire({"a" : (1, 1, 1)}, now=0), 1)
+        self.assertEqual(buckets.acquire({"b" : (1, 1, 1)}, now=0), 0)
+
+
+class TestLimiter(TestCaseWebApp):
+    def setUp(self):
+        super().setUp()
+        populate_db()
+        self.client = self.app.test_client()
+        self.app.config["LIMIT_BURST_SECONDS"] = 1
+
+
+    def tearDown(self):
+        super().tearDown()
+        self.client = None
+
+
+    def post(self, sensor_id, count=1):
+        return self.client.post("/api/sensor/reading",
+            json=[{"sensor_id" : sensor_id, "value" : i} for i in range(count)])
+
+
+    def test_sensor_limit(self):
+        response = self.client.put("/api/sensor/1", json={"rate_limit" : "0.5"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["rate_limit"], 0.5)
+
+        count = lambda: len(self.client.get("/api/sensor/reading",
+            query_string={"sensor_id" : 1, "days" : 1}).get_json()["1"])
+        before = count()
+        self.assertEqual(self.post(1).status_code, 200)
+        response = self.post(1)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers["Retry-After"], "2")
+        # nothing was written
+        self.assertEqual(count(), before + 1)
+
+        # other sensors have their own bucket
+        self.assertEqual(self.post(2).status_code, 200)
+
+        # 0 disables the limit of the sensor
+        self.client.put("/api/sensor/1", json={"rate_limit" : 0})
+        for _ in range(5):
+            self.assertEqual(self.post(1).status_code, 200)
+
+
+    def test_client_limit(self):
+        self.app.config["LIMIT_CLIENT_RATE"] = 5
+        self.assertEqual(self.post(1, 3).status_code, 200)
+        self.assertEqual(self.post(2, 2).status_code, 200)
+        self.assertEqual(self.post(2).status_code, 429)
+
+
+    def test_rejected_batch(self):
+        # invalid batches take no tokens
+        self.app.config["LIMIT_CLIENT_RATE"] = 1
+        response = self.client.post("/api/sensor/reading",
+            json=[{"sensor_id" : 1, "value" : 1}, {"sensor_id" : 1, "unknown" : 1}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post("/api/sensor/reading", json=[{"sensor_id" : 9}]).status_code, 400)
+        self.assertEqual(self.post(1).status_code, 200)
+        self.assertEqual(self.post(1).status_code, 429)
+
+
+    def test_invalid_rate_limit(self):
+        self.assertEqual(self.client.put("/api/sensor/1", json={"rate_limit" : -1}).status_code, 400)
+        self.assertEqual(self.client.post("/api/sensor",
+            json={"name" : "New", "rate_limit" : "x"}).status_code, 400)
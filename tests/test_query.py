@@ -0,0 +1,89 @@
+import datetime
+
+from app import archive, db, models, query, registry
+from test_basic import TestCaseWebApp
+
+
+class TestQuery(TestCaseWebApp):
+    def setUp(self):
+        super().setUp()
+        # three sensors with a reading every hour over 40 days
+        self.now = datetime.datetime.utcnow()
+        for i in range(3):
+            sensor = models.Sensor(name="Sensor{}".format(i))
+            db.session.add(sensor)
+            db.session.add_all([models.SensorReading(sensor=sensor, value=float(j),
+                datetime=self.now - datetime.timedelta(hours=j)) for j in range(40 * 24)])
+        db.session.commit()
+        self.client = self.app.test_client()
+
+
+    def tearDown(self):
+        super().tearDown()
+        self.client = None
+
+
+    def test_merge(self):
+        d = lambda day: datetime.datetime(2021, 9, day)
+        self.assertEqual(query._merge([(d(5), d(8)), (d(1), d(3)), (d(2), d(4))]),
+            [(d(1), d(4)), (d(5), d(8))])
+        self.assertEqual(query._merge([(d(1), None), (d(2), d(3))]), [(d(1), None)])
+        self.assertEqual(query._merge([(d(2), d(3)), (d(3), None)]), [(d(2), None)])
+
+
+    def test_plan(self):
+        sensors = registry.sensors()
+        day = self.now - datetime.timedelta(days=1)
+        month = self.now - datetime.timedelta(days=30)
+
+        plan = query.ReadingPlan()
+        a = plan.add([sensors[1], sensors[2]], day, None)
+        b = plan.add([sensors[1]], month, None)
+        c = plan.add([sensors[3]], month, day)
+        # month of 1, day of 2, month until a day ago of 3
+        self.assertEqual(plan.execute(), 3)
+
+        for index, ids, start, end in [(a, (1, 2), day, None), (b, (1,), month, None),
+                (c, (3,), month, day)]:
+            self.assertEqual(plan.result(index),
+                [(id, archive.readings_between(id, start, end)) for id in ids])
+        # start is inclusive
+        self.assertEqual(len(plan.result(b)[0][1]), 30 * 24 + 1)
+
+        # equal ranges of several sensors are one scan
+        plan = query.ReadingPlan()
+        plan.add(list(sensors.values()), day, None)
+        plan.add([sensors[2]], day, None)
+        self.assertEqual(plan.execute(), 1)
+
+
+    def test_query_post(self):
+        post = lambda *queries: self.client.post("/api/query", json={"queries" : list(queries)})
+        response = post(
+            {"type" : "sensor"},
+            {"type" : "sensor", "filter" : {"name" : ["Sensor1"]}},
+            {"type" : "reading", "sensor_id" : [1, 2], "days" : 1},
+            {"type" : "reading", "sensor_id" : [1], "days" : 30},
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0], self.client.get("/api/sensor").get_json())
+        self.assertEqual(list(results[1]), ["2"])
+        self.assertEqual(results[2], self.client.get("/api/sensor/reading",
+            query_string={"sensor_id[]" : [1, 2], "days" : 1}).get_json())
+        self.assertEqual(len(results[3]["1"]), 30 * 24)
+
+        # ids are converted before deduplicating
+        response = post({"type" : "reading", "sensor_id" : ["1", 1], "days" : 1})
+        self.assertEqual(response.get_json(), [{"1" : results[2]["1"]}])
+
+        # invalid
+        self.assertEqual(post().status_code, 400)
+        self.assertEqual(post({"type" : "unknown"}).status_code, 400)
+        self.assertEqual(post({"type" : "sensor", "filter" : {"unknown" : [1]}}).status_code, 400)
+        self.assertEqual(post({"type" : "reading", "sensor_id" : [9]}).status_code, 400)
+        for ids in (["x"], [True], [1.5], [[1]]):
+            self.assertEqual(post({"type" : "reading", "sensor_id" : ids}).status_code, 400)
+        self.assertEqual(post({"type" : "reading", "days" : "x"}).status_code, 400)
+        self.assertEqual(self.client.post("/api/query", json=[]).status_code, 400)
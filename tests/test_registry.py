@@ -0,0 +1,122 @@
+from app import db, models, registry
+from sqlalchemy import event
+from test_basic import TestCaseWebApp, populate_db
+
+
+class TestRegistry(TestCaseWebApp):
+    def setUp(self):
+        super().setUp()
+        populate_db()
+        self.client = self.app.test_client()
+        self.statements = []
+        event.listen(db.engine, "before_cursor_execute", self.count)
+
+
+    def tearDown(self):
+        event.remove(db.engine, "before_cursor_execute", self.count)
+        super().tearDown()
+        self.client = None
+
+
+    def count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+
+    def test_cached(self):
+        self.assertEqual(set(registry.sensors()), {1, 2})
+        self.assertEqual(registry.sensor("2").name, "Sensor1")
+        self.assertIsNone(registry.sensor(3))
+        self.assertIsNone(registry.sensor(None))
+
+        # no db round trip within REGISTRY_CHECK_SECONDS
+        self.statements.clear()
+        registry.sensor(1)
+        registry.sensors()
+        self.assertEqual(self.statements, [])
+
+
+    def test_changed(self):
+        registry.sensors()
+        response = self.client.post("/api/sensor", json={"name" : "New"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(registry.get_version(registry.SENSOR), 1)
+        self.assertEqual(registry.sensor(3).name, "New")
+
+        self.client.put("/api/sensor/3", json={"name" : "Renamed"})
+        self.assertEqual(registry.sensor(3).name, "Renamed")
+        self.client.delete("/api/sensor/3")
+        self.assertIsNone(registry.sensor(3))
+        self.assertEqual(registry.get_version(registry.SENSOR), 3)
+
+
+    def test_invalidate_on_commit(self):
+        cache = self.app.extensions["registry"]
+        registry.sensors()
+        # dropped once committed, not before and not on rollback
+        db.session.add(models.Sensor(name="New"))
+        registry.changed()
+        db.session.flush()
+        self.assertIsNotNone(cache._data)
+        db.session.rollback()
+        self.assertIsNotNone(cache._data)
+
+        db.session.add(models.Sensor(name="New"))
+        registry.changed()
+        db.session.commit()
+        self.assertIsNone(cache._data)
+        self.assertEqual(registry.sensor(3).name, "New")
+
+
+    def test_invalidated_while_loading(self):
+        calls = []
+
+        def load():
+            calls.append(1)
+            if len(calls) == 1:
+                # eg. a concurrent request committed a change
+                cache.invalidate()
+            return len(calls)
+
+        cache = registry.Registry(registry.SENSOR, load, 60)
+        # returned, but not kept
+        self.assertEqual(cache.get(), 1)
+        self.assertEqual(cache.get(), 2)
+        self.assertEqual(cache.get(), 2)
+
+
+    def test_other_process(self):
+        cache = self.app.extensions["registry"]
+        cache.check_seconds = 0
+        registry.sensors()
+
+        # changed by another process: stale until the version changes
+        db.session.query(models.Sensor).filter(models.Sensor.id == 1).update({"name" : "Other"})
+        db.session.commit()
+        self.assertEqual(registry.sensor(1).name, "Sensor0")
+        registry.bump_version(registry.SENSOR)
+        db.session.commit()
+        self.assertEqual(registry.sensor(1).name, "Other")
+
+        # a version check is a single query
+        self.statements.clear()
+        registry.sensors()
+        self.assertEqual(len(self.statements), 1)
+
+
+    def test_reading_post_lookups(self):
+        registry.sensors()
+        self.statements.clear()
+        response = self.client.post("/api/sensor/reading", json=[
+            {"sensor_id" : 1, "value" : i, "datetime" : 1631377439 + i} for i in range(10)])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any("FROM sensor " in s for s in self.statements))
+
+        response = self.client.post("/api/sensor/reading", json={"sensor_id" : 3, "value" : 1})
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_column_metadata(self):
+        self.assertIs(models.Sensor.column_names(), models.Sensor.column_names())
+        self.assertIn("expression", models.Sensor.column_names())
+        self.assertNotEqual(models.Sensor.column_names(), models.SensorReading.column_names())
+        self.assertIs(models.Sensor.column_properties(), models.Sensor.column_properties())
@@ -0,0 +1,290 @@
+import datetime
+import http.server
+import json
+import os
+import tempfile
+import threading
+
+import app
+from app import db, models, registry, rules
+from test_basic import TestCaseWebApp
+
+
+def spec(kind, above=None, below=None, minutes=None):
+    return rules.RuleSpec(1, 1, kind, above, below, minutes)
+
+
+def feed(state, values, start=datetime.datetime(2021, 9, 11), step=60):
+    # active state changes, None where unchanged
+    return [state.update(start + datetime.timedelta(seconds=step * i), value)
+        for i, value in enumerate(values)]
+
+
+class TestRuleStates(TestCaseWebApp):
+    def test_threshold(self):
+        state = rules.ThresholdState(spec("threshold", above=10, below=0))
+        self.assertEqual(feed(state, [5, 11, 12, None, 5, -1, 0]),
+            [None, True, None, None, False, True, False])
+
+
+    def test_hysteresis(self):
+        state = rules.HysteresisState(spec("hysteresis", above=10, below=8))
+        self.assertEqual(feed(state, [9, 11, 9, 8, 7.9, 9, 10.5]),
+            [None, True, None, None, False, None, True])
+
+
+    def test_rate(self):
+        # rise of more than 2 within 5 minutes
+        state = rules.RateState(spec("rate", above=2, minutes=5))
+        self.assertEqual(feed(state, [0, 1, 2, 2.5, 3, 3.5, 3.5, 3.5, 3.5]),
+            [None, None, None, True, None, None, None, False, None])
+        # readings out of the window are dropped
+        self.assertEqual(len(state.window), 6)
+
+
+    def test_out_of_order(self):
+        state = rules.ThresholdState(spec("threshold", above=10))
+        start = datetime.datetime(2021, 9, 11)
+        self.assertEqual(state.update(start, 11), True)
+        self.assertIsNone(state.update(start - datetime.timedelta(seconds=1), 0))
+        self.assertTrue(state.active)
+
+
+    def test_validate(self):
+        rules.validate({"kind" : "threshold", "below" : 0})
+        rules.validate({"kind" : "stale", "minutes" : 10})
+        for data in [{"kind" : "unknown"}, {"kind" : "threshold"},
+                {"kind" : "hysteresis", "above" : 1, "below" : 2},
+                {"kind" : "rate", "above" : 1}, {"kind" : "stale", "minutes" : 0},
+                {"kind" : "threshold", "above" : "1"}]:
+            with self.assertRaises(ValueError):
+                rules.validate(data)
+
+
+class TestRulesApi(TestCaseWebApp):
+    def setUp(self):
+        super().setUp()
+        db.session.add(models.Sensor(name="Sensor"))
+        db.session.commit()
+        self.client = self.app.test_client()
+
+
+    def tearDown(self):
+        super().tearDown()
+        self.client = None
+
+
+    def post_readings(self, *values, client=None):
+        start = datetime.datetime.utcnow().timestamp() - len(values)
+        response = (client or self.client).post("/api/sensor/reading", json=[
+            {"sensor_id" : 1, "value" : v, "datetime" : start + i} for i, v in enumerate(values)])
+        self.assertEqual(response.status_code, 200)
+
+
+    def events(self, since=0):
+        response = self.client.get("/api/rule/event", query_string={"since" : since})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+
+    def test_rule_post(self):
+        post = lambda data: self.client.post("/api/rule", json=data)
+        self.assertEqual(post({"sensor_id" : 1, "kind" : "threshold", "above" : 25}).status_code, 200)
+        self.assertEqual(post({"sensor_id" : 2, "kind" : "threshold", "above" : 25}).status_code, 400)
+        self.assertEqual(post({"sensor_id" : 1, "kind" : "stale"}).status_code, 400)
+        self.assertEqual(post({"sensor_id" : 1, "unknown" : 1}).status_code, 400)
+        self.assertEqual(post({"sensor_id" : 1, "kind" : "threshold", "above" : 25,
+            "active" : True}).status_code, 400)
+        self.assertEqual(len(self.client.get("/api/rule").get_json()), 1)
+        self.assertEqual(self.client.put("/api/rule/1", json={"last" : 0}).status_code, 400)
+
+        # virtual sensors have no readings to evaluate
+        virtual = self.client.post("/api/sensor", json={"name" : "Virtual", "expression" : "s1 * 2"})
+        self.assertEqual(virtual.status_code, 200)
+        virtual_id = virtual.get_json()["id"]
+        self.assertEqual(post({"sensor_id" : virtual_id, "kind" : "threshold", "above" : 25}).status_code, 400)
+        self.assertEqual(self.client.put("/api/rule/1", json={"sensor_id" : virtual_id}).status_code, 400)
+        other = self.client.post("/api/sensor", json={"name" : "Other"}).get_json()["id"]
+        response = self.client.put("/api/sensor/1", json={"expression" : "s{} * 2".format(other)})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("has rules", response.get_json()["message"])
+
+        response = self.client.put("/api/rule/1", json={"below" : 30})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["below"], 30)
+        self.assertEqual(self.client.put("/api/rule/1", json={"kind" : "stale"}).status_code, 400)
+        self.assertEqual(self.client.delete("/api/rule/1").status_code, 200)
+        self.assertEqual(self.client.get("/api/rule").get_json(), {})
+
+
+    def test_ingest(self):
+        self.client.post("/api/rule", json={"sensor_id" : 1, "kind" : "threshold", "above" : 25})
+        self.post_readings(20, 26, 27, 24)
+        events = self.events()
+        self.assertEqual([(e["active"], e["value"]) for e in events], [(True, 26), (False, 24)])
+        self.assertEqual(self.events(since=events[0]["id"]), events[1:])
+        limited = lambda limit: self.client.get("/api/rule/event", query_string={"limit" : limit}).get_json()
+        self.assertEqual(limited(-1), events[:1])
+        self.assertEqual(limited(10 ** 9), events)
+
+        # state is kept on reload, retries do not fire again
+        self.client.post("/api/rule", json={"sensor_id" : 1, "kind" : "stale", "minutes" : 5})
+        self.post_readings(30)
+        self.post_readings(30)
+        self.assertEqual(len(self.events()), 3)
+
+        # new rules start with the state of the stored readings
+        self.client.post("/api/rule", json={"sensor_id" : 1, "kind" : "threshold", "below" : 40})
+        self.post_readings(31)
+        self.assertEqual(len(self.events()), 3)
+        self.assertTrue(self.client.get("/api/rule").get_json()["3"]["active"])
+
+        # and so do changed ones, renaming keeps the state
+        self.client.put("/api/rule/3", json={"below" : 20})
+        self.assertFalse(self.client.get("/api/rule").get_json()["3"]["active"])
+        self.client.put("/api/rule/1", json={"name" : "Hot"})
+        self.assertTrue(self.client.get("/api/rule").get_json()["1"]["active"])
+        self.assertEqual(len(self.events()), 3)
+
+
+    def test_rate(self):
+        # rise of more than 2 within 5 minutes, see TestRuleStates.test_rate
+        self.client.post("/api/rule", json={"sensor_id" : 1, "kind" : "rate", "above" : 2, "minutes" : 5})
+        start = datetime.datetime.utcnow().timestamp() - 3600
+        readings = [{"sensor_id" : 1, "value" : v, "datetime" : start + 60 * i}
+            for i, v in enumerate([0, 1, 2, 2.5, 3, 3.5, 3.5, 3.5, 3.5])]
+        # single posts and a batch read their window from the stored readings
+        for reading in readings[:5]:
+            self.client.post("/api/sensor/reading", json=reading)
+        self.client.post("/api/sensor/reading", json=readings[5:])
+        self.assertEqual([(e["active"], e["value"]) for e in self.events()], [(True, 2.5), (False, 3.5)])
+
+
+    def test_stale(self):
+        self.client.post("/api/rule", json={"sensor_id" : 1, "kind" : "stale", "minutes" : 5})
+        self.post_readings(1)
+        now = datetime.datetime.utcnow()
+        self.assertEqual(rules.check(now), [])
+
+        events = rules.check(now + datetime.timedelta(minutes=6))
+        self.assertEqual(len(events), 1)
+        self.assertTrue(events[0]["active"])
+        # fires once
+        self.assertEqual(rules.check(now + datetime.timedelta(minutes=12)), [])
+
+        # the next reading clears
+        self.client.post("/api/sensor/reading", json={"sensor_id" : 1,
+            "datetime" : (now + datetime.timedelta(minutes=13)).timestamp()})
+        self.assertEqual([e["active"] for e in self.events()], [True, False])
+
+
+    def test_stale_without_readings(self):
+        # counts from the creation of the rule
+        self.client.post("/api/rule", json={"sensor_id" : 1, "kind" : "stale", "minutes" : 5})
+        now = datetime.datetime.utcnow()
+        self.assertEqual(rules.check(now + datetime.timedelta(minutes=4)), [])
+        self.assertEqual(len(rules.check(now + datetime.timedelta(minutes=6))), 1)
+
+
+    def test_changed_by_other_process(self):
+        self.app.extensions["rules"].check_seconds = 0
+        self.post_readings(30)
+
+        db.session.add(models.Rule(sensor_id=1, kind="threshold", above=25))
+        registry.bump_version(rules.RULE)
+        db.session.commit()
+        self.post_readings(31)
+        self.assertEqual([e["active"] for e in self.events()], [True])
+
+
+    def test_workers(self):
+        # two app instances on one database, eg. server workers
+        db.session.remove()
+        with tempfile.TemporaryDirectory() as path:
+            workers = [app.create_app() for _ in range(2)]
+            for worker in workers:
+                worker.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(path, "app.db")
+            with workers[0].app_context():
+                db.create_all()
+            clients = [worker.test_client() for worker in workers]
+            try:
+                clients[0].post("/api/sensor", json={"name" : "Sensor"})
+                clients[1].post("/api/rule", json={"sensor_id" : 1, "kind" : "threshold", "above" : 10})
+                # alternating readings fire each change once
+                for i, value in enumerate([5, 11, 12, 5, 5]):
+                    self.post_readings(value, client=clients[i % 2])
+                events = clients[0].get("/api/rule/event").get_json()
+                self.assertEqual([(e["active"], e["value"]) for e in events], [(True, 11), (False, 5)])
+
+                # stale rules fire once, the readings of all workers count
+                clients[0].post("/api/rule", json={"sensor_id" : 1, "kind" : "stale", "minutes" : 5})
+                self.post_readings(1, client=clients[1])
+                now = datetime.datetime.utcnow()
+                with workers[0].app_context():
+                    self.assertEqual(rules.check(now + datetime.timedelta(minutes=4)), [])
+                fired = []
+                for worker in workers:
+                    with worker.app_context():
+                        fired += rules.check(now + datetime.timedelta(minutes=6))
+                self.assertEqual(len(fired), 1)
+            finally:
+                for worker in workers:
+                    with worker.app_context():
+                        db.engine.dispose()
+
+
+    def test_webhook(self):
+        received = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                received.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        httpd = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+        # handle_request returns if nothing is posted
+        httpd.timeout = 5
+        thread = threading.Thread(target=httpd.handle_request)
+        thread.start()
+        try:
+            self.app.extensions["rules_notifier"] = rules.Notifier(
+                "http://127.0.0.1:{}/".format(httpd.server_port), 5)
+            self.client.post("/api/rule", json={"sensor_id" : 1, "kind" : "threshold", "above" : 0})
+            self.post_readings(1)
+            thread.join(5)
+        finally:
+            httpd.server_close()
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0][0]["rule_id"], 1)
+
+
+    def test_notifier_close(self):
+        received = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_POST(self):
+                received.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+                self.send_response(204)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        httpd = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+        httpd.timeout = 5
+        thread = threading.Thread(target=lambda: [httpd.handle_request() for _ in range(2)])
+        thread.start()
+        try:
+            notifier = rules.Notifier("http://127.0.0.1:{}/".format(httpd.server_port), 5)
+            notifier.send([1])
+            notifier.send([2])
+            # queued events are posted before closing
+            notifier.close(5)
+            self.assertEqual(received, [[1], [2]])
+            thread.join(5)
+        finally:
+            httpd.server_close()
@@ -0,0 +1,65 @@
+import datetime
+import json
+
+from app import models, serialize
+from test_basic import TestCaseWebApp, populate_db
+
+
+class TestSerialize(TestCaseWebApp):
+    def setUp(self):
+        super().setUp()
+        populate_db(2)
+        self.client = self.app.test_client()
+
+
+    def tearDown(self):
+        super().tearDown()
+        self.client = None
+
+
+    def test_providers(self):
+        obj = {1 : [{"datetime" : datetime.datetime(2021, 9, 11, 18, 23, 59, 560886), "value" : 1.5}]}
+        expected = {"1" : [{"datetime" : "2021-09-11T18:23:59Z", "value" : 1.5}]}
+
+        providers = [serialize.StdlibJSONProvider()]
+        if serialize.orjson is not None:
+            providers.append(serialize.OrjsonJSONProvider())
+        for provider in providers:
+            self.assertEqual(json.loads(provider.dumps(obj)), expected)
+
+        # flask.jsonify uses the same datetime format
+        self.assertEqual(self.app.json_encoder().encode(obj[1][0]["datetime"]), '"2021-09-11T18:23:59Z"')
+
+
+    def test_row_serializer(self):
+        readings = models.SensorReading.query.all()
+        columns = (models.SensorReading.id, models.SensorReading.sensor_id,
+            models.SensorReading.value, models.SensorReading.datetime)
+        rows = [(r.id, r.sensor_id, r.value, r.datetime) for r in readings]
+
+        # same output as the dict based path
+        serializer = serialize.row_serializer(*columns)
+        self.assertEqual(json.loads(serializer(rows)), [r.to_dict() for r in readings])
+        # invalid JSON values become null
+        self.assertEqual(serializer([(1, 1, float("nan"), readings[0].datetime)])[:40],
+            '[{"id":1,"sensor_id":1,"value":null,"dat')
+
+        self.assertEqual(serializer([]), "[]")
+        self.assertEqual(serializer(iter(rows)), serializer(rows))
+
+        builder = serialize.row_builder(*columns)
+        self.assertEqual(builder(rows)[0]["id"], readings[0].id)
+        builder = serialize.row_builder(models.SensorReading.datetime, models.SensorReading.value)
+        self.assertEqual(builder([(readings[0].datetime, 1.5)]),
+            [{"datetime" : readings[0].datetime, "value" : 1.5}])
+
+
+    def test_reading_get(self):
+        response = self.client.get("/api/sensor/reading", query_string={"days":1})
+        self.assertEqual(response.mimetype, "application/json")
+        data = response.get_json()
+
+        expected = {str(s.id) : sorted(
+            [r.to_dict("datetime", "value") for r in s.readings], key=lambda r: r["datetime"])
+            for s in models.Sensor.query}
+        self.assertEqual(data, expected)
@@ -0,0 +1,68 @@
+import socket
+import threading
+import time
+import urllib.request
+
+from app import server
+from test_basic import TestCaseWebApp
+
+
+class TestServer(TestCaseWebApp):
+    def test_pooled_server(self):
+        httpd = server.PooledWSGIServer("127.0.0.1", 0, self.app, threads=2)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            url = "http://127.0.0.1:{}/api/timestamp".format(httpd.port)
+            for _ in range(4):
+                with urllib.request.urlopen(url) as response:
+                    self.assertEqual(response.status, 200)
+        finally:
+            httpd.shutdown()
+            thread.join()
+
+
+    def test_shutdown_hooks(self):
+        calls = []
+        failing = server.register_shutdown(lambda: 1 / 0)
+        flush = server.register_shutdown(lambda: calls.append("flush"))
+        try:
+            # failing hooks do not stop the others
+            server.run_shutdown_hooks(self.app)
+            self.assertEqual(calls, ["flush"])
+        finally:
+            server._shutdown_hooks.remove(failing)
+            server._shutdown_hooks.remove(flush)
+
+
+    def test_stalled_connection(self):
+        httpd = server.PooledWSGIServer("127.0.0.1", 0, self.app, threads=1,
+            max_connections=1, timeout=0.5)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            # a client sending nothing holds the only connection until the timeout
+            stalled = socket.create_connection(("127.0.0.1", httpd.port))
+            start = time.monotonic()
+            url = "http://127.0.0.1:{}/api/timestamp".format(httpd.port)
+            with urllib.request.urlopen(url, timeout=5) as response:
+                self.assertEqual(response.status, 200)
+            self.assertGreater(time.monotonic() - start, 0.4)
+            stalled.settimeout(5)
+            self.assertEqual(stalled.recv(1024), b"")
+            stalled.close()
+        finally:
+            httpd.shutdown()
+            thread.join()
+
+
+    def test_respawn_delay(self):
+        delay = 0
+        delays = []
+        for _ in range(8):
+            delay = server._respawn_delay(delay, 0.1)
+            delays.append(delay)
+        self.assertEqual(delays[:3], [0.5, 1, 2])
+        self.assertEqual(delays[-1], server.RESPAWN_MAX_DELAY)
+        # workers crashing after running a while are restarted at once
+        self.assertEqual(server._respawn_delay(delay, server.RESPAWN_RESET_SECONDS), 0)
@@ -0,0 +1,72 @@
+import datetime
+
+from app import db, models, tiles
+from test_basic import TestCaseWebApp
+
+
+class TestTiles(TestCaseWebApp):
+    def setUp(self):
+        super().setUp()
+        # one reading every 10 seconds over 2 hours, starting at a level 7 tile (7680 seconds)
+        self.start = datetime.datetime(2021, 9, 11, 3, 44)
+        sensor = models.Sensor(name="Sensor")
+        db.session.add(sensor)
+        db.session.add_all([models.SensorReading(sensor=sensor, value=i % 10,
+            datetime=self.start + datetime.timedelta(seconds=10 * i)) for i in range(720)])
+        db.session.commit()
+        self.client = self.app.test_client()
+
+
+    def tearDown(self):
+        super().tearDown()
+        self.client = None
+
+
+    def test_tile_range(self):
+        start, end = tiles.tile_range(7, 0, 60)
+        self.assertEqual(end - start, datetime.timedelta(seconds=7680))
+        start, end = tiles.tile_range(7, 3, 60)
+        self.assertEqual(start, datetime.datetime(1970, 1, 1) + 3 * datetime.timedelta(seconds=7680))
+
+
+    def test_downsample(self):
+        start = self.start
+        readings = [(start + datetime.timedelta(seconds=i), float(i)) for i in range(100)]
+        buckets = tiles.downsample(readings, start, start + datetime.timedelta(seconds=100), 10)
+        self.assertEqual(len(buckets), 10)
+        self.assertEqual(buckets[0], (start, 4.5, 0.0, 9.0))
+
+        # nothing to reduce
+        self.assertEqual(len(tiles.downsample(readings, start, start + datetime.timedelta(seconds=100), 100)), 100)
+
+
+    def test_tile_get(self):
+        get = lambda **kwargs: self.client.get("/api/sensor/reading/tile", query_string=kwargs)
+        index = int((self.start - datetime.datetime(1970, 1, 1)).total_seconds()) // 7680
+
+        # downsampled to TILE_POINTS (256) buckets of 30 seconds, 2 hours are covered
+        response = get(**{"sensor_id[]":1, "level":7, "index":index})
+        self.assertEqual(response.status_code, 200)
+        entries = response.get_json()["1"]
+        self.assertEqual(len(entries), 240)
+        self.assertEqual(entries[0]["min"], 0)
+        self.assertEqual(entries[0]["max"], 2)
+        # past tiles are cacheable
+        self.assertEqual(response.cache_control.max_age, self.app.config["TILE_MAX_AGE"])
+
+        # zoomed in, full resolution: 6 readings in one minute
+        response = get(**{"sensor_id[]":1, "level":0, "index":index * 128})
+        self.assertEqual(len(response.get_json()["1"]), 6)
+
+        # invalid
+        self.assertEqual(get(**{"sensor_id[]":1, "level":-1, "index":0}).status_code, 400)
+        self.assertEqual(get(**{"sensor_id[]":1, "level":1}).status_code, 400)
+        self.assertEqual(get(**{"sensor_id[]":99, "level":1, "index":0}).status_code, 400)
+
+
+    def test_plot_config(self):
+        self.app.config["TILE_BASE_SECONDS"] = 30
+        for url in ("/sensor", "/sensor/1"):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b'"tileBaseMs": 30000', response.data)
@@ -0,0 +1,139 @@
+import datetime
+
+from app import db, models, registry, virtual
+from test_basic import TestCaseWebApp
+
+
+class TestVirtual(TestCaseWebApp):
+    def setUp(self):
+        super().setUp()
+        # two sources with one reading every 30 seconds over an hour, in the past
+        self.start = datetime.datetime(2021, 9, 11, 12, 0)
+        self.a = models.Sensor(name="A")
+        self.b = models.Sensor(name="B")
+        db.session.add_all([self.a, self.b])
+        db.session.add_all([models.SensorReading(sensor=self.a, value=1.0,
+            datetime=self.start + datetime.timedelta(seconds=30 * i)) for i in range(120)])
+        db.session.add_all([models.SensorReading(sensor=self.b, value=float(i // 2),
+            datetime=self.start + datetime.timedelta(seconds=30 * i)) for i in range(120)])
+        self.sum = models.Sensor(name="Sum", expression="s1 + s2")
+        db.session.add(self.sum)
+        db.session.commit()
+        self.client = self.app.test_client()
+
+
+    def tearDown(self):
+        super().tearDown()
+        self.client = None
+
+
+    def get_readings(self, sensor_id):
+        start = (self.start - datetime.datetime(1970, 1, 1)).total_seconds()
+        response = self.client.get("/api/sensor/reading", query_string={
+            "sensor_id[]" : sensor_id, "start" : start, "end" : start + 3600})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()[str(sensor_id)]
+
+
+    def test_compile_expression(self):
+        _, sources = virtual.compile_expression("dewpoint(s1, s2) - 2 * s13")
+        self.assertEqual(sources, {1, 2, 13})
+
+        for expression in ["s1 +", "x + s1", "1 + 2", "s1.real", "__import__('os')",
+                "s1 if s2 else 0", "'a' * s1", "abs(x=s1)"]:
+            with self.assertRaises(ValueError):
+                virtual.compile_expression(expression)
+
+
+    def test_validate(self):
+        virtual.validate(None, "s1 * s2")
+        for expression in ["s3 + s1", "s99", 5]:
+            with self.assertRaises(ValueError):
+                virtual.validate(None, expression)
+        with self.assertRaises(ValueError):
+            virtual.validate(1, "s1 + s2")
+
+
+    def test_sensor_post(self):
+        post = lambda data: self.client.post("/api/sensor", json=data)
+        self.assertEqual(post({"name" : "Avg", "expression" : "(s1 + s2) / 2"}).status_code, 200)
+        self.assertEqual(post({"name" : "Bad", "expression" : "s1 +"}).status_code, 400)
+        self.assertEqual(post({"name" : "Bad", "expression" : "s3"}).status_code, 400)
+
+        # virtual sensors have no readings of their own
+        response = self.client.post("/api/sensor/reading", json={"sensor_id" : 3, "value" : 1})
+        self.assertEqual(response.status_code, 400)
+
+
+    def test_readings(self):
+        # 60 buckets of 60 seconds, A averages to 1, B to the bucket index
+        entries = self.get_readings(3)
+        self.assertEqual(len(entries), 60)
+        self.assertEqual(entries[0], {"datetime" : "2021-09-11T12:00:00Z", "value" : 1.0})
+        self.assertEqual(entries[10]["value"], 11.0)
+
+        # constants are floats, huge powers overflow to null instead of growing integers
+        huge = self.client.post("/api/sensor", json={"name" : "Huge", "expression" : "s1 + 9**9**9**9"})
+        self.assertEqual(huge.status_code, 200)
+        self.assertTrue(all(e["value"] is None for e in self.get_readings(huge.get_json()["id"])))
+        self.assertEqual(self.client.post("/api/sensor", json={"name" : "Bad",
+            "expression" : "s1 + 1" + "0" * 400}).status_code, 400)
+
+        # only buckets with readings of all sources
+        db.session.query(models.SensorReading).filter(models.SensorReading.sensor_id == 1,
+            models.SensorReading.datetime < self.start + datetime.timedelta(minutes=5)).delete()
+        db.session.commit()
+        virtual.invalidate()
+        self.assertEqual(len(self.get_readings(3)), 55)
+
+
+    def test_memoize(self):
+        self.get_readings(3)
+        self.assertGreater(len(self.app.extensions["virtual"].get()._blocks), 0)
+
+        # memoized results are used even if the sources change behind the api's back
+        db.session.query(models.SensorReading).update({"value" : 0.0})
+        db.session.commit()
+        self.assertEqual(self.get_readings(3)[10]["value"], 11.0)
+
+        # changes through the api invalidate the memo
+        response = self.client.put("/api/sensor/reading", json={"sensor_id" : 2, "value" : 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_readings(3)[10]["value"], 5.0)
+
+        # changed expression
+        response = self.client.put("/api/sensor/3", json={"expression" : "s1 - s2"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_readings(3)[10]["value"], -5.0)
+
+
+    def test_other_process(self):
+        self.app.extensions["virtual"].check_seconds = 0
+        self.assertEqual(self.get_readings(3)[10]["value"], 11.0)
+
+        # changed by another process: memoized until the reading version changes
+        db.session.query(models.SensorReading).update({"value" : 0.0})
+        db.session.commit()
+        self.assertEqual(self.get_readings(3)[10]["value"], 11.0)
+        registry.bump_version(virtual.READING)
+        db.session.commit()
+        self.assertEqual(self.get_readings(3)[10]["value"], 0.0)
+
+
+    def test_changed_version(self):
+        post = lambda data: self.client.post("/api/sensor/reading", json=data)
+        # readings of the current block do not affect memoized results
+        self.assertEqual(post({"sensor_id" : 1, "value" : 1}).status_code, 200)
+        self.assertEqual(registry.get_version(virtual.READING), 0)
+        # nor do readings of sensors without virtual sensors
+        other = self.client.post("/api/sensor", json={"name" : "Other"}).get_json()["id"]
+        self.assertEqual(post({"sensor_id" : other, "value" : 1, "datetime" : 1631361600}).status_code, 200)
+        self.assertEqual(registry.get_version(virtual.READING), 0)
+
+        # backfills and edits of sources do
+        self.assertEqual(post({"sensor_id" : 1, "value" : 1, "datetime" : 1631361600}).status_code, 200)
+        self.assertEqual(registry.get_version(virtual.READING), 1)
+        reading = models.SensorReading.query.filter_by(sensor_id=2).first()
+        self.client.put("/api/sensor/reading/{}".format(reading.id), json={"value" : 3})
+        self.client.delete("/api/sensor/reading/{}".format(reading.id))
+        self.assertEqual(registry.get_version(virtual.READING), 3)